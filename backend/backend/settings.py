@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,8 +44,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so request timings include the other middleware
+    'repoanalyze.metrics.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise, async-capable so ASGI requests aren't serialized on one thread
+    'repoanalyze.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,6 +94,20 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # writers (job threads renewing leases, recovery claiming jobs)
+            # wait for each other instead of failing with "database is
+            # locked" when a read lock can't be upgraded
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than the shared-cache in-memory default, whose table
+        # locks fail at once instead of waiting out the timeout; job threads
+        # write while tests poll
+        'TEST': {
+            'NAME': os.path.join(tempfile.gettempdir(), f'repoanalyze-test-{os.getpid()}.sqlite3'),
+        },
     }
 }
 
@@ -136,3 +154,102 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Repository clone cache
+# Clones are shared between requests and worker processes; least recently
+# used entries are evicted once the cache grows past REPO_CACHE_MAX_BYTES.
+
+REPO_CACHE_DIR = os.environ.get('REPO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'repo_analyzer'))
+REPO_CACHE_MAX_BYTES = int(os.environ.get('REPO_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+# Seconds a cached clone is trusted before `git ls-remote` checks it again
+REPO_FRESHNESS_TTL = int(os.environ.get('REPO_FRESHNESS_TTL', 300))
+
+# Clone without file contents (--filter=blob:none) or a working tree; the
+# blobs an endpoint reads are fetched on demand
+REPO_PARTIAL_CLONE = os.environ.get('REPO_PARTIAL_CLONE', 'True') == 'True'
+
+# Accept file:// blob links (repositories on this server's disk) for
+# docstring generation. Only the benchmark command and the tests turn this
+# on; a client could otherwise read any repository on the server.
+DOCSTRINGS_ALLOW_FILE_URLS = False
+
+# File listings are cached per commit as JSON under REPO_CACHE_DIR/trees;
+# this many are kept, least recently used evicted first
+TREE_CACHE_MAX_FILES = int(os.environ.get('TREE_CACHE_MAX_FILES', 1000))
+# Likewise for dependency results, under REPO_CACHE_DIR/deps
+DEPENDENCY_CACHE_MAX_FILES = int(os.environ.get('DEPENDENCY_CACHE_MAX_FILES', 1000))
+
+# Threads per worker process that async views hand blocking work to (object
+# reads, SQLite, model calls, file reads); git clones, fetches and logs run as
+# asyncio subprocesses and never hold one
+ASYNC_WORKER_THREADS = int(os.environ.get('ASYNC_WORKER_THREADS', 32))
+
+# Background jobs (docstring/documentation generation) run in this many
+# threads per worker process. A job whose worker hasn't renewed its lease
+# for JOB_LEASE_SECONDS (the process died or hung) is re-run by another.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 60))
+
+# Model backend: 'gemini', 'http' (an OpenAI-compatible chat completions
+# server at LLM_HTTP_URL, e.g. llama.cpp or vLLM) or 'stub' (deterministic
+# offline answers after LLM_STUB_LATENCY seconds). LLM_MODEL overrides the
+# backend's default model name.
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'gemini')
+LLM_MODEL = os.environ.get('LLM_MODEL', '')
+LLM_HTTP_URL = os.environ.get('LLM_HTTP_URL', '')
+LLM_HTTP_API_KEY = os.environ.get('LLM_HTTP_API_KEY', '')
+LLM_STUB_LATENCY = float(os.environ.get('LLM_STUB_LATENCY', 0.5))
+
+# Model calls are queued fairly between clients (by IP) and share one budget
+# across all worker processes on the host: requests and tokens per minute
+# matching the API quota, and requests per minute per client (0 = no limit).
+# LLM_CONCURRENCY caps calls in flight per worker process. Interactive
+# requests give up after LLM_QUEUE_TIMEOUT seconds in the queue; background
+# jobs wait their turn. Then the per-call timeout in seconds, and retries on
+# rate limits / transient errors
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', 4))
+LLM_RPM = int(os.environ.get('LLM_RPM', 0))
+LLM_TPM = int(os.environ.get('LLM_TPM', 0))
+LLM_CLIENT_RPM = int(os.environ.get('LLM_CLIENT_RPM', 0))
+LLM_QUEUE_TIMEOUT = int(os.environ.get('LLM_QUEUE_TIMEOUT', 120))
+# Clients are told apart by IP. Behind this many reverse proxies, each
+# appending to X-Forwarded-For, the client is the entry the outermost one
+# added; with 0 the header (which any client can set) is ignored
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+# Synchronous docstring requests with more files than this are batch work
+LLM_INTERACTIVE_MAX_FILES = int(os.environ.get('LLM_INTERACTIVE_MAX_FILES', 20))
+LLM_TIMEOUT = int(os.environ.get('LLM_TIMEOUT', 60))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 3))
+
+# Generated docstrings are cached by file content + prompt/model settings
+LLM_CACHE_MAX_BYTES = int(os.environ.get('LLM_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+
+# Docstring requests pack definitions from many files into one prompt, up to
+# these estimated input/output token budgets (output must fit max_output_tokens)
+LLM_PACK_INPUT_TOKENS = int(os.environ.get('LLM_PACK_INPUT_TOKENS', 6000))
+LLM_PACK_OUTPUT_TOKENS = int(os.environ.get('LLM_PACK_OUTPUT_TOKENS', 1800))
+
+# Sphinx builds: worker processes, extra builds allowed to wait for one,
+# parallel readers per build ('auto' = one per CPU), build timeout in
+# seconds, and how many finished builds and per-repository workspaces are
+# kept on disk
+DOCS_BUILD_WORKERS = int(os.environ.get('DOCS_BUILD_WORKERS', 2))
+DOCS_BUILD_QUEUE = int(os.environ.get('DOCS_BUILD_QUEUE', 8))
+DOCS_BUILD_JOBS = os.environ.get('DOCS_BUILD_JOBS', 'auto')
+DOCS_BUILD_TIMEOUT = int(os.environ.get('DOCS_BUILD_TIMEOUT', 300))
+DOCS_CACHE_MAX_BUILDS = int(os.environ.get('DOCS_CACHE_MAX_BUILDS', 50))
+DOCS_CACHE_MAX_WORKSPACES = int(os.environ.get('DOCS_CACHE_MAX_WORKSPACES', 10))
+
+# Documentation ZIPs are streamed from the build directory on download; set
+# to True to also write each build's archive once so downloads can resume
+DOCS_PREBUILD_ZIP = os.environ.get('DOCS_PREBUILD_ZIP', 'False') == 'True'
+
+# Processes used to parse Python files when inferring dependencies from
+# imports (repos without a manifest)
+IMPORT_SCAN_WORKERS = int(os.environ.get('IMPORT_SCAN_WORKERS', os.cpu_count() or 2))
+
+# Parsed imports are cached per blob SHA in REPO_CACHE_DIR/imports.sqlite3;
+# this many blobs are kept, least recently used evicted first
+IMPORT_CACHE_MAX_BLOBS = int(os.environ.get('IMPORT_CACHE_MAX_BLOBS', 100000))
@@ -17,7 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from repoanalyze.views import metrics_endpoint
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('repoanalyze/', include('repoanalyze.urls'))
+    path('repoanalyze/', include('repoanalyze.urls')),
+    path('metrics', metrics_endpoint, name='metrics'),
 ]
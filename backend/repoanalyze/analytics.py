@@ -0,0 +1,226 @@
+"""
+Repository analytics: per-author totals, file churn and weekly activity.
+
+Aggregates come from a single streamed `git log --numstat` pass and are
+stored per repository together with the SHA they were computed at. A later
+request only folds in the commits since that SHA (`git log <last>..<head>`),
+so an active repository costs as much as its new commits. If history was
+rewritten and the stored SHA is no longer an ancestor of the head, the
+aggregates are rebuilt. Memory grows with the number of authors, files and
+weeks, never with the number of commits.
+
+The first run needs the full history, so a shallow cached clone is
+unshallowed first. Merge commits are left out, as their diffs repeat the
+changes of the merged branch.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+
+from . import metrics
+from .files import write_json
+from .history import HistoryError, iter_log
+from .repo_cache import CloneError, cache_key, deepen_async, is_shallow, open_repo_async
+from .singleflight import AsyncSingleFlight
+from .threads import run_in_thread, run_sync
+
+# Bump when the stored aggregates change shape
+ANALYTICS_VERSION = 1
+
+DEFAULT_TOP = 20
+MAX_TOP = 500
+# Aggregates kept in memory so a repeated request skips reading the JSON file
+MEMORY_CACHE_SIZE = 8
+
+_lock = threading.Lock()
+_recent = OrderedDict()
+_inflight = AsyncSingleFlight()
+
+
+def empty_stats() -> dict:
+    return {
+        'version': ANALYTICS_VERSION,
+        'head': None,
+        'commits': 0,
+        'added': 0,
+        'deleted': 0,
+        'authors': {},
+        'files': {},
+        'weeks': {},
+    }
+
+
+def _later(a: str, b: str) -> bool:
+    return datetime.fromisoformat(a) > datetime.fromisoformat(b)
+
+
+def fold(stats: dict, commit):
+    """Add one commit (parsed with numstat) to the aggregates"""
+    added, deleted = commit.added or 0, commit.deleted or 0
+    stats['commits'] += 1
+    stats['added'] += added
+    stats['deleted'] += deleted
+
+    key = commit.email.lower() or commit.author
+    author = stats['authors'].get(key)
+    if author is None:
+        author = stats['authors'][key] = {
+            'name': commit.author, 'email': commit.email, 'commits': 0, 'added': 0, 'deleted': 0,
+            'first': commit.date, 'last': commit.date,
+        }
+    author['commits'] += 1
+    author['added'] += added
+    author['deleted'] += deleted
+    if _later(commit.date, author['last']):
+        # Report the name the author uses most recently
+        author['last'], author['name'] = commit.date, commit.author
+    elif _later(author['first'], commit.date):
+        author['first'] = commit.date
+
+    year, week, _ = datetime.fromisoformat(commit.date).isocalendar()
+    activity = stats['weeks'].setdefault(f"{year}-W{week:02d}", {'commits': 0, 'added': 0, 'deleted': 0})
+    activity['commits'] += 1
+    activity['added'] += added
+    activity['deleted'] += deleted
+
+    for change in commit.files or []:
+        churn = stats['files'].setdefault(change['path'], {'commits': 0, 'added': 0, 'deleted': 0})
+        churn['commits'] += 1
+        churn['added'] += change['added'] or 0
+        churn['deleted'] += change['deleted'] or 0
+
+
+# =============================================================================
+# STORAGE
+# =============================================================================
+
+def _stats_path(repo_key: str) -> str:
+    stats_dir = os.path.join(settings.REPO_CACHE_DIR, 'analytics')
+    os.makedirs(stats_dir, exist_ok=True)
+    return os.path.join(stats_dir, f"{hashlib.sha256(repo_key.encode()).hexdigest()[:32]}.json")
+
+
+def _load(repo_key: str) -> dict:
+    try:
+        with open(_stats_path(repo_key), 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return stats if stats.get('version') == ANALYTICS_VERSION else None
+
+
+def _save(repo_key: str, stats: dict):
+    try:
+        write_json(_stats_path(repo_key), stats, separators=(',', ':'))
+    except OSError as e:
+        print(f"Could not save analytics for {repo_key}: {e}")
+
+
+def _remember(repo_key: str, stats: dict):
+    with _lock:
+        _recent[repo_key] = stats
+        _recent.move_to_end(repo_key)
+        while len(_recent) > MEMORY_CACHE_SIZE:
+            _recent.popitem(last=False)
+
+
+# =============================================================================
+# UPDATES
+# =============================================================================
+
+def _is_ancestor(repo_path: str, ancestor: str, commit: str) -> bool:
+    cmd = ['git', '-C', repo_path, 'merge-base', '--is-ancestor', ancestor, commit]
+    metrics.git_started(cmd)
+    result = subprocess.run(cmd, capture_output=True, timeout=30)
+    return result.returncode == 0
+
+
+def _refresh(repo) -> dict:
+    """
+    Bring the stored aggregates up to the repo's head.
+
+    Returns None if that needs history the shallow clone doesn't have.
+    """
+    with _lock:
+        stats = _recent.get(repo.key)
+    if stats and stats['head'] == repo.sha:
+        metrics.cache_lookup('analytics', 'hit')
+        return stats
+
+    # Folded into in place below, so always start from a fresh copy
+    stats = _load(repo.key)
+    if stats and stats['head'] == repo.sha:
+        _remember(repo.key, stats)
+        metrics.cache_lookup('analytics', 'hit')
+        return stats
+
+    if stats and _is_ancestor(repo.path, stats['head'], repo.sha):
+        revs = [f"{stats['head']}..{repo.sha}"]
+        metrics.cache_lookup('analytics', 'incremental')
+    elif not is_shallow(repo.path):
+        stats, revs = empty_stats(), [repo.sha]
+        metrics.cache_lookup('analytics', 'miss')
+    else:
+        return None
+
+    with metrics.stage('analytics_fold'):
+        for commit in iter_log(repo.path, revs, numstat=True, merges=False):
+            fold(stats, commit)
+    stats['head'] = repo.sha
+    _save(repo.key, stats)
+    _remember(repo.key, stats)
+    return stats
+
+
+async def _update(url: str, branch: str = None) -> dict:
+    for _ in range(2):
+        async with open_repo_async(url, branch=branch) as repo:
+            # Folding the log is CPU work; a fold that outlives its request still stores its result
+            stats = await run_in_thread(_refresh, repo)
+        if stats:
+            return stats
+        # Unshallowing takes the entry's exclusive lock, so it can't happen inside open_repo
+        if not await deepen_async(url, branch=branch):
+            break
+    raise HistoryError("Could not fetch the repository's full history")
+
+
+async def get_stats_async(url: str, branch: str = None) -> dict:
+    """Up-to-date aggregates for a repository; concurrent requests share one update"""
+    try:
+        key = cache_key(url, branch)
+    except ValueError as e:
+        raise CloneError(str(e))
+    return await _inflight.do(key, lambda: _update(url, branch))
+
+
+def get_stats(url: str, branch: str = None) -> dict:
+    """get_stats_async for blocking code"""
+    return run_sync(get_stats_async(url, branch))
+
+
+def summarize(stats: dict, top: int = DEFAULT_TOP) -> dict:
+    """Response view of the aggregates: totals, top authors, churn hotspots and the weekly series"""
+    top = max(1, min(top, MAX_TOP))
+    authors = sorted(stats['authors'].values(), key=lambda a: (-a['commits'], a['name']))
+    hotspots = sorted(
+        ({'path': path, **churn} for path, churn in stats['files'].items()),
+        key=lambda f: (-(f['added'] + f['deleted']), f['path']),
+    )
+    return {
+        'commit': stats['head'],
+        'commits': stats['commits'],
+        'added': stats['added'],
+        'deleted': stats['deleted'],
+        'total_authors': len(authors),
+        'total_files': len(hotspots),
+        'authors': authors[:top],
+        'hotspots': hotspots[:top],
+        'weekly': [{'week': week, **stats['weeks'][week]} for week in sorted(stats['weeks'])],
+    }
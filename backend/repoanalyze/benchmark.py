@@ -0,0 +1,504 @@
+"""
+Offline, reproducible benchmarks for every repoanalyze endpoint.
+
+A synthetic repository is written with `git fast-import` (fixed authors,
+dates and seeded contents, so its SHAs are the same on every run) and served
+from a local bare repo over file://. The model backend is swapped for the
+stub (llm.StubBackend), which answers deterministically after a
+configurable delay, so nothing touches the network or an API quota.
+
+Requests go straight into the ASGI application, as a server would send
+them, at each concurrency level. Every scenario reports latency
+percentiles, throughput, status codes and the peak RSS of the process and
+its children (git, the Sphinx pool) while it ran. Run it with
+`python manage.py benchmark`.
+"""
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+
+import django
+
+# =============================================================================
+# SYNTHETIC REPOSITORIES
+# =============================================================================
+
+AUTHORS = [
+    ('Ada Lovelace', 'ada@example.com'),
+    ('Grace Hopper', 'grace@example.com'),
+    ('Linus Torvalds', 'linus@example.com'),
+    ('Margaret Hamilton', 'margaret@example.com'),
+    ('Guido van Rossum', 'guido@example.com'),
+]
+# First commit time; every later commit is six hours after the previous one
+EPOCH = 1_600_000_000
+COMMIT_INTERVAL = 6 * 3600
+
+# Third-party packages imported by the generated modules (and listed in the manifests)
+PACKAGES = [
+    ('requests', '2.31.0'), ('numpy', '1.26.4'), ('flask', '3.0.2'), ('click', '8.1.7'),
+    ('pyyaml', '6.0.1'), ('jinja2', '3.1.3'), ('sqlalchemy', '2.0.28'), ('pydantic', '2.6.4'),
+]
+IMPORT_NAMES = {'pyyaml': 'yaml'}
+NPM_PACKAGES = [('react', '^18.2.0'), ('axios', '^1.6.7'), ('lodash', '^4.17.21')]
+
+
+def _render_requirements(packages: list) -> str:
+    return ''.join(f"{name}=={version}\n" for name, version in packages)
+
+
+def _render_pyproject(packages: list) -> str:
+    deps = ''.join(f'    "{name}>={version}",\n' for name, version in packages)
+    return f'[project]\nname = "synthetic"\nversion = "0.1.0"\ndependencies = [\n{deps}]\n'
+
+
+def _render_setup_cfg(packages: list) -> str:
+    deps = ''.join(f"    {name}>={version}\n" for name, version in packages)
+    return f"[metadata]\nname = synthetic\n\n[options]\ninstall_requires =\n{deps}"
+
+
+def _render_package_json(packages: list) -> str:
+    return json.dumps({'name': 'synthetic', 'version': '0.1.0', 'dependencies': dict(NPM_PACKAGES)}, indent=2)
+
+
+# Manifest file name -> renderer; repositories without one exercise the import scanner
+MANIFESTS = {
+    'requirements.txt': _render_requirements,
+    'pyproject.toml': _render_pyproject,
+    'setup.cfg': _render_setup_cfg,
+    'package.json': _render_package_json,
+}
+
+
+@dataclass
+class RepoSpec:
+    files: int = 200
+    commits: int = 100
+    manifests: tuple = ('requirements.txt',)
+    seed: int = 0
+    name: str = 'synthetic'
+
+
+def _python_module(rng: random.Random, index: int) -> str:
+    """An undocumented module with a class and a few functions"""
+    imported = rng.sample(PACKAGES, 2)
+    lines = ['import os', 'import json']
+    lines += [f"import {IMPORT_NAMES.get(name, name)}" for name, _ in imported]
+    lines += ['', '', f"LIMIT_{index} = {rng.randint(1, 1000)}", '', '']
+    lines += [
+        f"class Widget{index}:",
+        '    def __init__(self, value):',
+        '        self.value = value',
+        '',
+        '    def scaled(self, factor):',
+        '        return self.value * factor',
+        '',
+    ]
+    for n in range(rng.randint(2, 6)):
+        lines += _function(rng, f"helper_{index}_{n}")
+    return '\n'.join(lines) + '\n'
+
+
+def _function(rng: random.Random, name: str) -> list:
+    body = rng.choice([
+        ['    total = 0', '    for item in items:', '        total += item', '    return total'],
+        ['    return [item for item in items if item]'],
+        ['    seen = {}', '    for item in items:', '        seen[item] = seen.get(item, 0) + 1', '    return seen'],
+    ])
+    return ['', f"def {name}(items):", *body, '']
+
+
+def _file_path(rng: random.Random, index: int, spec: RepoSpec) -> str:
+    # Most files are Python modules spread over a few packages
+    if index % 5 == 4:
+        return f"docs/page_{index}.md"
+    package = f"pkg{index % max(1, spec.files // 50)}"
+    return f"src/{package}/module_{index}.py"
+
+
+def _fast_import_stream(spec: RepoSpec) -> bytes:
+    rng = random.Random(spec.seed)
+    contents = {}
+    for index in range(spec.files):
+        path = _file_path(rng, index, spec)
+        contents[path] = (_python_module(rng, index) if path.endswith('.py')
+                          else f"# Page {index}\n\nSynthetic documentation page.\n")
+    for manifest in spec.manifests:
+        contents[manifest] = MANIFESTS[manifest](PACKAGES)
+
+    stream = []
+
+    def data(text: str):
+        raw = text.encode('utf-8')
+        stream.append(f"data {len(raw)}\n".encode() + raw + b'\n')
+
+    python_files = sorted(path for path in contents if path.endswith('.py'))
+    for number in range(max(1, spec.commits)):
+        name, email = AUTHORS[number % len(AUTHORS)]
+        when = EPOCH + number * COMMIT_INTERVAL
+        stream.append(f"commit refs/heads/main\nauthor {name} <{email}> {when} +0000\n"
+                      f"committer {name} <{email}> {when} +0000\n".encode())
+        if number == 0:
+            data('Initial import')
+            changed = sorted(contents)
+        else:
+            changed = rng.sample(python_files, min(len(python_files), rng.randint(1, 3)))
+            for path in changed:
+                contents[path] += '\n'.join(_function(rng, f"change_{number}_{rng.randint(0, 999)}")) + '\n'
+            data(f"Update {', '.join(os.path.basename(path) for path in changed)}")
+        for path in changed:
+            stream.append(f"M 100644 inline {path}\n".encode())
+            data(contents[path])
+        stream.append(b'\n')
+    return b''.join(stream)
+
+
+def make_repo(root: str, spec: RepoSpec) -> str:
+    """
+    Write the synthetic repository as a bare repo under root and return its path.
+
+    A `<name>` symlink is made next to `<name>.git`, since the blob links the
+    file listing returns drop the .git suffix.
+    """
+    path = os.path.join(root, f"{spec.name}.git")
+    subprocess.run(['git', 'init', '--quiet', '--bare', '--initial-branch=main', path], check=True)
+    subprocess.run(['git', '-C', path, 'fast-import', '--quiet'], input=_fast_import_stream(spec), check=True)
+    # Like GitHub: allow partial clones and fetching single blobs by SHA
+    for key in ('uploadpack.allowFilter', 'uploadpack.allowAnySHA1InWant'):
+        subprocess.run(['git', '-C', path, 'config', key, 'true'], check=True)
+    os.symlink(path, os.path.join(root, spec.name))
+    return path
+
+
+# =============================================================================
+# ASGI CLIENT
+# =============================================================================
+
+@dataclass
+class Response:
+    status: int
+    headers: dict
+    body: bytes
+    seconds: float
+
+    def json(self) -> dict:
+        return json.loads(self.body)
+
+
+async def asgi_request(app, method: str, path: str, body=None) -> Response:
+    """Send one request through the ASGI application and read the whole response"""
+    path, _, query = path.partition('?')
+    payload = json.dumps(body).encode() if body is not None else b''
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(payload)).encode()), (b'accept-encoding', b'gzip, br')],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    sent = False
+    status, headers, chunks = None, {}, []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': payload, 'more_body': False}
+        # The client never disconnects; Django cancels this once it responds
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            headers.update((k.decode().lower(), v.decode()) for k, v in message['headers'])
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    return Response(status, headers, b''.join(chunks), time.perf_counter() - started)
+
+
+# =============================================================================
+# MEASUREMENT
+# =============================================================================
+
+def _rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid: int) -> list:
+    found = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                found.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return found
+
+
+def tree_rss(pid: int = None) -> int:
+    """Resident memory of a process and all of its descendants (Linux /proc)"""
+    total, pending = 0, [pid or os.getpid()]
+    while pending:
+        current = pending.pop()
+        total += _rss(current)
+        pending.extend(_children(current))
+    return total
+
+
+def max_rss() -> dict:
+    """Peak RSS since start, from getrusage (children only count once they have exited)"""
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit,
+    }
+
+
+class RssSampler:
+    """Samples tree_rss() on a thread and keeps the peak"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = tree_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, tree_rss())
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+def summarize_latencies(latencies: list) -> dict:
+    values = sorted(latencies)
+    as_ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None
+    return {
+        'p50': as_ms(percentile(values, 50)),
+        'p95': as_ms(percentile(values, 95)),
+        'p99': as_ms(percentile(values, 99)),
+        'mean': as_ms(sum(values) / len(values)) if values else None,
+        'min': as_ms(values[0]) if values else None,
+        'max': as_ms(values[-1]) if values else None,
+    }
+
+
+# =============================================================================
+# SCENARIOS
+# =============================================================================
+
+API = '/repoanalyze/'
+
+
+@dataclass
+class Context:
+    """What setup learned about the synthetic repository, shared by the scenarios"""
+    root: str
+    repo_url: str
+    doc_batch: int = 5
+    files: list = field(default_factory=list)
+    build_id: str = None
+    job_id: str = None
+    _variants: int = 0
+    _next_file: int = 0
+
+    def fresh_url(self) -> str:
+        """A URL for the same repository that nothing has cached yet"""
+        self._variants += 1
+        link = os.path.join(self.root, 'variants', f"variant{self._variants}.git")
+        os.makedirs(os.path.dirname(link), exist_ok=True)
+        os.symlink(self.repo_url[len('file://'):], link)
+        return f"file://{link}"
+
+    def next_files(self) -> list:
+        """The next doc_batch files, so consecutive requests don't share cached results"""
+        batch = [self.files[(self._next_file + n) % len(self.files)] for n in range(self.doc_batch)]
+        self._next_file += self.doc_batch
+        return batch
+
+
+@dataclass
+class Scenario:
+    name: str
+    # request(ctx) -> (method, path, body)
+    request: object
+    # Cold scenarios have nothing cached, so they skip the warm-up request
+    cold: bool = False
+    # Slow scenarios (documentation builds) run fewer requests
+    slow: bool = False
+    # Called before each concurrency level
+    reset: object = None
+
+
+def _clear_llm_cache():
+    from .models import LLMResult
+    LLMResult.objects.all().delete()
+
+
+SCENARIOS = [
+    Scenario('get_files_from_repository',
+             lambda ctx: ('POST', f"{API}get_files_from_repository/", {'input': ctx.repo_url})),
+    Scenario('get_files_from_repository:clone',
+             lambda ctx: ('POST', f"{API}get_files_from_repository/", {'input': ctx.fresh_url()}), cold=True),
+    Scenario('get_dependencies',
+             lambda ctx: ('POST', f"{API}get_dependencies/", {'input': ctx.repo_url})),
+    Scenario('get_commit_history',
+             lambda ctx: ('POST', f"{API}get_commit_history/", {'input': ctx.repo_url, 'limit': 50})),
+    Scenario('get_commit_history:numstat',
+             lambda ctx: ('POST', f"{API}get_commit_history/", {'input': ctx.repo_url, 'limit': 50, 'numstat': True})),
+    Scenario('get_repository_analytics',
+             lambda ctx: ('POST', f"{API}get_repository_analytics/", {'input': ctx.repo_url})),
+    Scenario('generate_doc_strings',
+             lambda ctx: ('POST', f"{API}generate_doc_strings/", {'input': ctx.next_files()}),
+             cold=True, reset=_clear_llm_cache),
+    Scenario('generate_doc_strings:cached',
+             lambda ctx: ('POST', f"{API}generate_doc_strings/", {'input': ctx.files[:ctx.doc_batch]})),
+    Scenario('genDocument_from_docstr',
+             lambda ctx: ('POST', f"{API}genDocument_from_docstr/", {'input': ctx.fresh_url()}),
+             cold=True, slow=True),
+    Scenario('genDocument_from_docstr:cached',
+             lambda ctx: ('POST', f"{API}genDocument_from_docstr/", {'input': ctx.repo_url})),
+    Scenario('download_documentation',
+             lambda ctx: ('POST', f"{API}download_documentation/", {'input': ctx.build_id})),
+    Scenario('download_build',
+             lambda ctx: ('GET', f"{API}download_documentation/{ctx.build_id}/", None)),
+    Scenario('serve_docs',
+             lambda ctx: ('GET', f"{API}docs/{ctx.build_id}/index.html", None)),
+    Scenario('job_status',
+             lambda ctx: ('GET', f"{API}jobs/{ctx.job_id}/", None)),
+]
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def _expect(response: Response, what: str) -> dict:
+    if response.status != 200:
+        raise BenchmarkError(f"{what} failed with {response.status}: {response.body[:300]!r}")
+    return response.json()
+
+
+async def setup(app, ctx: Context):
+    """Warm the caches the scenarios share and collect the file links, build ID and job ID"""
+    listing = _expect(await asgi_request(app, 'POST', f"{API}get_files_from_repository/",
+                                         {'input': ctx.repo_url}), 'Listing files')
+    ctx.files = listing['output']
+    if not ctx.files:
+        raise BenchmarkError("The synthetic repository has no Python files")
+
+    build = _expect(await asgi_request(app, 'POST', f"{API}genDocument_from_docstr/",
+                                       {'input': ctx.repo_url}), 'Building documentation')
+    ctx.build_id = build['build_id']
+
+    job = await asgi_request(app, 'POST', f"{API}genDocument_from_docstr/", {'input': ctx.repo_url, 'async': True})
+    if job.status != 202:
+        raise BenchmarkError(f"Submitting a job failed with {job.status}")
+    ctx.job_id = job.json()['job_id']
+    while True:
+        status = _expect(await asgi_request(app, 'GET', f"{API}jobs/{ctx.job_id}/"), 'Job status')['status']
+        if status not in ('queued', 'running'):
+            break
+        await asyncio.sleep(0.05)
+
+
+async def run_level(app, scenario: Scenario, ctx: Context, concurrency: int, requests: int) -> dict:
+    """Send requests with at most concurrency in flight and summarize them"""
+    if scenario.reset:
+        await asyncio.to_thread(scenario.reset)
+    latencies, statuses, failures = [], {}, []
+    remaining = iter(range(requests))
+
+    async def client():
+        for _ in remaining:
+            method, path, body = scenario.request(ctx)
+            response = await asgi_request(app, method, path, body)
+            latencies.append(response.seconds)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+            if response.status >= 400 and not failures:
+                failures.append(response.body[:300].decode('utf-8', 'replace'))
+
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    errors = sum(count for status, count in statuses.items() if status >= 400)
+    return {
+        'scenario': scenario.name,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': errors,
+        'first_error': failures[0] if failures else None,
+        'status': {str(status): count for status, count in sorted(statuses.items())},
+        'latency_ms': summarize_latencies(latencies),
+        'throughput_rps': round(requests / elapsed, 2) if elapsed else None,
+        'wall_seconds': round(elapsed, 3),
+        'peak_rss_bytes': sampler.peak,
+    }
+
+
+async def run_scenarios(app, ctx: Context, scenarios: list, levels: list, requests: int, slow_requests: int,
+                        log=print) -> list:
+    await setup(app, ctx)
+    results = []
+    for scenario in scenarios:
+        if not scenario.cold:
+            method, path, body = scenario.request(ctx)
+            await asgi_request(app, method, path, body)
+        for concurrency in levels:
+            count = max(concurrency, slow_requests if scenario.slow else requests)
+            result = await run_level(app, scenario, ctx, concurrency, count)
+            latency = result['latency_ms']
+            log(f"{scenario.name:<34} c={concurrency:<3} p50={latency['p50']}ms p95={latency['p95']}ms "
+                f"p99={latency['p99']}ms {result['throughput_rps']} req/s errors={result['errors']}")
+            results.append(result)
+    return results
+
+
+def environment() -> dict:
+    git = subprocess.run(['git', '--version'], capture_output=True, text=True).stdout.strip()
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'git': git,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
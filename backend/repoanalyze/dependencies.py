@@ -0,0 +1,471 @@
+"""
+Dependency extraction from package manifests and lock files.
+
+Parsers are registered per file name and run in-process on blobs read from
+the git object store, so no checkout or subprocess is needed. Every
+manifest found in a commit's tree is parsed (not just the first), and the
+structured result is cached per commit SHA in memory and as JSON under
+REPO_CACHE_DIR (up to DEPENDENCY_CACHE_MAX_FILES results, least recently
+used evicted first), like tree listings. A repository with no manifest, or whose
+manifests declare no Python runtime dependency, also gets dependencies
+inferred from its imports (see imports.py).
+"""
+import ast
+import configparser
+import fnmatch
+import json
+import os
+import posixpath
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+
+from django.conf import settings
+
+from . import imports, listing, metrics
+from .files import evict_files, write_json
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+# Bump when parsers change so cached results are recomputed
+PARSER_VERSION = 3
+RESULT_CACHE_SIZE = 64
+
+# Source reported for dependencies inferred from import statements
+IMPORTS_SOURCE = 'imports'
+
+RUNTIME, DEV, OPTIONAL, INDIRECT = 'runtime', 'dev', 'optional', 'indirect'
+
+
+@dataclass
+class Dependency:
+    name: str
+    spec: str
+    source: str
+    kind: str = RUNTIME
+    ecosystem: str = 'python'
+
+
+# =============================================================================
+# PARSER REGISTRY
+# =============================================================================
+
+# (file name pattern, ecosystem, parser(text, path, read) -> list of Dependency)
+_parsers = []
+
+
+def parser(*patterns: str, ecosystem: str):
+    """Register a parser for manifests whose file name matches any pattern"""
+    def decorator(fn):
+        for pattern in patterns:
+            _parsers.append((pattern, ecosystem, fn))
+        return fn
+    return decorator
+
+
+def find_parser(path: str):
+    """Return (ecosystem, parser) for a manifest path, or None"""
+    name = posixpath.basename(path)
+    for pattern, ecosystem, fn in _parsers:
+        if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern):
+            return ecosystem, fn
+    return None
+
+
+# =============================================================================
+# PYTHON
+# =============================================================================
+
+PEP508_RE = re.compile(r'^\s*(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*(?P<extras>\[[^\]]*\])?\s*(?P<spec>.*?)\s*$')
+
+
+def parse_pep508(requirement: str, source: str, kind: str = RUNTIME) -> Dependency:
+    match = PEP508_RE.match(requirement)
+    if not match:
+        return Dependency(requirement.strip(), '', source, kind)
+    spec = (match.group('extras') or '') + match.group('spec')
+    return Dependency(match.group('name'), spec.strip(), source, kind)
+
+
+def _requirements_kind(path: str) -> str:
+    name = path.lower()
+    return DEV if any(word in name for word in ('dev', 'test', 'lint', 'doc')) else RUNTIME
+
+
+def _logical_lines(text: str):
+    """Lines with comments removed and backslash continuations joined"""
+    pending = ''
+    for line in text.splitlines():
+        line = re.sub(r'(^|\s)#.*$', '', line).rstrip()
+        if line.endswith('\\'):
+            pending += line[:-1] + ' '
+            continue
+        line, pending = (pending + line).strip(), ''
+        if line:
+            yield line
+
+
+@parser('requirements*.txt', '*requirements.txt', '*requirements/*.txt', ecosystem='python')
+def parse_requirements(text: str, path: str, read, _seen=None) -> list:
+    seen = _seen if _seen is not None else set()
+    seen.add(path)
+    kind = _requirements_kind(path)
+    deps = []
+    for line in _logical_lines(text):
+        option = re.match(r'^(-r|--requirement)[=\s]\s*(\S+)$', line)
+        if option:
+            # Includes are resolved relative to the including file
+            included = posixpath.normpath(posixpath.join(posixpath.dirname(path), option.group(2)))
+            if included not in seen:
+                content = read(included)
+                if content is not None:
+                    deps.extend(parse_requirements(content, included, read, seen))
+            continue
+        editable = re.match(r'^(-e|--editable)[=\s]\s*(\S+)$', line)
+        if editable:
+            target = editable.group(2)
+            egg = re.search(r'#egg=([\w.-]+)', target)
+            deps.append(Dependency(egg.group(1) if egg else target, target, path, kind))
+            continue
+        if line.startswith('-'):
+            # -c constraints, --index-url, --hash and other options
+            continue
+        line = re.sub(r'\s--hash[=\s]\S+', '', line)
+        deps.append(parse_pep508(line, path, kind))
+    return deps
+
+
+def _poetry_spec(value) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        for key in ('version', 'git', 'path', 'url'):
+            if key in value:
+                return str(value[key])
+    return ''
+
+
+@parser('pyproject.toml', ecosystem='python')
+def parse_pyproject(text: str, path: str, read) -> list:
+    data = tomllib.loads(text)
+    deps = []
+
+    # PEP 621
+    project = data.get('project', {})
+    for requirement in project.get('dependencies', []):
+        deps.append(parse_pep508(requirement, path))
+    for requirements in project.get('optional-dependencies', {}).values():
+        deps.extend(parse_pep508(requirement, path, OPTIONAL) for requirement in requirements)
+    # PEP 735 dependency groups
+    for requirements in data.get('dependency-groups', {}).values():
+        deps.extend(parse_pep508(r, path, DEV) for r in requirements if isinstance(r, str))
+
+    # Poetry
+    poetry = data.get('tool', {}).get('poetry', {})
+    for name, value in poetry.get('dependencies', {}).items():
+        if name.lower() != 'python':
+            kind = OPTIONAL if isinstance(value, dict) and value.get('optional') else RUNTIME
+            deps.append(Dependency(name, _poetry_spec(value), path, kind))
+    for name, value in poetry.get('dev-dependencies', {}).items():
+        deps.append(Dependency(name, _poetry_spec(value), path, DEV))
+    for group in poetry.get('group', {}).values():
+        for name, value in group.get('dependencies', {}).items():
+            deps.append(Dependency(name, _poetry_spec(value), path, DEV))
+    return deps
+
+
+@parser('Pipfile', ecosystem='python')
+def parse_pipfile(text: str, path: str, read) -> list:
+    data = tomllib.loads(text)
+    deps = []
+    for section, kind in (('packages', RUNTIME), ('dev-packages', DEV)):
+        for name, value in data.get(section, {}).items():
+            spec = value if isinstance(value, str) else _poetry_spec(value)
+            deps.append(Dependency(name, '' if spec == '*' else spec, path, kind))
+    return deps
+
+
+@parser('Pipfile.lock', ecosystem='python')
+def parse_pipfile_lock(text: str, path: str, read) -> list:
+    data = json.loads(text)
+    deps = []
+    for section, kind in (('default', RUNTIME), ('develop', DEV)):
+        for name, value in data.get(section, {}).items():
+            deps.append(Dependency(name, value.get('version', ''), path, kind))
+    return deps
+
+
+@parser('poetry.lock', ecosystem='python')
+def parse_poetry_lock(text: str, path: str, read) -> list:
+    data = tomllib.loads(text)
+    deps = []
+    for package in data.get('package', []):
+        kind = DEV if package.get('category') == 'dev' else RUNTIME
+        deps.append(Dependency(package.get('name', ''), f"=={package.get('version', '')}", path, kind))
+    return deps
+
+
+def _cfg_list(value: str) -> list:
+    return [line.strip() for line in value.splitlines() if line.strip() and not line.strip().startswith('#')]
+
+
+@parser('setup.cfg', ecosystem='python')
+def parse_setup_cfg(text: str, path: str, read) -> list:
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_string(text)
+    deps = []
+    if config.has_section('options'):
+        for requirement in _cfg_list(config.get('options', 'install_requires', fallback='')):
+            deps.append(parse_pep508(requirement, path))
+        for requirement in _cfg_list(config.get('options', 'tests_require', fallback='')):
+            deps.append(parse_pep508(requirement, path, DEV))
+    if config.has_section('options.extras_require'):
+        for _, value in config.items('options.extras_require'):
+            deps.extend(parse_pep508(r, path, OPTIONAL) for r in _cfg_list(value))
+    return deps
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, SyntaxError, TypeError):
+        return None
+
+
+@parser('setup.py', ecosystem='python')
+def parse_setup_py(text: str, path: str, read) -> list:
+    """Read literal install_requires/extras_require from the setup() call (never executed)"""
+    deps = []
+    for node in ast.walk(ast.parse(text)):
+        if not isinstance(node, ast.Call):
+            continue
+        func = node.func.attr if isinstance(node.func, ast.Attribute) else getattr(node.func, 'id', '')
+        if func != 'setup':
+            continue
+        for keyword in node.keywords:
+            value = _literal(keyword.value)
+            if keyword.arg in ('install_requires', 'tests_require') and isinstance(value, (list, tuple)):
+                kind = RUNTIME if keyword.arg == 'install_requires' else DEV
+                deps.extend(parse_pep508(r, path, kind) for r in value if isinstance(r, str))
+            elif keyword.arg == 'extras_require' and isinstance(value, dict):
+                for requirements in value.values():
+                    if isinstance(requirements, str):
+                        requirements = [requirements]
+                    deps.extend(parse_pep508(r, path, OPTIONAL) for r in requirements if isinstance(r, str))
+    return deps
+
+
+# =============================================================================
+# JAVASCRIPT
+# =============================================================================
+
+@parser('package.json', ecosystem='npm')
+def parse_package_json(text: str, path: str, read) -> list:
+    data = json.loads(text)
+    deps = []
+    for section, kind in (('dependencies', RUNTIME), ('devDependencies', DEV),
+                          ('peerDependencies', OPTIONAL), ('optionalDependencies', OPTIONAL)):
+        for name, spec in (data.get(section) or {}).items():
+            deps.append(Dependency(name, str(spec), path, kind, 'npm'))
+    return deps
+
+
+@parser('package-lock.json', 'npm-shrinkwrap.json', ecosystem='npm')
+def parse_package_lock(text: str, path: str, read) -> list:
+    data = json.loads(text)
+    deps = []
+    packages = data.get('packages')
+    if packages:
+        # lockfileVersion 2/3: keyed by install path
+        for location, info in packages.items():
+            if not location:
+                continue
+            name = info.get('name') or location.rsplit('node_modules/', 1)[-1]
+            kind = DEV if info.get('dev') else RUNTIME
+            deps.append(Dependency(name, info.get('version', ''), path, kind, 'npm'))
+        return deps
+
+    # lockfileVersion 1: nested dependency tree
+    def walk(tree):
+        for name, info in (tree or {}).items():
+            kind = DEV if info.get('dev') else RUNTIME
+            deps.append(Dependency(name, info.get('version', ''), path, kind, 'npm'))
+            walk(info.get('dependencies'))
+    walk(data.get('dependencies'))
+    return deps
+
+
+YARN_VERSION_RE = re.compile(r'^\s+version:?\s+"?([^"\s]+)"?')
+
+
+@parser('yarn.lock', ecosystem='npm')
+def parse_yarn_lock(text: str, path: str, read) -> list:
+    """Yarn classic and berry lock files: one entry per resolved package"""
+    deps = []
+    name = None
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        if not line[0].isspace():
+            # "lodash@^4.17.0", lodash@^4.17.21:  /  "@scope/pkg@npm:^1.0.0":
+            first = line.rstrip(':').split(',')[0].strip().strip('"')
+            name = first[:first.index('@', 1)] if '@' in first[1:] else first
+            if name == '__metadata':
+                name = None
+            continue
+        match = YARN_VERSION_RE.match(line)
+        if name and match:
+            deps.append(Dependency(name, match.group(1), path, RUNTIME, 'npm'))
+            name = None
+    return deps
+
+
+# =============================================================================
+# GO
+# =============================================================================
+
+GO_REQUIRE_RE = re.compile(r'^(?P<module>\S+)\s+(?P<version>\S+)(?P<comment>\s*//.*)?$')
+
+
+@parser('go.mod', ecosystem='go')
+def parse_go_mod(text: str, path: str, read) -> list:
+    deps = []
+    in_block = False
+    for raw in text.splitlines():
+        line = raw.strip()
+        if in_block:
+            if line == ')':
+                in_block = False
+                continue
+            entry = line
+        elif line.startswith('require ('):
+            in_block = True
+            continue
+        elif line.startswith('require '):
+            entry = line[len('require '):].strip()
+        else:
+            continue
+        match = GO_REQUIRE_RE.match(entry)
+        if match:
+            indirect = 'indirect' in (match.group('comment') or '')
+            deps.append(Dependency(match.group('module'), match.group('version'), path,
+                                   INDIRECT if indirect else RUNTIME, 'go'))
+    return deps
+
+
+# =============================================================================
+# EXTRACTION + CACHE
+# =============================================================================
+
+_lock = threading.Lock()
+_results = OrderedDict()
+
+
+def _cache_dir() -> str:
+    cache_dir = os.path.join(settings.REPO_CACHE_DIR, 'deps')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def _cache_path(commit: str) -> str:
+    return os.path.join(_cache_dir(), f"{commit}-v{PARSER_VERSION}.json")
+
+
+def _extract(reader, commit: str, skip_dirs) -> dict:
+    entries = listing.filter_entries(listing.get_tree(reader, commit), skip_dirs=skip_dirs)
+    by_path = {entry.path: entry for entry in entries}
+    manifests = [entry for entry in entries if find_parser(entry.path)]
+    reader.prefetch(commit, [entry.sha for entry in manifests])
+
+    def read(path: str):
+        entry = by_path.get(path)
+        if entry is None:
+            return None
+        return reader.read_blob(entry.sha).decode('utf-8', 'replace')
+
+    deps, errors = OrderedDict(), []
+    for entry in manifests:
+        ecosystem, parse = find_parser(entry.path)
+        try:
+            # Included requirement files are reached both directly and via -r
+            for dep in parse(read(entry.path), entry.path, read):
+                deps.setdefault((dep.source, dep.name, dep.spec, dep.kind), dep)
+        except Exception as e:
+            errors.append({'source': entry.path, 'error': str(e)})
+
+    # No manifest, or Python ones that declare no runtime dependency (a
+    # pyproject.toml with only build settings, a requirements-dev.txt)
+    python = [dep for dep in deps.values() if dep.ecosystem == 'python']
+    python_manifests = any(find_parser(entry.path)[0] == 'python' for entry in manifests)
+    inferred = not manifests or python_manifests and not any(dep.kind == RUNTIME for dep in python)
+    if inferred:
+        python_files = [entry for entry in entries if entry.path.endswith('.py')]
+        declared = [dep.name for dep in python]
+        for name, _ in imports.scan(reader, commit, python_files, declared):
+            deps[(IMPORTS_SOURCE, name)] = Dependency(name, '', IMPORTS_SOURCE)
+    return {
+        'manifests': [entry.path for entry in manifests],
+        'dependencies': [asdict(dep) for dep in deps.values()],
+        'inferred': inferred,
+        'errors': errors,
+    }
+
+
+def extract(reader, commit: str, skip_dirs=()) -> dict:
+    """Dependencies declared in a commit's manifests: {manifests, dependencies, errors}"""
+    with _lock:
+        result = _results.get(commit)
+        if result is not None:
+            _results.move_to_end(commit)
+            metrics.cache_lookup('dependencies', 'hit')
+            return result
+
+    cache_file = _cache_path(commit)
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+        metrics.cache_lookup('dependencies', 'hit')
+        # Touch for LRU eviction
+        os.utime(cache_file)
+    except (OSError, ValueError):
+        metrics.cache_lookup('dependencies', 'miss')
+        with metrics.stage('dependency_parse'):
+            result = _extract(reader, commit, skip_dirs)
+        try:
+            write_json(cache_file, result)
+        except OSError as e:
+            print(f"Could not cache dependencies for {commit}: {e}")
+        evict_files(_cache_dir(), settings.DEPENDENCY_CACHE_MAX_FILES)
+
+    with _lock:
+        _results[commit] = result
+        while len(_results) > RESULT_CACHE_SIZE:
+            _results.popitem(last=False)
+    return result
+
+
+def format_text(result: dict) -> str:
+    """Plain-text rendering, grouped by manifest"""
+    sections = OrderedDict()
+    for dep in result['dependencies']:
+        sections.setdefault(dep['source'], []).append(dep)
+    if result['manifests']:
+        inferred = "# Inferred from imports (manifests declare no runtime dependency)"
+    else:
+        inferred = "# Inferred from imports (no manifest found)"
+    lines = []
+    for source, deps in sections.items():
+        lines.append(inferred if source == IMPORTS_SOURCE else f"# {source}")
+        for dep in deps:
+            spec = dep['spec']
+            # requirements style (name>=1.0) where the spec is an operator, else "name 1.0"
+            if spec and not spec.startswith(('<', '>', '=', '!', '~', '[', ';', '@')):
+                spec = f" {spec}"
+            kind = f"  ({dep['kind']})" if dep['kind'] != RUNTIME else ''
+            lines.append(f"{dep['name']}{spec}{kind}")
+        lines.append('')
+    return '\n'.join(lines)
@@ -0,0 +1,560 @@
+"""
+Sphinx documentation builds, cached by (repository, commit, build options).
+
+A finished build is published under REPO_CACHE_DIR/docs/builds/<key>/ and
+returned as-is whenever the same commit is requested again. Each repository
+also keeps one workspace (exported sources, generated .rst files, Sphinx
+doctrees and HTML output) that survives between commits. Files in the
+workspace are only rewritten when their content changes, so Sphinx's saved
+environment sees unchanged modules as up to date and re-reads only what
+actually moved.
+
+Both are evicted least recently used first (DOCS_CACHE_MAX_BUILDS,
+DOCS_CACHE_MAX_WORKSPACES). Their locks live under docs/locks/ so they
+outlast the directories they guard: a build is read under a shared lock
+and a workspace is built in under an exclusive one, and eviction skips
+anything locked rather than deleting it in use.
+
+Builds run in a dedicated process pool (DOCS_BUILD_WORKERS processes, at
+most DOCS_BUILD_QUEUE more waiting), never in the request thread, and every
+subprocess gets an explicit working directory, so concurrent builds of
+different repositories can't interfere with each other.
+
+Text assets are precompressed (brotli and gzip) when a build is published,
+so serving a page is just handing a file to the web server.
+"""
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import brotli
+from django.conf import settings
+
+from . import listing, metrics
+from .git_reader import get_reader
+from .repo_cache import FileLock, normalize_repo_url, open_repo
+from .singleflight import SingleFlight
+
+
+# Everything that changes the generated HTML besides the sources; part of the
+# cache key, so bump 'version' when the conf.py/index.rst templates change
+BUILD_OPTIONS = {
+    'version': 2,
+    'builder': 'html',
+    'theme': 'alabaster',
+    'extensions': ['sphinx.ext.autodoc', 'sphinx.ext.viewcode', 'sphinx.ext.napoleon'],
+}
+
+# Paths sphinx-apidoc never documents (relative to the exported sources)
+APIDOC_EXCLUDES = ['docs', 'venv', 'env', '__pycache__', 'setup.py']
+
+BUILD_META = 'build.json'
+
+# Precompressed variants are written next to each text asset
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.json', '.svg', '.txt', '.xml', '.map')
+COMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+MIN_COMPRESS_SIZE = 512
+
+
+class BuildQueueFull(Exception):
+    """Raised when the documentation build queue is full."""
+
+
+def _docs_root() -> str:
+    root = os.path.join(settings.REPO_CACHE_DIR, 'docs')
+    os.makedirs(os.path.join(root, 'builds'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'workspaces'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'locks'), exist_ok=True)
+    return root
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()[:16]
+
+
+def build_key(repo_url: str, commit: str, options: dict = None) -> str:
+    payload = json.dumps([normalize_repo_url(repo_url), commit, options or BUILD_OPTIONS], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def build_path(key: str) -> str:
+    return os.path.join(_docs_root(), 'builds', key)
+
+
+def workspace_path(repo_url: str) -> str:
+    return os.path.join(_docs_root(), 'workspaces', _digest(normalize_repo_url(repo_url)))
+
+
+def build_lock(key: str, shared: bool = False) -> FileLock:
+    """Readers of a build (pages, downloads) hold it shared; replacing or evicting it, exclusive"""
+    return FileLock(os.path.join(_docs_root(), 'locks', f"build-{key}.lock"), shared=shared)
+
+
+def _workspace_lock(name: str) -> FileLock:
+    return FileLock(os.path.join(_docs_root(), 'locks', f"workspace-{name}.lock"))
+
+
+def find_build(key: str) -> dict:
+    """Metadata of a finished build, or None if it hasn't been built"""
+    try:
+        with open(os.path.join(build_path(key), BUILD_META), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Touch for LRU eviction
+    try:
+        os.utime(os.path.join(build_path(key), BUILD_META))
+    except OSError:
+        pass
+    return meta
+
+
+def site_files(html_dir: str):
+    """Yield (relative path, absolute path) of a build's files, without compressed variants"""
+    for root, dirs, names in os.walk(html_dir):
+        dirs.sort()
+        for name in sorted(names):
+            full_path = os.path.join(root, name)
+            stem, ext = os.path.splitext(full_path)
+            if ext in COMPRESSED_SUFFIXES.values() and os.path.exists(stem):
+                continue
+            yield os.path.relpath(full_path, html_dir).replace(os.sep, '/'), full_path
+
+
+ZIP_NAME = 'documentation.zip'
+ZIP_CHUNK_SIZE = 256 * 1024
+
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable write target that hands out what zipfile has written so far"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _zip_info(rel_path: str, full_path: str) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo.from_file(full_path, rel_path)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def stream_zip(key: str):
+    """
+    Yield a ZIP of a build's HTML chunk by chunk.
+
+    Nothing is written to disk and at most one chunk of one file is held in
+    memory, however large the site is. The build is locked shared until the
+    stream is exhausted or closed, so it can't be evicted halfway through.
+    """
+    html_dir = os.path.join(build_path(key), 'html')
+    with build_lock(key, shared=True):
+        if not os.path.isdir(html_dir):
+            raise FileNotFoundError(f"Documentation build {key} was removed")
+        sink = _ZipSink()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for rel_path, full_path in site_files(html_dir):
+                with open(full_path, 'rb') as src, archive.open(_zip_info(rel_path, full_path), 'w') as dest:
+                    while True:
+                        chunk = src.read(ZIP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        data = sink.take()
+                        if data:
+                            yield data
+                data = sink.take()
+                if data:
+                    yield data
+        yield sink.take()
+
+
+def prebuilt_zip(key: str) -> str:
+    """Path of the build's archive on disk, or None if it was not prebuilt"""
+    zip_path = os.path.join(build_path(key), ZIP_NAME)
+    return zip_path if os.path.exists(zip_path) else None
+
+
+def _write_zip(build_dir: str):
+    zip_path = os.path.join(build_dir, ZIP_NAME)
+    with open(zip_path + '.tmp', 'wb') as f:
+        with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for rel_path, full_path in site_files(os.path.join(build_dir, 'html')):
+                archive.write(full_path, rel_path)
+    os.replace(zip_path + '.tmp', zip_path)
+
+
+def precompress(html_dir: str) -> int:
+    """Write .br and .gz variants of text assets; returns how many files were compressed"""
+    count = 0
+    for _, full_path in list(site_files(html_dir)):
+        if not full_path.endswith(COMPRESSIBLE_EXTENSIONS) or os.path.getsize(full_path) < MIN_COMPRESS_SIZE:
+            continue
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        mtime = os.stat(full_path).st_mtime
+        variants = {'.br': brotli.compress(data), '.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        for suffix, compressed in variants.items():
+            # Only worth keeping if it actually saves bytes
+            if len(compressed) < len(data):
+                with open(full_path + suffix, 'wb') as f:
+                    f.write(compressed)
+                os.utime(full_path + suffix, (mtime, mtime))
+        count += 1
+    return count
+
+
+# =============================================================================
+# WORKSPACE SYNC
+# =============================================================================
+
+def write_if_changed(path: str, data: bytes) -> bool:
+    """Write a file only if its content differs, keeping the mtime Sphinx compares"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def sync_tree(dest: str, files: dict, keep=()) -> int:
+    """
+    Make dest contain exactly the given {relative path: bytes} files.
+
+    Unchanged files are left alone; names in `keep` at the top level are
+    never removed. Returns the number of files written or removed.
+    """
+    changed = 0
+    for rel_path, data in files.items():
+        if write_if_changed(os.path.join(dest, *rel_path.split('/')), data):
+            changed += 1
+
+    for root, dirs, names in os.walk(dest, topdown=False):
+        for name in names:
+            rel_path = os.path.relpath(os.path.join(root, name), dest).replace(os.sep, '/')
+            if rel_path not in files and rel_path.split('/')[0] not in keep:
+                os.remove(os.path.join(root, name))
+                changed += 1
+        if root != dest and not os.listdir(root):
+            os.rmdir(root)
+    return changed
+
+
+# =============================================================================
+# BUILD
+# =============================================================================
+
+def render_conf(project: str) -> str:
+    return f'''# Configuration file for Sphinx documentation builder.
+import os
+import sys
+sys.path.insert(0, os.path.abspath('../src'))
+
+project = {project!r}
+copyright = '2024, RepoAnalyzer'
+author = 'RepoAnalyzer'
+
+extensions = {BUILD_OPTIONS['extensions']!r}
+
+templates_path = ['_templates']
+exclude_patterns = ['_build', 'Thumbs.db', '.DS_Store']
+
+html_theme = {BUILD_OPTIONS['theme']!r}
+html_static_path = ['_static']
+
+# Napoleon settings for Google/NumPy style docstrings
+napoleon_google_docstring = True
+napoleon_numpy_docstring = True
+'''
+
+
+def render_index(project: str, py_files: list) -> str:
+    index_content = f'''{project} Documentation
+{'=' * (len(project) + 14)}
+
+Welcome to the documentation for **{project}**.
+
+Project Overview
+----------------
+
+This documentation was auto-generated using RepoAnalyzer.
+
+Python Files in this Repository
+-------------------------------
+
+'''
+    # Add file tree
+    for py_file in sorted(py_files)[:30]:  # Limit display
+        index_content += f"* ``{py_file}``\n"
+
+    index_content += '''
+
+Module Documentation
+--------------------
+
+.. toctree::
+   :maxdepth: 2
+   :caption: Contents:
+
+   modules
+
+Indices and tables
+==================
+
+* :ref:`genindex`
+* :ref:`modindex`
+* :ref:`search`
+'''
+    return index_content
+
+
+def _apidoc(workspace: str) -> dict:
+    """Run sphinx-apidoc into a scratch directory and return the generated files"""
+    scratch = os.path.join(workspace, 'apidoc.tmp')
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    try:
+        subprocess.run([
+            'sphinx-apidoc',
+            '-f',  # Force overwrite
+            '-e',  # Separate pages for each module
+            '-o', scratch,  # Output directory
+            'src',  # Source directory
+            *[os.path.join('src', path) for path in APIDOC_EXCLUDES]  # Exclude
+        ], cwd=workspace, capture_output=True, timeout=60)
+        generated = {}
+        for name in os.listdir(scratch):
+            with open(os.path.join(scratch, name), 'rb') as f:
+                generated[name] = f.read()
+        return generated
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def build(repo_url: str, commit: str, project: str, sources: dict) -> dict:
+    """
+    Build HTML docs for one commit's {path: bytes} Python sources and publish them.
+
+    Returns the build metadata. Holds the repository's workspace lock, so
+    concurrent builds of the same repository run one after the other (and the
+    second one usually finds the first one's result).
+    """
+    key = build_key(repo_url, commit)
+    workspace = workspace_path(repo_url)
+
+    with _workspace_lock(os.path.basename(workspace)):
+        meta = find_build(key)
+        if meta:
+            return meta
+        os.makedirs(workspace, exist_ok=True)
+        # Touch for LRU eviction
+        os.utime(workspace)
+
+        # Sources: only changed modules get a new mtime
+        started = time.monotonic()
+        py_files = [path for path in sources if not path.rsplit('/', 1)[-1].startswith('_')]
+        changed = sync_tree(os.path.join(workspace, 'src'), sources)
+
+        # conf.py, index.rst and the apidoc pages, again only rewritten on change
+        docs_dir = os.path.join(workspace, 'docs')
+        with metrics.stage('sphinx_apidoc'):
+            pages = _apidoc(workspace)
+        pages['conf.py'] = render_conf(project).encode('utf-8')
+        pages['index.rst'] = render_index(project, py_files).encode('utf-8')
+        sync_tree(docs_dir, pages, keep=('_static', '_templates'))
+        os.makedirs(os.path.join(docs_dir, '_static'), exist_ok=True)
+        os.makedirs(os.path.join(docs_dir, '_templates'), exist_ok=True)
+
+        # Build HTML; the doctrees directory persists, so only outdated pages are re-read
+        with metrics.stage('sphinx_build'):
+            result = subprocess.run(
+                ['sphinx-build', '-b', BUILD_OPTIONS['builder'], '-j', str(settings.DOCS_BUILD_JOBS),
+                 '-d', os.path.join(workspace, 'doctrees'), '.', os.path.join(workspace, 'html')],
+                cwd=docs_dir, capture_output=True, text=True, timeout=settings.DOCS_BUILD_TIMEOUT,
+            )
+        print(f"Sphinx build output: {result.stdout}")
+        if result.stderr:
+            print(f"Sphinx build errors: {result.stderr}")
+        if not os.path.exists(os.path.join(workspace, 'html', 'index.html')):
+            raise RuntimeError(f"Sphinx build failed: {result.stderr.strip()[-500:]}")
+
+        # Publish a copy, so the next commit's build can't change what's being served
+        target = build_path(key)
+        staging = f"{target}.{os.getpid()}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        with metrics.stage('docs_publish'):
+            shutil.copytree(os.path.join(workspace, 'html'), os.path.join(staging, 'html'))
+            precompress(os.path.join(staging, 'html'))
+            if settings.DOCS_PREBUILD_ZIP:
+                # A file on disk can be served with Range requests (resumable downloads)
+                _write_zip(staging)
+        meta = {
+            'key': key,
+            'repo': normalize_repo_url(repo_url),
+            'commit': commit,
+            'files_documented': len(py_files),
+            'changed_files': changed,
+            'build_seconds': round(time.monotonic() - started, 2),
+            'built_at': time.time(),
+        }
+        with open(os.path.join(staging, BUILD_META), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        with build_lock(key):
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(staging, target)
+
+    evict(exclude=key)
+    evict_workspaces(exclude=os.path.basename(workspace))
+    return meta
+
+
+def _evict_lru(parent: str, entries: list, keep: int, exclude: str, lock_for, label: str):
+    """Remove the oldest of (mtime, name) entries beyond `keep`, skipping any that are locked"""
+    entries.sort(reverse=True)
+    for _, name in entries[keep:]:
+        if name == exclude:
+            continue
+        lock = lock_for(name)
+        # In use (being served, zipped or built); it goes on a later pass
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            print(f"Evicting docs {label}: {name}")
+            shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+        finally:
+            lock.release()
+
+
+def evict(exclude: str = None):
+    """Remove the least recently used builds beyond DOCS_CACHE_MAX_BUILDS"""
+    builds_dir = os.path.join(_docs_root(), 'builds')
+    builds = []
+    for name in os.listdir(builds_dir):
+        try:
+            builds.append((os.path.getmtime(os.path.join(builds_dir, name, BUILD_META)), name))
+        except OSError:
+            continue
+    _evict_lru(builds_dir, builds, settings.DOCS_CACHE_MAX_BUILDS, exclude, build_lock, 'build')
+
+
+def evict_workspaces(exclude: str = None):
+    """Remove the least recently built workspaces beyond DOCS_CACHE_MAX_WORKSPACES"""
+    workspaces_dir = os.path.join(_docs_root(), 'workspaces')
+    workspaces = []
+    for name in os.listdir(workspaces_dir):
+        try:
+            workspaces.append((os.path.getmtime(os.path.join(workspaces_dir, name)), name))
+        except OSError:
+            continue
+    _evict_lru(workspaces_dir, workspaces, settings.DOCS_CACHE_MAX_WORKSPACES, exclude,
+               _workspace_lock, 'workspace')
+
+
+# =============================================================================
+# BUILD POOL
+# =============================================================================
+
+_pool = None
+_pool_lock = threading.Lock()
+_queued = 0
+_inflight = SingleFlight()
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: forking a threaded server process can copy held locks
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.DOCS_BUILD_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def _build_repo(repo_url: str, project: str, skip_dirs) -> tuple:
+    """
+    Worker entry point: read the current commit's Python sources and build them.
+
+    Returns (meta, stages); the stage timings are recorded by the parent,
+    since metrics in a pool worker are never scraped.
+    """
+    with metrics.collect() as stages:
+        with open_repo(repo_url) as repo:
+            meta = find_build(build_key(repo_url, repo.sha))
+            if meta:
+                return meta, stages
+            reader = get_reader(repo.path)
+            entries = listing.filter_entries(listing.get_tree(reader, repo.sha), ['.py'], skip_dirs=skip_dirs)
+            with metrics.stage('read_sources'):
+                reader.prefetch(repo.sha, [entry.sha for entry in entries])
+                sources = {entry.path: reader.read_blob(entry.sha) for entry in entries}
+        return build(repo_url, repo.sha, project, sources), stages
+
+
+def _submit(repo_url: str, project: str, skip_dirs, queued) -> dict:
+    global _pool, _queued
+    with _pool_lock:
+        if _queued >= settings.DOCS_BUILD_WORKERS + settings.DOCS_BUILD_QUEUE:
+            raise BuildQueueFull("Too many documentation builds in progress, try again shortly")
+        _queued += 1
+    try:
+        if queued:
+            queued()
+        future = _get_pool().submit(_build_repo, repo_url, project, tuple(skip_dirs))
+        meta, stages = future.result()
+        for name, seconds in stages:
+            metrics.record(name, seconds)
+        return meta
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool next time
+        with _pool_lock:
+            _pool = None
+        raise
+    finally:
+        with _pool_lock:
+            _queued -= 1
+
+
+def build_in_pool(repo_url: str, commit: str, project: str, skip_dirs=(), queued=None) -> dict:
+    """
+    Build a repository's docs in the worker pool and return the build metadata.
+
+    Concurrent requests for the same build in this process share one pool
+    task; queued() is called once the caller's build has a place in the
+    pool. Raises BuildQueueFull when the pool is saturated.
+    """
+    key = build_key(repo_url, commit)
+    return _inflight.do(key, lambda: _submit(repo_url, project, skip_dirs, queued))
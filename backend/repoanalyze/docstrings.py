@@ -0,0 +1,299 @@
+"""
+AST-driven docstring generation.
+
+Instead of sending a whole file and asking for the whole file back, find the
+modules, classes and functions that lack a docstring, send only those
+definitions to the model, and splice the returned docstrings back into the
+original source at exact line offsets. Code that is already documented costs
+no tokens, and file size no longer matters.
+
+Definitions from many files are packed into one prompt up to an estimated
+token budget, so a repository of small modules takes a handful of requests
+instead of one per file. A pack whose answer can't be parsed is split in
+half and retried.
+"""
+import ast
+import contextvars
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from django.conf import settings
+
+# Functions longer than this are sent truncated; the signature matters most
+MAX_TARGET_CHARS = 4000
+# Rough size of one generated docstring, for the output budget
+DOCSTRING_TOKENS = 120
+# Fixed instructions wrapped around every pack
+PROMPT_OVERHEAD_TOKENS = 150
+
+FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+
+class SpliceError(Exception):
+    """Raised when the docstrings can't be spliced in without breaking the source."""
+
+
+@dataclass
+class Target:
+    id: str
+    kind: str
+    name: str
+    insert_line: int  # 1-based line the docstring is inserted before
+    indent: str
+    snippet: str
+
+
+def _first_line(node: ast.stmt) -> int:
+    """First line of a statement, counting its decorators"""
+    decorators = getattr(node, 'decorator_list', [])
+    return min([node.lineno] + [d.lineno for d in decorators])
+
+
+def _starts_line(node: ast.stmt, lines: list) -> bool:
+    """Whether a statement starts its own line (not after a `def ...:` on the same line)"""
+    # col_offset counts UTF-8 bytes
+    return not lines[node.lineno - 1].encode('utf-8')[:node.col_offset].strip()
+
+
+def _indent_of(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _class_outline(node: ast.ClassDef, lines: list) -> str:
+    """Class header plus member signatures; bodies are left out to save tokens"""
+    outline = [lines[node.lineno - 1]]
+    for child in node.body:
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            outline.append(lines[child.lineno - 1])
+        elif isinstance(child, (ast.Assign, ast.AnnAssign)):
+            outline.append(lines[child.lineno - 1])
+    return '\n'.join(outline)
+
+
+def find_undocumented(source: str) -> list:
+    """Return the definitions in source that have no docstring"""
+    tree = ast.parse(source)
+    lines = source.splitlines()
+    targets = []
+
+    if tree.body and ast.get_docstring(tree) is None:
+        first = tree.body[0]
+        summary = '\n'.join(lines[:40])
+        targets.append(Target('module', 'module', '<module>', _first_line(first), '', summary))
+
+    def visit(node, prefix=''):
+        for child in ast.iter_child_nodes(node):
+            if not isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                continue
+            qualname = f"{prefix}{child.name}"
+            body_start = child.body[0]
+            # A body on the signature's line (def f(): pass, or after a
+            # multi-line signature) can't take a docstring cleanly
+            if ast.get_docstring(child) is None and _starts_line(body_start, lines):
+                if isinstance(child, ast.ClassDef):
+                    snippet = _class_outline(child, lines)
+                else:
+                    snippet = ast.get_source_segment(source, child) or lines[child.lineno - 1]
+                    if len(snippet) > MAX_TARGET_CHARS:
+                        snippet = snippet[:MAX_TARGET_CHARS] + '\n    ...'
+                kind = 'class' if isinstance(child, ast.ClassDef) else 'function'
+                insert_line = _first_line(body_start)
+                indent = _indent_of(lines[insert_line - 1])
+                targets.append(Target(f"t{len(targets)}", kind, qualname, insert_line, indent, snippet))
+            visit(child, f"{qualname}.")
+
+    visit(tree)
+    return targets
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token for code)"""
+    return len(text) // 4 + 1
+
+
+def pack_targets(items: list) -> list:
+    """
+    Greedily group (file, target) items into packs that fit the token budgets.
+
+    Items keep their order, so a file's definitions stay together unless the
+    file alone overflows a pack.
+    """
+    input_budget = settings.LLM_PACK_INPUT_TOKENS - PROMPT_OVERHEAD_TOKENS
+    max_targets = max(1, settings.LLM_PACK_OUTPUT_TOKENS // DOCSTRING_TOKENS)
+    packs, current, size = [], [], 0
+    for item in items:
+        tokens = estimate_tokens(item[1].snippet)
+        if current and (size + tokens > input_budget or len(current) >= max_targets):
+            packs.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+def _label(file_index: int, target: Target) -> str:
+    return f"f{file_index}.{target.id}"
+
+
+def pack_prompt(pack: list, names: list) -> str:
+    parts = []
+    for file_index, target in pack:
+        parts.append(
+            f"### {_label(file_index, target)} ({target.kind} {target.name} in {names[file_index]})\n"
+            f"```python\n{target.snippet}\n```"
+        )
+    definitions = '\n\n'.join(parts)
+    return f"""Write professional Google-style docstrings for the Python definitions below.
+Each definition is labelled with an id.
+
+{definitions}
+
+Respond with only a JSON object mapping each id to its docstring text
+(without surrounding quotes or indentation), e.g. {{"f0.t0": "Summary line.\\n\\nArgs:\\n    x: ..."}}."""
+
+
+def parse_response(text: str) -> dict:
+    """Extract the id -> docstring mapping from a model response"""
+    text = FENCE_RE.sub('', text.strip())
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end == -1:
+        raise ValueError("No JSON object in model response")
+    data = json.loads(text[start:end + 1])
+    if not isinstance(data, dict):
+        raise ValueError("Model response is not a JSON object")
+    return {str(key): str(value) for key, value in data.items() if value}
+
+
+def format_docstring(text: str, indent: str) -> str:
+    text = text.strip().replace('\\', '\\\\')
+    if text.endswith('"'):
+        # Would run into the closing quotes
+        text = text[:-1] + '\\"'
+    text = text.replace('"""', '\\"\\"\\"')
+    lines = text.splitlines() or ['']
+    if len(lines) == 1:
+        return f'{indent}"""{lines[0]}"""\n'
+    body = '\n'.join(f"{indent}{line}" if line.strip() else '' for line in lines[1:])
+    return f'{indent}"""{lines[0]}\n{body}\n{indent}"""\n'
+
+
+def splice_docstrings(source: str, targets: list, docstrings: dict) -> str:
+    """
+    Insert docstrings before each target's first body line, bottom-up so offsets stay valid.
+
+    Raises SpliceError if the result doesn't parse.
+    """
+    lines = source.splitlines(keepends=True)
+    for target in sorted(targets, key=lambda t: t.insert_line, reverse=True):
+        text = docstrings.get(target.id)
+        if not text:
+            continue
+        lines.insert(target.insert_line - 1, format_docstring(text, target.indent))
+    spliced = ''.join(lines)
+    try:
+        ast.parse(spliced)
+    except SyntaxError as e:
+        raise SpliceError(f"Docstrings would break the file: {e}")
+    return spliced
+
+
+def _generate_pack(pack: list, names: list, generate) -> dict:
+    """Return {(file_index, target_id): docstring} for a pack, splitting it on malformed answers"""
+    labels = {_label(file_index, target): (file_index, target.id) for file_index, target in pack}
+    try:
+        answer = parse_response(generate(pack_prompt(pack, names)))
+        found = {labels[key]: text for key, text in answer.items() if key in labels}
+        if not found:
+            raise ValueError("Model response has none of the requested ids")
+        return found
+    except ValueError as e:
+        if len(pack) == 1:
+            # Leave this definition undocumented rather than failing the file
+            print(f"Unusable docstring response: {e}")
+            return {}
+        print(f"Unusable docstring response for {len(pack)} definitions, splitting: {e}")
+        middle = len(pack) // 2
+        return {**_generate_pack(pack[:middle], names, generate),
+                **_generate_pack(pack[middle:], names, generate)}
+
+
+def document_sources(sources: list, generate, workers: int = 1):
+    """
+    Add docstrings to several (name, source) pairs with as few model calls as possible.
+
+    generate(prompt) -> str is the model call; packs run on up to `workers`
+    threads. Yields (index, result, missing) as each file completes, where
+    result is the documented source or the exception that stopped it
+    (SyntaxError if the source doesn't parse, SpliceError if the documented
+    one wouldn't, or whatever generate raised),
+    and missing names the definitions the model gave no usable docstring
+    for. A result with anything missing is partial and worth retrying.
+    """
+    names = [name for name, _ in sources]
+    file_targets = {}
+    items = []
+    for index, (_, source) in enumerate(sources):
+        try:
+            file_targets[index] = find_undocumented(source)
+        except SyntaxError as e:
+            yield index, e, []
+            continue
+        if not file_targets[index]:
+            yield index, source, []
+            continue
+        items.extend((index, target) for target in file_targets[index])
+
+    packs = pack_targets(items)
+    # Packs still outstanding per file; a file is done when all of its packs are
+    remaining = {}
+    for pack in packs:
+        for file_index in {file_index for file_index, _ in pack}:
+            remaining[file_index] = remaining.get(file_index, 0) + 1
+
+    answers = {}
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # Each pack runs in a copy of the caller's context so its model stages count toward the request
+        futures = {pool.submit(contextvars.copy_context().run, _generate_pack, pack, names, generate): pack
+                   for pack in packs}
+        for future in as_completed(futures):
+            pack = futures[future]
+            files = {file_index for file_index, _ in pack}
+            try:
+                answers.update(future.result())
+            except Exception as e:
+                for file_index in files:
+                    failures.setdefault(file_index, e)
+
+            for file_index in sorted(files):
+                remaining[file_index] -= 1
+                if remaining[file_index]:
+                    continue
+                if file_index in failures:
+                    yield file_index, failures[file_index], []
+                    continue
+                targets = file_targets[file_index]
+                found = {t.id: answers[(file_index, t.id)] for t in targets if (file_index, t.id) in answers}
+                missing = [t.name for t in targets if t.id not in found]
+                try:
+                    result = splice_docstrings(sources[file_index][1], targets, found)
+                except SpliceError as e:
+                    result, missing = e, []
+                yield file_index, result, missing
+
+
+def add_docstrings(source: str, generate) -> str:
+    """
+    Add docstrings to every undocumented definition in source.
+
+    generate(prompt) -> str is the model call. Raises SyntaxError if the
+    source can't be parsed.
+    """
+    for _, result, _ in document_sources([('<source>', source)], generate):
+        if isinstance(result, Exception):
+            raise result
+        return result
@@ -0,0 +1,57 @@
+"""
+File helpers shared by the on-disk caches under REPO_CACHE_DIR.
+
+JSON state (the clone manifest, tree listings, dependency results,
+analytics, the model scheduler) is written to a temporary file and moved
+into place, so a reader in another process sees either the old file or
+the new one, never half of either.
+"""
+import json
+import os
+import threading
+
+
+def write_json(path: str, data, **options):
+    """Atomically replace path with data as JSON; options go to json.dump"""
+    # Unique per thread, so concurrent writers of one file don't share a temp file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, **options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def dir_size(path: str) -> int:
+    """Bytes in the files under path, not following symlinks"""
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def evict_files(cache_dir: str, keep: int):
+    """Remove all but the keep most recently used (touched) JSON files in cache_dir"""
+    files = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.json'):
+            continue
+        try:
+            files.append((os.path.getmtime(os.path.join(cache_dir, name)), name))
+        except OSError:
+            continue
+    files.sort(reverse=True)
+    for _, name in files[keep:]:
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
@@ -0,0 +1,243 @@
+"""
+Read repository contents straight from the git object database.
+
+A GitObjectReader keeps one long-lived `git cat-file --batch` process per
+repository and streams trees and blobs by SHA, so endpoints never depend on
+a checked-out working tree and several commits can be read side by side.
+Readers are pooled per repository path and restarted transparently if the
+process dies or the repository directory is replaced.
+"""
+import atexit
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from . import metrics
+
+
+class GitReadError(Exception):
+    """Raised when an object can't be read from the repository."""
+
+
+@dataclass
+class TreeEntry:
+    path: str
+    mode: str
+    type: str
+    sha: str
+
+
+class _BatchProcess:
+    """One `git cat-file --batch` or `--batch-check` child process"""
+
+    def __init__(self, repo_path: str, mode: str):
+        metrics.git_started(['git', 'cat-file'])
+        self.proc = subprocess.Popen(
+            ['git', '-C', repo_path, 'cat-file', mode],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def request(self, rev: str) -> list:
+        """Send one object name and return its header fields, or None if missing"""
+        self.proc.stdin.write(rev.encode('utf-8') + b'\n')
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline()
+        if not header:
+            raise GitReadError(f"git cat-file exited while reading {rev}")
+        fields = header.decode('utf-8', 'replace').split()
+        if fields[-1] in ('missing', 'ambiguous'):
+            return None
+        return fields
+
+    def close(self):
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class GitObjectReader:
+    """Streams objects out of one repository's object database"""
+
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self._lock = threading.Lock()
+        self._batch = None
+        self._check = None
+        self._git_dir_id = self._dir_id()
+
+    def _dir_id(self):
+        try:
+            st = os.stat(os.path.join(self.repo_path, '.git'))
+            return (st.st_dev, st.st_ino)
+        except OSError:
+            return None
+
+    def is_stale(self) -> bool:
+        """True if the repository directory was removed or replaced since we started"""
+        return self._dir_id() != self._git_dir_id
+
+    def _process(self, attr: str, mode: str) -> _BatchProcess:
+        proc = getattr(self, attr)
+        if proc is None or not proc.alive():
+            if proc is not None:
+                # Reap the dead process and close its pipes
+                proc.close()
+            proc = _BatchProcess(self.repo_path, mode)
+            setattr(self, attr, proc)
+        return proc
+
+    def read_object(self, rev: str):
+        """Return (sha, type, data) for any object name, or None if it doesn't exist"""
+        with self._lock:
+            batch = self._process('_batch', '--batch')
+            try:
+                fields = batch.request(rev)
+                if fields is None:
+                    return None
+                sha, obj_type, size = fields[0], fields[1], int(fields[2])
+                data = batch.proc.stdout.read(size)
+                batch.proc.stdout.read(1)  # trailing newline
+            except (OSError, ValueError, IndexError) as e:
+                # Drop the process; the next call starts a fresh one
+                batch.close()
+                self._batch = None
+                raise GitReadError(f"Failed to read {rev}: {e}")
+            return sha, obj_type, data
+
+    def object_info(self, rev: str):
+        """Return (sha, type, size) without reading the content, or None if missing"""
+        with self._lock:
+            check = self._process('_check', '--batch-check')
+            try:
+                fields = check.request(rev)
+            except OSError as e:
+                check.close()
+                self._check = None
+                raise GitReadError(f"Failed to inspect {rev}: {e}")
+            if fields is None:
+                return None
+            return fields[0], fields[1], int(fields[2])
+
+    def read_blob(self, sha: str) -> bytes:
+        obj = self.read_object(sha)
+        if obj is None or obj[1] != 'blob':
+            raise GitReadError(f"Blob not found: {sha}")
+        return obj[2]
+
+    def read_file(self, commit: str, path: str) -> bytes:
+        """Read a file as of a commit"""
+        obj = self.read_object(f"{commit}:{path}")
+        if obj is None or obj[1] != 'blob':
+            raise GitReadError(f"File not found at {commit[:12]}: {path}")
+        return obj[2]
+
+    def list_tree(self, commit: str, recursive: bool = True) -> list:
+        """List the entries of a commit's tree (only tree objects are read, never blobs)"""
+        cmd = ['git', '-C', self.repo_path, 'ls-tree', '-z', '--full-tree']
+        if recursive:
+            cmd.append('-r')
+        cmd.append(commit)
+        metrics.git_started(cmd)
+        result = subprocess.run(cmd, capture_output=True, timeout=60)
+        if result.returncode != 0:
+            raise GitReadError(f"ls-tree failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+
+        entries = []
+        for record in result.stdout.split(b'\0'):
+            if not record:
+                continue
+            meta, _, path = record.partition(b'\t')
+            mode, obj_type, sha = meta.decode('ascii').split()
+            entries.append(TreeEntry(path=path.decode('utf-8', 'replace'), mode=mode, type=obj_type, sha=sha))
+        return entries
+
+    def missing_blobs(self, commit: str) -> set:
+        """Blobs of a commit's tree that a partial clone hasn't downloaded yet"""
+        metrics.git_started(['git', 'rev-list'])
+        result = subprocess.run(
+            ['git', '-C', self.repo_path, 'rev-list', '--objects', '--no-walk', '--missing=print', commit],
+            capture_output=True, text=True, timeout=60,
+        )
+        return {line[1:] for line in result.stdout.splitlines() if line.startswith('?')}
+
+    def prefetch(self, commit: str, shas) -> None:
+        """
+        Download the given blobs of a partial clone in one round trip.
+
+        Reading a missing blob through cat-file would otherwise trigger a
+        separate lazy fetch per object.
+        """
+        wanted = set(shas) & self.missing_blobs(commit)
+        if not wanted:
+            return
+        metrics.git_started(['git', 'fetch'])
+        subprocess.run(
+            ['git', '-C', self.repo_path, '-c', 'fetch.negotiationAlgorithm=noop',
+             'fetch', 'origin', '--no-tags', '--no-write-fetch-head',
+             '--recurse-submodules=no', '--filter=blob:none', '--stdin'],
+            input='\n'.join(sorted(wanted)) + '\n', capture_output=True, text=True, timeout=120,
+        )
+
+    def close(self):
+        with self._lock:
+            for proc in (self._batch, self._check):
+                if proc is not None:
+                    proc.close()
+            self._batch = self._check = None
+
+
+# =============================================================================
+# READER POOL
+# =============================================================================
+
+MAX_READERS = 32
+
+_readers = OrderedDict()
+_readers_lock = threading.Lock()
+
+
+def get_reader(repo_path: str) -> GitObjectReader:
+    """Return the pooled reader for a repository, starting one if needed"""
+    with _readers_lock:
+        reader = _readers.get(repo_path)
+        if reader is not None and reader.is_stale():
+            reader.close()
+            reader = None
+        if reader is None:
+            reader = GitObjectReader(repo_path)
+            _readers[repo_path] = reader
+        _readers.move_to_end(repo_path)
+
+        while len(_readers) > MAX_READERS:
+            _, oldest = _readers.popitem(last=False)
+            oldest.close()
+        return reader
+
+
+def close_reader(repo_path: str):
+    with _readers_lock:
+        reader = _readers.pop(repo_path, None)
+    if reader is not None:
+        reader.close()
+
+
+@atexit.register
+def close_all():
+    """Stop every pooled reader's processes (on shutdown, so none outlive the server)"""
+    with _readers_lock:
+        readers = list(_readers.values())
+        _readers.clear()
+    for reader in readers:
+        reader.close()
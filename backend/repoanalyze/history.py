@@ -0,0 +1,308 @@
+"""
+Structured, paginated commit history.
+
+`git log -z` output is parsed as it streams from the subprocess, and once
+a page's last record is read the process is killed instead of walking the
+rest of history. Fields are separated by control characters that can't
+occur in commit metadata, so subjects with any punctuation survive intact.
+
+Pages are addressed by cursor (the SHA of the last commit returned). The
+next page reruns the same log from the head and skips past the cursor, so
+in merge histories the commits git interleaves from other branches are
+neither lost nor repeated. That makes page k cost k pages' worth of
+commits, so cursors deeper than MAX_SKIP commits are refused; filters
+(since, until, paths) reach further back. The cached clones are shallow, so when a page
+runs into the shallow boundary, or a cursor isn't in the history the clone
+has, the clone is deepened on demand and the page is read again.
+
+Pages are read with async git (get_page_async), so a client that goes away
+stops the clone, deepen or log it was waiting on.
+"""
+import asyncio
+import subprocess
+from dataclasses import asdict, dataclass, field
+
+from . import metrics
+from .repo_cache import deepen_async, git_process, is_shallow, open_repo_async, run_git
+from .threads import run_sync
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Commits fetched by the first deepen of a request; doubles each round
+DEEPEN_STEP = 200
+MAX_DEEPEN_ROUNDS = 5
+# Longest a single page's `git log` may run
+LOG_TIMEOUT = 30
+# Most commits a page skips to reach its cursor
+MAX_SKIP = 10000
+
+RECORD_START = '\x1e'
+FIELD_SEP = '\x1f'
+LOG_FIELDS = ['%H', '%P', '%an', '%ae', '%aI', '%cn', '%cI', '%s']
+LOG_FORMAT = '%x1e' + '%x1f'.join(LOG_FIELDS)
+
+READ_SIZE = 64 * 1024
+
+
+class HistoryError(Exception):
+    pass
+
+
+@dataclass
+class Commit:
+    sha: str
+    parents: list
+    author: str
+    email: str
+    date: str
+    committer: str
+    committed_at: str
+    message: str
+    files: list = field(default=None)
+    added: int = None
+    deleted: int = None
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        if self.files is None:
+            for key in ('files', 'added', 'deleted'):
+                del data[key]
+        return data
+
+
+def _parse_header(record: str) -> Commit:
+    sha, parents, author, email, date, committer, committed_at, message = record.split(FIELD_SEP, 7)
+    return Commit(sha, parents.split(), author, email, date, committer, committed_at, message)
+
+
+def _add_numstat(commit: Commit, added: str, deleted: str, path: str):
+    # Binary files report '-' for both counts
+    added = int(added) if added.isdigit() else None
+    deleted = int(deleted) if deleted.isdigit() else None
+    commit.files.append({'path': path, 'added': added, 'deleted': deleted})
+    commit.added += added or 0
+    commit.deleted += deleted or 0
+
+
+class LogParser:
+    """
+    Incremental parser for `git log -z` output.
+
+    feed() takes raw chunks as they arrive and returns the commits they
+    completed; a commit is complete once the next one starts (its numstat
+    lines follow its header), so close() returns the last one.
+    """
+
+    def __init__(self, numstat: bool = False):
+        self.numstat = numstat
+        self._pending = b''
+        self._commit = None
+        # A rename spans three tokens: "added\tdeleted\t", old path, new path
+        self._rename = None
+
+    def feed(self, chunk: bytes) -> list:
+        self._pending += chunk
+        *tokens, self._pending = self._pending.split(b'\0')
+        done = []
+        for token in tokens:
+            commit = self._token(token.decode('utf-8', errors='replace'))
+            if commit:
+                done.append(commit)
+        return done
+
+    def close(self) -> list:
+        done = self.feed(b'\0') if self._pending else []
+        if self._commit:
+            done.append(self._commit)
+            self._commit = None
+        return done
+
+    def _token(self, token: str) -> Commit:
+        if token.startswith('\n'):
+            token = token[1:]
+        if token.startswith(RECORD_START):
+            finished, self._commit = self._commit, _parse_header(token[1:])
+            if self.numstat:
+                self._commit.files, self._commit.added, self._commit.deleted = [], 0, 0
+            return finished
+
+        commit = self._commit
+        if not self.numstat or commit is None:
+            return None
+        if self._rename is not None:
+            self._rename.append(token)
+            if len(self._rename) == 4:
+                added, deleted, old_path, path = self._rename
+                _add_numstat(commit, added, deleted, path)
+                commit.files[-1]['previous_path'] = old_path
+                self._rename = None
+            return None
+        added, _, rest = token.partition('\t')
+        deleted, _, path = rest.partition('\t')
+        if path:
+            _add_numstat(commit, added, deleted, path)
+        elif token:
+            self._rename = [added, deleted]
+        return None
+
+
+def log_command(repo_path: str, revs: list, paths=(), author: str = None, since: str = None,
+                until: str = None, numstat: bool = False, merges: bool = True) -> list:
+    cmd = ['git', '-C', repo_path, 'log', '-z', f'--format={LOG_FORMAT}']
+    if numstat:
+        cmd.append('--numstat')
+    if not merges:
+        cmd.append('--no-merges')
+    if author:
+        cmd.append(f'--author={author}')
+    if since:
+        cmd.append(f'--since={since}')
+    if until:
+        cmd.append(f'--until={until}')
+    # --end-of-options keeps a revision from being read as an option
+    return cmd + ['--end-of-options', *revs, '--', *paths]
+
+
+def iter_log(repo_path: str, revs: list, numstat: bool = False, **filters):
+    """
+    Yield Commits from `git log` as they are parsed.
+
+    Closing the generator early kills git, so callers only pay for the
+    commits they consume.
+    """
+    cmd = log_command(repo_path, revs, numstat=numstat, **filters)
+    metrics.git_started(cmd)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        parser = LogParser(numstat)
+        # read1 returns whatever is available instead of waiting for a full chunk
+        while chunk := process.stdout.read1(READ_SIZE):
+            yield from parser.feed(chunk)
+        yield from parser.close()
+
+        process.stdout.close()
+        if process.wait() != 0:
+            raise HistoryError(process.stderr.read().decode('utf-8', errors='replace').strip())
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+async def aiter_log(repo_path: str, revs: list, numstat: bool = False, **filters):
+    """iter_log for async code; git is stopped once the iterator is closed or its task cancelled"""
+    cmd = log_command(repo_path, revs, numstat=numstat, **filters)
+    async with git_process(*cmd[1:]) as process:
+        parser = LogParser(numstat)
+        while chunk := await process.stdout.read(READ_SIZE):
+            for commit in parser.feed(chunk):
+                yield commit
+        for commit in parser.close():
+            yield commit
+
+        stderr = await process.stderr.read()
+        if await process.wait() != 0:
+            raise HistoryError(stderr.decode('utf-8', errors='replace').strip())
+
+
+async def _git_output(repo_path: str, *args) -> str:
+    result = await run_git('-C', repo_path, *args, timeout=30)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+async def _collect_page(log, after: str, limit: int) -> list:
+    """Up to limit + 1 commits following the cursor, or None if the cursor never came up"""
+    commits = []
+    found = not after
+    skipped = 0
+    try:
+        async for commit in log:
+            if not found:
+                # Everything up to the cursor was on earlier pages
+                found = commit.sha == after
+                skipped += 1
+                if not found and skipped >= MAX_SKIP:
+                    raise HistoryError(f"Cursor is more than {MAX_SKIP} commits deep; "
+                                       "narrow the history with since, until or paths")
+                continue
+            commits.append(commit)
+            if len(commits) > limit:
+                break
+    finally:
+        await log.aclose()
+    return commits if found else None
+
+
+async def _read_page(repo_path: str, head: str, after: str, limit: int, **options):
+    """
+    Return (commits, complete) for one page from the local clone.
+
+    The page has up to limit + 1 commits so the caller can tell whether
+    there is another one. commits is None when the cursor isn't in the
+    log. complete is False when the clone may be too shallow to answer:
+    the cursor wasn't found, or history ran out at the boundary.
+    """
+    if after:
+        after = await _git_output(repo_path, 'rev-parse', '--verify', '--quiet', f'{after}^{{commit}}')
+        if not after:
+            return None, False
+
+    try:
+        # A path-filtered log can scan a long history without printing anything
+        commits = await asyncio.wait_for(
+            _collect_page(aiter_log(repo_path, [head], **options), after, limit), LOG_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise HistoryError(f"git log took longer than {LOG_TIMEOUT}s")
+
+    if commits is None:
+        return None, not is_shallow(repo_path)
+    complete = len(commits) > limit or not is_shallow(repo_path)
+    return commits, complete
+
+
+async def get_page_async(url: str, after: str = None, limit: int = DEFAULT_PAGE_SIZE, branch: str = None,
+                         **options) -> dict:
+    """
+    Return one page of commit history for a repository.
+
+    options are the log filters (paths, author, since, until) and numstat.
+    The result has 'commits' (Commit list), 'next_cursor' (None on the last
+    page), 'commit' (the head SHA) and 'deepened' (commits fetched to answer).
+    Raises HistoryError for a cursor that isn't in the repository's history
+    or is more than MAX_SKIP commits down it.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    step = max(DEEPEN_STEP, limit * 2)
+    deepened = 0
+    for _ in range(MAX_DEEPEN_ROUNDS + 1):
+        async with open_repo_async(url, branch=branch) as repo:
+            with metrics.stage('git_log'):
+                commits, complete = await _read_page(repo.path, repo.sha, after, limit, **options)
+        # Deepening takes the entry's exclusive lock, so it can't happen inside open_repo
+        if complete or not await deepen_async(url, step, branch=branch):
+            break
+        deepened += step
+        step *= 2
+
+    if commits is None:
+        raise HistoryError(f"Unknown cursor: {after}")
+
+    return _page_result(commits, limit, repo.sha, deepened)
+
+
+def get_page(url: str, **kwargs) -> dict:
+    """get_page_async for blocking code"""
+    return run_sync(get_page_async(url, **kwargs))
+
+
+def _page_result(commits: list, limit: int, head: str, deepened: int) -> dict:
+    next_cursor = commits[limit - 1].sha if len(commits) > limit else None
+    return {
+        'commits': commits[:limit],
+        'next_cursor': next_cursor,
+        'commit': head,
+        'deepened': deepened,
+    }
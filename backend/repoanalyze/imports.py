@@ -0,0 +1,294 @@
+"""
+Infer Python dependencies from import statements.
+
+Used when a repository has no manifest, or only ones that declare no
+Python runtime dependency. Every .py blob of the commit is
+parsed with `ast` (across a process pool for large trees) and its absolute
+imports are collected. Results are cached per blob SHA in a small SQLite
+database under REPO_CACHE_DIR, shared by all worker processes and capped at
+IMPORT_CACHE_MAX_BLOBS, so a new commit only re-parses the files that
+changed. Imports of the standard library and of the repository's own
+modules are dropped, and the rest are mapped to distribution names with a
+static table and the names the repository declares itself; what is
+installed on the server plays no part.
+"""
+import ast
+import multiprocessing
+import os
+import posixpath
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from . import metrics
+
+# Import names whose distribution is called something else
+DISTRIBUTION_NAMES = {
+    'Crypto': 'pycryptodome',
+    'Levenshtein': 'python-Levenshtein',
+    'MySQLdb': 'mysqlclient',
+    'OpenGL': 'PyOpenGL',
+    'OpenSSL': 'pyOpenSSL',
+    'PIL': 'Pillow',
+    'Xlib': 'python-xlib',
+    'attr': 'attrs',
+    'bs4': 'beautifulsoup4',
+    'cairo': 'pycairo',
+    'cv2': 'opencv-python',
+    'dateutil': 'python-dateutil',
+    'dns': 'dnspython',
+    'docx': 'python-docx',
+    'dotenv': 'python-dotenv',
+    'fitz': 'PyMuPDF',
+    'gi': 'PyGObject',
+    'git': 'GitPython',
+    'github': 'PyGithub',
+    'google.cloud': 'google-cloud',
+    'google.generativeai': 'google-generativeai',
+    'google.protobuf': 'protobuf',
+    'jose': 'python-jose',
+    'jwt': 'PyJWT',
+    'ldap': 'python-ldap',
+    'magic': 'python-magic',
+    'multipart': 'python-multipart',
+    'nacl': 'PyNaCl',
+    'pkg_resources': 'setuptools',
+    'pptx': 'python-pptx',
+    'psycopg2': 'psycopg2-binary',
+    'rest_framework': 'djangorestframework',
+    'serial': 'pyserial',
+    'skimage': 'scikit-image',
+    'sklearn': 'scikit-learn',
+    'slugify': 'python-slugify',
+    'socketio': 'python-socketio',
+    'telegram': 'python-telegram-bot',
+    'usb': 'pyusb',
+    'win32api': 'pywin32',
+    'win32con': 'pywin32',
+    'yaml': 'PyYAML',
+    'zmq': 'pyzmq',
+}
+
+# Top-level packages shared by many distributions; keep one more level
+NAMESPACE_PACKAGES = {'google', 'azure', 'zope', 'backports', 'jaraco', 'sphinxcontrib'}
+
+# Below this many uncached files, parsing in-process beats pool overhead
+PARALLEL_MIN_FILES = 200
+BATCH_SIZE = 64
+
+STDLIB_MODULES = set(sys.stdlib_module_names) | {'__future__'}
+
+
+def scan_source(source: bytes) -> list:
+    """Absolute module names imported by one file (empty if it doesn't parse)"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module)
+    return sorted(names)
+
+
+def _scan_batch(blobs: list) -> list:
+    """Process pool entry point: [(sha, source)] -> [(sha, imports)]"""
+    return [(sha, scan_source(source)) for sha, source in blobs]
+
+
+# =============================================================================
+# BLOB CACHE
+# =============================================================================
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(settings.REPO_CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(settings.REPO_CACHE_DIR, 'imports.sqlite3'), timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS blob_imports '
+                 '(sha TEXT PRIMARY KEY, imports TEXT NOT NULL, used REAL NOT NULL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS blob_imports_used ON blob_imports (used)')
+    return conn
+
+
+def _chunks(shas: list):
+    # Stay under SQLite's variable limit
+    for i in range(0, len(shas), 500):
+        chunk = shas[i:i + 500]
+        yield chunk, ','.join('?' * len(chunk))
+
+
+def _cached_imports(conn, shas: list) -> dict:
+    """Cached imports of the given blobs, marking the ones found as used"""
+    found = {}
+    for chunk, params in _chunks(shas):
+        rows = conn.execute(f"SELECT sha, imports FROM blob_imports WHERE sha IN ({params})", chunk)
+        for sha, imports in rows:
+            found[sha] = imports.split('\n') if imports else []
+    hits = list(found)
+    with conn:
+        for chunk, params in _chunks(hits):
+            conn.execute(f"UPDATE blob_imports SET used = ? WHERE sha IN ({params})", [time.time(), *chunk])
+    return found
+
+
+def _store_imports(conn, parsed: list):
+    """Cache newly parsed blobs and evict the least recently used beyond IMPORT_CACHE_MAX_BLOBS"""
+    now = time.time()
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO blob_imports (sha, imports, used) VALUES (?, ?, ?)',
+            [(sha, '\n'.join(names), now) for sha, names in parsed],
+        )
+        conn.execute(
+            'DELETE FROM blob_imports WHERE sha IN '
+            '(SELECT sha FROM blob_imports ORDER BY used DESC LIMIT -1 OFFSET ?)',
+            (settings.IMPORT_CACHE_MAX_BLOBS,),
+        )
+
+
+# =============================================================================
+# PROCESS POOL
+# =============================================================================
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: forking a threaded server process can copy held locks
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMPORT_SCAN_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def _parse_all(blobs: list) -> list:
+    if len(blobs) < PARALLEL_MIN_FILES:
+        return _scan_batch(blobs)
+
+    global _pool
+    batches = [blobs[i:i + BATCH_SIZE] for i in range(0, len(blobs), BATCH_SIZE)]
+    try:
+        results = []
+        for batch_result in _get_pool().map(_scan_batch, batches):
+            results.extend(batch_result)
+        return results
+    except BrokenProcessPool:
+        with _pool_lock:
+            _pool = None
+        print("Import scanner pool died; parsing in-process")
+        return _scan_batch(blobs)
+
+
+# =============================================================================
+# RESOLUTION
+# =============================================================================
+
+# Directories whose contents are importable as top-level names
+SOURCE_ROOTS = ('', 'src')
+
+
+def local_modules(paths: list) -> set:
+    """
+    Top-level names the repository provides itself: modules and packages at
+    the root or under src/ (namespace packages included there), and the
+    outermost package of every other __init__.py tree (importable once its
+    parent directory is on the path). Other plain directories don't count.
+    """
+    paths = set(paths)
+    names = set()
+    for path in paths:
+        directory, filename = posixpath.split(path)
+        if directory.startswith('src/'):
+            names.add(directory.split('/')[1])
+        if filename != '__init__.py':
+            if directory in SOURCE_ROOTS and filename.endswith('.py'):
+                names.add(filename[:-3])
+            continue
+        parent, package = posixpath.split(directory)
+        if package and posixpath.join(parent, '__init__.py') not in paths:
+            names.add(package)
+    return names
+
+
+def _is_sibling(path: str, top: str, paths: set) -> bool:
+    """A script's own directory is on sys.path, so `import helper` can mean helper.py beside it"""
+    directory = posixpath.dirname(path)
+    return (posixpath.join(directory, f"{top}.py") in paths
+            or posixpath.join(directory, top, '__init__.py') in paths)
+
+
+def normalize(name: str) -> str:
+    """PEP 503 normalized distribution name"""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def distribution_name(module: str, declared: dict) -> str:
+    """
+    Distribution that provides an imported module: a name the repository
+    declares when one matches (keeping its spelling), else the static table,
+    else the import name itself. `declared` maps normalized names to names.
+    """
+    parts = module.split('.')
+    top = parts[0]
+    candidates = ['.'.join(parts[:2])] if top in NAMESPACE_PACKAGES and len(parts) > 1 else []
+    candidates.append(top)
+    for name in candidates:
+        dist = DISTRIBUTION_NAMES.get(name, name)
+        if normalize(dist) in declared:
+            return declared[normalize(dist)]
+    for name in candidates:
+        if name in DISTRIBUTION_NAMES:
+            return DISTRIBUTION_NAMES[name]
+    return candidates[0].replace('.', '-')
+
+
+def scan(reader, commit: str, entries: list, declared=()) -> list:
+    """
+    Third-party distributions imported by the given .py tree entries of a commit.
+
+    `declared` names distributions the repository lists elsewhere (dev or
+    build requirements, say), so imports resolve to them first.
+    Returns sorted [(distribution, [files importing it])].
+    """
+    conn = _connect()
+    try:
+        shas = sorted({entry.sha for entry in entries})
+        imports = _cached_imports(conn, shas)
+        missing = [sha for sha in shas if sha not in imports]
+        metrics.cache_lookup('import_blobs', 'hit', len(imports))
+        metrics.cache_lookup('import_blobs', 'miss', len(missing))
+        if missing:
+            reader.prefetch(commit, missing)
+            with metrics.stage('import_scan'):
+                parsed = _parse_all([(sha, reader.read_blob(sha)) for sha in missing])
+            imports.update(parsed)
+            _store_imports(conn, parsed)
+    finally:
+        conn.close()
+
+    paths = {entry.path for entry in entries}
+    local = local_modules(paths)
+    declared = {normalize(name): name for name in declared}
+    used = {}
+    for entry in entries:
+        for module in imports.get(entry.sha, []):
+            top = module.split('.')[0]
+            if top in STDLIB_MODULES or top in local or _is_sibling(entry.path, top, paths):
+                continue
+            used.setdefault(distribution_name(module, declared), set()).add(entry.path)
+    return sorted((name, sorted(files)) for name, files in used.items())
@@ -0,0 +1,157 @@
+"""
+Background jobs for long-running work (docstring and documentation generation).
+
+submit() stores a Job row and hands it to a local thread pool, so the
+request returns immediately with a job ID that clients poll. Job state
+lives in the database. The process running a job renews a lease on it
+(heartbeat_at) every JOB_LEASE_SECONDS / 4, along with the leases of the
+jobs queued behind it in its pool; a queued or running job whose lease has
+run out belonged to a process that died or hung (e.g. a gunicorn
+restart, on any host), and is taken over by the next process that touches
+the queue. Processes look for such jobs at most once per heartbeat
+interval, so polling clients keep recovery going.
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+# kind -> callable(params, progress) returning a JSON-serializable result
+_handlers = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+_worker = None
+_last_recovery = 0.0
+
+
+def register(kind: str, handler):
+    _handlers[kind] = handler
+
+
+def _worker_id() -> str:
+    # The token tells a restarted process that reused the PID from the old one
+    global _worker
+    pid = os.getpid()
+    if _worker is None or _worker[0] != pid:
+        _worker = (pid, f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}")
+    return _worker[1]
+
+
+def _heartbeat_interval() -> float:
+    return settings.JOB_LEASE_SECONDS / 4
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.JOB_WORKERS, thread_name_prefix='job')
+        return _executor
+
+
+def recover_jobs() -> int:
+    """Take over unfinished jobs whose lease has run out; returns how many"""
+    me = _worker_id()
+    expired = timezone.now() - timedelta(seconds=settings.JOB_LEASE_SECONDS)
+    # This process's own jobs are running (renewing their lease) or waiting in its pool
+    orphaned = Job.objects.filter(status__in=[Job.QUEUED, Job.RUNNING]).filter(
+        Q(heartbeat_at__lt=expired) | Q(heartbeat_at__isnull=True)
+    ).exclude(worker=me)
+    recovered = 0
+    for job in orphaned:
+        # Claim atomically so only one process re-runs the job
+        claimed = Job.objects.filter(id=job.id, worker=job.worker, heartbeat_at=job.heartbeat_at).update(
+            worker=me, status=Job.QUEUED, progress_done=0, heartbeat_at=timezone.now(),
+        )
+        if claimed:
+            print(f"Recovering job {job.id} from {job.worker or 'unknown worker'}")
+            _get_executor().submit(_run, job.id)
+            recovered += 1
+    return recovered
+
+
+def _maybe_recover():
+    global _last_recovery
+    now = time.monotonic()
+    if now - _last_recovery < _heartbeat_interval():
+        return
+    _last_recovery = now
+    try:
+        recover_jobs()
+    except Exception as e:
+        print(f"Job recovery failed: {e}")
+
+
+def submit(kind: str, params: dict) -> Job:
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    _maybe_recover()
+    job = Job.objects.create(kind=kind, params=params, worker=_worker_id(), heartbeat_at=timezone.now())
+    _get_executor().submit(_run, job.id)
+    return job
+
+
+def get_job(job_id):
+    _maybe_recover()
+    return Job.objects.filter(id=job_id).first()
+
+
+def _owned(job_id):
+    """The job's row, as long as this process still holds it"""
+    return Job.objects.filter(id=job_id, worker=_worker_id())
+
+
+def _renew_lease(job_id, stop: threading.Event):
+    try:
+        while not stop.wait(_heartbeat_interval()):
+            try:
+                if not _owned(job_id).update(heartbeat_at=timezone.now()):
+                    return  # taken over by another worker
+                # Jobs waiting for a free thread in this process are held too,
+                # however long the ones ahead of them take
+                Job.objects.filter(worker=_worker_id(), status=Job.QUEUED).update(heartbeat_at=timezone.now())
+            except Exception as e:
+                print(f"Could not renew the lease of job {job_id}: {e}")
+    finally:
+        close_old_connections()
+
+
+def _run(job_id):
+    close_old_connections()
+    stop = threading.Event()
+    try:
+        claimed = _owned(job_id).filter(status=Job.QUEUED).update(
+            status=Job.RUNNING, started_at=timezone.now(), heartbeat_at=timezone.now(),
+        )
+        if not claimed:
+            return
+        threading.Thread(target=_renew_lease, args=(job_id, stop), daemon=True,
+                         name=f"job-lease-{job_id}").start()
+        job = Job.objects.get(id=job_id)
+
+        def progress(done: int, total: int):
+            _owned(job_id).update(progress_done=done, progress_total=total)
+
+        try:
+            result = _handlers[job.kind](job.params, progress)
+        except Exception as e:
+            traceback.print_exc()
+            _owned(job_id).update(status=Job.FAILED, error=str(e), finished_at=timezone.now())
+            return
+
+        _owned(job_id).update(status=Job.SUCCEEDED, result=result, finished_at=timezone.now())
+    finally:
+        stop.set()
+        close_old_connections()
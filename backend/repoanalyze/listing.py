@@ -0,0 +1,110 @@
+"""
+File listings of a commit, cached by commit SHA.
+
+A commit's tree never changes, so its listing is computed once with
+`git ls-tree` and kept both in memory and as JSON under REPO_CACHE_DIR
+where other worker processes can reuse it (up to TREE_CACHE_MAX_FILES
+listings, least recently used evicted first). Listings carry no blob
+sizes: a partial clone hasn't downloaded most blobs, and fetching them
+just to measure them would cost what the partial clone saves.
+"""
+import bisect
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+from .files import evict_files, write_json
+from .git_reader import TreeEntry
+
+TREE_CACHE_SIZE = 64
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 5000
+
+_lock = threading.Lock()
+_trees = OrderedDict()
+
+
+def _tree_dir() -> str:
+    tree_dir = os.path.join(settings.REPO_CACHE_DIR, 'trees')
+    os.makedirs(tree_dir, exist_ok=True)
+    return tree_dir
+
+
+def _tree_cache_path(commit: str) -> str:
+    return os.path.join(_tree_dir(), f"{commit}.json")
+
+
+def _load_tree(reader, commit: str) -> list:
+    cache_file = _tree_cache_path(commit)
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            entries = [TreeEntry(*row) for row in json.load(f)]
+        metrics.cache_lookup('tree', 'hit')
+        # Touch for LRU eviction
+        os.utime(cache_file)
+        return entries
+    except (OSError, ValueError, TypeError):
+        pass
+
+    metrics.cache_lookup('tree', 'miss')
+    with metrics.stage('tree_listing'):
+        entries = [entry for entry in reader.list_tree(commit) if entry.type == 'blob']
+        entries.sort(key=lambda entry: entry.path)
+
+    try:
+        write_json(cache_file, [[e.path, e.mode, e.type, e.sha] for e in entries])
+    except OSError as e:
+        print(f"Could not cache tree listing for {commit}: {e}")
+    evict_files(_tree_dir(), settings.TREE_CACHE_MAX_FILES)
+    return entries
+
+
+def get_tree(reader, commit: str) -> list:
+    """All blobs of a commit's tree, sorted by path"""
+    with _lock:
+        entries = _trees.get(commit)
+        if entries is not None:
+            _trees.move_to_end(commit)
+            metrics.cache_lookup('tree', 'hit')
+            return entries
+
+    entries = _load_tree(reader, commit)
+    with _lock:
+        _trees[commit] = entries
+        while len(_trees) > TREE_CACHE_SIZE:
+            _trees.popitem(last=False)
+    return entries
+
+
+def filter_entries(entries: list, extensions=None, prefix: str = '', skip_dirs=()) -> list:
+    """Entries matching any of the extensions and the path prefix"""
+    extensions = tuple(extensions or ())
+    matched = []
+    for entry in entries:
+        if prefix and not entry.path.startswith(prefix):
+            continue
+        if extensions and not entry.path.endswith(extensions):
+            continue
+        dirs = entry.path.split('/')[:-1]
+        if skip_dirs and any(d.startswith('.') or d in skip_dirs for d in dirs):
+            continue
+        matched.append(entry)
+    return matched
+
+
+def paginate(entries: list, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    Return (page, next_cursor) for path-sorted entries.
+
+    The cursor is the last path of the previous page; None marks the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    start = bisect.bisect_right(entries, cursor, key=lambda e: e.path) if cursor else 0
+    page = entries[start:start + limit]
+    next_cursor = page[-1].path if start + limit < len(entries) else None
+    return page, next_cursor
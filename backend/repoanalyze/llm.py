@@ -0,0 +1,418 @@
+"""
+Model backends.
+
+Views call generate(prompt) and never touch a vendor SDK. The backend named
+by LLM_BACKEND is created on first use, so booting a worker doesn't import
+google.generativeai. The client it builds on its first call, together with
+that client's connections, is then reused by every later call. Every call
+goes through the backend's scheduler (see scheduler.py), which orders calls
+fairly between clients and keeps all worker processes within the shared
+quota. Quota errors pause every worker with exponential backoff; other
+transient failures (overloaded servers, timeouts) are retried by the
+calling thread.
+
+Backends:
+- 'gemini': Google Gemini.
+- 'http': any OpenAI-compatible chat completions server (llama.cpp, vLLM,
+  Ollama, ...).
+- 'stub': deterministic offline answers after a fixed delay, for
+  development and benchmarks.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from . import metrics
+from .docstrings import estimate_tokens
+from .scheduler import DEFAULT_CLIENT, INTERACTIVE, Limits, QueueTimeout, Scheduler
+
+
+class ModelError(Exception):
+    """Raised when the model call fails after retries."""
+
+
+class ModelBusy(ModelError):
+    """Raised when the shared quota has no room for a call; retry after retry_after seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ServerBusy(Exception):
+    """A model server answered with a status worth retrying"""
+
+    def __init__(self, message: str, status: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+@dataclass
+class Generation:
+    text: str
+    # None when the backend doesn't report usage; estimated from the text instead
+    input_tokens: int = None
+    output_tokens: int = None
+
+
+class Backend:
+    """
+    Base class for model backends.
+
+    Subclasses implement connect() (build the client, called once) and
+    complete() (one call); generate() adds scheduling, retries, timing and
+    token accounting.
+    """
+    name = None
+    label = None
+    default_model = None
+    # Shown when configured() is False
+    setup_hint = ''
+    # Generation settings; part of the result cache key, as they change the output
+    config = {}
+
+    def __init__(self, model_name: str = None, concurrency: int = 4, rpm: int = 0, tpm: int = 0,
+                 client_rpm: int = 0):
+        self.model_name = model_name or self.default_model
+        self.concurrency = max(1, concurrency)
+        self.limits = Limits(rpm=rpm, tpm=tpm, client_rpm=client_rpm, concurrency=self.concurrency)
+        self.scheduler = Scheduler(self.name, self.limits)
+        self.calls = 0
+        self.in_flight = 0
+        self._client = None
+        self._lock = threading.Lock()
+
+    def configured(self) -> bool:
+        return True
+
+    def connect(self):
+        raise NotImplementedError
+
+    def complete(self, client, prompt: str, timeout: int) -> Generation:
+        raise NotImplementedError
+
+    def is_retryable(self, error: Exception) -> bool:
+        return False
+
+    def is_quota_error(self, error: Exception) -> bool:
+        """Whether the error means the shared quota is spent (rather than one call failing)"""
+        return False
+
+    def client(self):
+        """The backend's client, built on first use and shared by all threads"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self.connect()
+        return self._client
+
+    def _call(self, prompt: str) -> Generation:
+        with metrics.stage('llm'):
+            with self._lock:
+                self.calls += 1
+                self.in_flight += 1
+            try:
+                return self.complete(self.client(), prompt, settings.LLM_TIMEOUT)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+
+    def generate(self, prompt: str, client: str = DEFAULT_CLIENT, kind: str = INTERACTIVE) -> str:
+        """
+        Generate text for a prompt (stateless).
+
+        The call waits for its turn in the scheduler as `client`; BATCH work
+        waits as long as it takes, INTERACTIVE work raises ModelBusy after
+        LLM_QUEUE_TIMEOUT seconds.
+        """
+        if not self.configured():
+            raise ModelError(f"{self.label} not configured")
+
+        # Reserve the prompt plus a full answer; settled against actual usage afterwards
+        cost = estimate_tokens(prompt) + settings.LLM_PACK_OUTPUT_TOKENS
+        timeout = settings.LLM_QUEUE_TIMEOUT if kind == INTERACTIVE else None
+        attempt = 0
+        while True:
+            try:
+                with metrics.stage('llm_queue'):
+                    ticket = self.scheduler.acquire(client, cost, kind, timeout)
+            except QueueTimeout as e:
+                raise ModelBusy(str(e), e.retry_after)
+            try:
+                generation = self._call(prompt)
+            except Exception as e:
+                quota_error = self.is_quota_error(e)
+                delay = self.scheduler.release(ticket, quota_error=quota_error,
+                                               retry_after=getattr(e, 'retry_after', None))
+                if not (quota_error or self.is_retryable(e)):
+                    raise ModelError(str(e))
+                attempt += 1
+                if attempt > settings.LLM_MAX_RETRIES:
+                    if quota_error:
+                        raise ModelBusy(str(e), delay)
+                    raise ModelError(str(e))
+                if quota_error:
+                    # Every worker now waits out the backoff in the scheduler
+                    metrics.LLM_QUOTA_ERRORS.inc(backend=self.name)
+                    print(f"{self.label} quota exhausted, pausing model calls for {delay:.1f}s")
+                    continue
+                # Exponential backoff with jitter
+                delay = min(2 ** attempt, 30) * (0.5 + random.random())
+                print(f"{self.label} busy ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            tokens = record_token_usage(self.name, prompt, generation)
+            self.scheduler.release(ticket, tokens=tokens)
+            return generation.text
+
+
+def record_token_usage(backend: str, prompt: str, generation: Generation) -> int:
+    """Count tokens as reported by the backend, estimating them where it reports none; returns the total"""
+    input_tokens = generation.input_tokens
+    output_tokens = generation.output_tokens
+    if input_tokens is None:
+        input_tokens = estimate_tokens(prompt)
+    if output_tokens is None:
+        output_tokens = estimate_tokens(generation.text)
+    metrics.LLM_TOKENS.inc(input_tokens, backend=backend, direction='input')
+    metrics.LLM_TOKENS.inc(output_tokens, backend=backend, direction='output')
+    return input_tokens + output_tokens
+
+
+# =============================================================================
+# BACKENDS
+# =============================================================================
+
+class GeminiBackend(Backend):
+    name = 'gemini'
+    label = 'Gemini AI'
+    default_model = 'gemini-1.5-flash'
+    setup_hint = 'Check API key.'
+    config = {
+        "temperature": 0.7,
+        "top_p": 1,
+        "top_k": 1,
+        "max_output_tokens": 2048,
+    }
+    safety_settings = [
+        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    ]
+
+    def configured(self) -> bool:
+        return bool(os.getenv("GEMNI_API_KEY"))
+
+    def connect(self):
+        # The SDK takes most of a second to import, so it's only loaded here
+        import google.generativeai as genai
+
+        genai.configure(api_key=os.getenv("GEMNI_API_KEY"))
+        # The model keeps its API client (and gRPC channel) across calls
+        return genai.GenerativeModel(
+            model_name=self.model_name,
+            generation_config=self.config,
+            safety_settings=self.safety_settings,
+        )
+
+    def complete(self, client, prompt: str, timeout: int) -> Generation:
+        response = client.generate_content(prompt, request_options={'timeout': timeout})
+        usage = getattr(response, 'usage_metadata', None)
+        # .text raises ValueError for a blocked response
+        return Generation(response.text, getattr(usage, 'prompt_token_count', None),
+                          getattr(usage, 'candidates_token_count', None))
+
+    def is_retryable(self, error: Exception) -> bool:
+        from google.api_core import exceptions
+
+        return isinstance(error, (
+            exceptions.ResourceExhausted,
+            exceptions.ServiceUnavailable,
+            exceptions.DeadlineExceeded,
+            exceptions.InternalServerError,
+        ))
+
+    def is_quota_error(self, error: Exception) -> bool:
+        from google.api_core import exceptions
+
+        return isinstance(error, exceptions.ResourceExhausted)
+
+
+class HttpBackend(Backend):
+    """OpenAI-compatible chat completions endpoint at LLM_HTTP_URL"""
+    name = 'http'
+    label = 'Model server'
+    default_model = 'local'
+    setup_hint = 'Set LLM_HTTP_URL.'
+    config = {
+        "temperature": 0.7,
+        "max_tokens": 2048,
+    }
+    # Statuses worth retrying: rate limits and transient server failures
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def configured(self) -> bool:
+        return bool(settings.LLM_HTTP_URL)
+
+    def connect(self):
+        session = requests.Session()
+        # Enough pooled keep-alive connections for every concurrent call
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if settings.LLM_HTTP_API_KEY:
+            session.headers['Authorization'] = f"Bearer {settings.LLM_HTTP_API_KEY}"
+        return session
+
+    def complete(self, client, prompt: str, timeout: int) -> Generation:
+        response = client.post(settings.LLM_HTTP_URL, timeout=timeout, json={
+            'model': self.model_name,
+            'messages': [{'role': 'user', 'content': prompt}],
+            **self.config,
+        })
+        if response.status_code in self.retry_statuses:
+            raise ServerBusy(f"{response.status_code} from {settings.LLM_HTTP_URL}", response.status_code,
+                             _retry_after(response.headers.get('Retry-After')))
+        response.raise_for_status()
+        data = response.json()
+        usage = data.get('usage') or {}
+        return Generation(data['choices'][0]['message']['content'],
+                          usage.get('prompt_tokens'), usage.get('completion_tokens'))
+
+    def is_retryable(self, error: Exception) -> bool:
+        return isinstance(error, (ServerBusy, requests.ConnectionError, requests.Timeout))
+
+    def is_quota_error(self, error: Exception) -> bool:
+        return isinstance(error, ServerBusy) and error.status == 429
+
+
+def _retry_after(value: str) -> float:
+    """Seconds from a Retry-After header (HTTP dates are ignored)"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+PACK_LABEL_RE = re.compile(r'^### (?P<label>f\d+\.\w+) \((?P<kind>\w+) (?P<name>\S+) in ', re.MULTILINE)
+CODE_BLOCK_RE = re.compile(r'```python\n(?P<code>.*)\n```', re.DOTALL)
+
+
+class StubBackend(Backend):
+    """
+    Offline stand-in that answers from the prompt alone.
+
+    Packed docstring prompts get a JSON docstring per label, whole-file
+    prompts get their code back. Each call sleeps `latency` seconds plus
+    the output at `tokens_per_second`.
+    """
+    name = 'stub'
+    label = 'Stub model'
+    default_model = 'stub'
+
+    def __init__(self, latency: float = None, tokens_per_second: float = 0, **options):
+        super().__init__(**options)
+        self.latency = settings.LLM_STUB_LATENCY if latency is None else latency
+        self.tokens_per_second = tokens_per_second
+
+    def connect(self):
+        return None
+
+    def answer(self, prompt: str) -> str:
+        labels = PACK_LABEL_RE.findall(prompt)
+        if labels:
+            return json.dumps({
+                label: f"{kind.capitalize()} {name}.\n\nGenerated offline."
+                for label, kind, name in labels
+            })
+        code = CODE_BLOCK_RE.search(prompt)
+        return code.group('code') if code else 'Generated offline.'
+
+    def complete(self, client, prompt: str, timeout: int) -> Generation:
+        text = self.answer(prompt)
+        delay = self.latency
+        if self.tokens_per_second:
+            delay += estimate_tokens(text) / self.tokens_per_second
+        time.sleep(delay)
+        return Generation(text)
+
+
+BACKENDS = {backend.name: backend for backend in (GeminiBackend, HttpBackend, StubBackend)}
+
+
+# =============================================================================
+# ACTIVE BACKEND
+# =============================================================================
+
+_backend = None
+_backend_lock = threading.Lock()
+# Every backend created in this process, for the limit gauges
+_created = []
+
+
+def create_backend(name: str, **options) -> Backend:
+    """A new backend instance with its own client and limits"""
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown model backend {name!r}; expected one of {', '.join(BACKENDS)}")
+    options.setdefault('concurrency', settings.LLM_CONCURRENCY)
+    options.setdefault('rpm', settings.LLM_RPM)
+    options.setdefault('tpm', settings.LLM_TPM)
+    options.setdefault('client_rpm', settings.LLM_CLIENT_RPM)
+    backend = backend_class(**options)
+    _created.append(backend)
+    return backend
+
+
+def get_backend() -> Backend:
+    """The backend configured by LLM_BACKEND; created on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend(settings.LLM_BACKEND, model_name=settings.LLM_MODEL or None)
+    return _backend
+
+
+def set_backend(backend: Backend) -> Backend:
+    """Swap the active backend (e.g. for the stub in benchmarks) and return the previous one"""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
+
+
+def generate(prompt: str, client: str = DEFAULT_CLIENT, kind: str = INTERACTIVE) -> str:
+    """Generate text with the active backend; raises ModelError on failure"""
+    return get_backend().generate(prompt, client, kind)
+
+
+def _collect_limits() -> dict:
+    values = {}
+    for backend in _created:
+        values[(backend.name, 'concurrency')] = backend.concurrency
+        values[(backend.name, 'rpm')] = backend.limits.rpm
+        values[(backend.name, 'tpm')] = backend.limits.tpm
+        values[(backend.name, 'client_rpm')] = backend.limits.client_rpm
+        values[(backend.name, 'in_flight')] = backend.in_flight
+        # Shared by every worker on the host
+        for name, value in backend.scheduler.snapshot().items():
+            values[(backend.name, name)] = value
+    return values
+
+
+LLM_LIMITS = metrics.Gauge('repoanalyze_llm_calls',
+                           'Model call limits per backend (0 = unlimited), calls in flight in this worker, '
+                           'and calls queued, running and seconds of quota backoff across workers',
+                           ('backend', 'limit'), _collect_limits)
@@ -0,0 +1,63 @@
+"""
+Content-addressed cache of model output.
+
+Results are keyed by a hash of (input content, prompt template version,
+model name, generation config), so an unchanged file returns the same
+output instantly and costs no API quota, whichever user asks for it. The
+cache lives in the database and is trimmed to LLM_CACHE_MAX_BYTES by
+evicting the least recently used results.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import metrics
+from .models import LLMResult
+
+
+def make_key(content: str, prompt_version: str, model_name: str, config: dict) -> str:
+    payload = json.dumps([content, prompt_version, model_name, config], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_many(keys) -> dict:
+    """Return {key: result} for cached keys and count hits/misses"""
+    keys = set(keys)
+    found = dict(LLMResult.objects.filter(key__in=keys).values_list('key', 'result'))
+    if found:
+        LLMResult.objects.filter(key__in=found).update(last_used_at=timezone.now(), hits=F('hits') + 1)
+    metrics.cache_lookup('llm', 'hit', len(found))
+    metrics.cache_lookup('llm', 'miss', len(keys) - len(found))
+    return found
+
+
+def put(key: str, result: str, prompt_version: str, model_name: str):
+    LLMResult.objects.update_or_create(key=key, defaults={
+        'result': result,
+        'prompt_version': prompt_version,
+        'model_name': model_name,
+        'size': len(result.encode('utf-8')),
+        'last_used_at': timezone.now(),
+    })
+
+
+def evict():
+    """Drop least recently used results until the cache fits its byte budget"""
+    max_bytes = settings.LLM_CACHE_MAX_BYTES
+    total = LLMResult.objects.aggregate(total=Sum('size'))['total'] or 0
+    if total <= max_bytes:
+        return
+
+    stale = []
+    for key, size in LLMResult.objects.order_by('last_used_at').values_list('key', 'size').iterator():
+        if total <= max_bytes:
+            break
+        stale.append(key)
+        total -= size
+    # Delete in chunks to stay under SQLite's variable limit
+    for i in range(0, len(stale), 500):
+        LLMResult.objects.filter(key__in=stale[i:i + 500]).delete()
+
@@ -0,0 +1,162 @@
+"""
+python manage.py benchmark [options]
+
+Runs the offline benchmark suite (see repoanalyze/benchmark.py) against a
+freshly generated repository, a throwaway database and cache directory, and
+writes the results as JSON.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from repoanalyze import benchmark, llm
+
+
+def _csv(value: str) -> list:
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+@contextlib.contextmanager
+def _stdout_to_stderr():
+    """Point file descriptor 1 at stderr, so prints from views, git and pool workers stay out of the JSON"""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+class Command(BaseCommand):
+    help = "Benchmark every endpoint offline against a synthetic repository and a local model stand-in"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=200, help="Files in the synthetic repository")
+        parser.add_argument('--commits', type=int, default=100, help="Commits in the synthetic repository")
+        parser.add_argument('--manifests', default='requirements.txt',
+                            help=f"Comma-separated manifests to include ({', '.join(benchmark.MANIFESTS)}); "
+                                 "'none' leaves dependencies to the import scanner")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the repository contents")
+        parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated concurrency levels")
+        parser.add_argument('--requests', type=int, default=20, help="Requests per scenario and level")
+        parser.add_argument('--slow-requests', type=int, default=4,
+                            help="Requests per level for documentation builds")
+        parser.add_argument('--scenarios', default='',
+                            help="Comma-separated scenarios to run (default: all); a base name selects its variants")
+        parser.add_argument('--model-latency', type=float, default=0.25, help="Seconds per model call")
+        parser.add_argument('--model-tps', type=float, default=0,
+                            help="Model output tokens per second, added to the latency (0: instant)")
+        parser.add_argument('--doc-files', type=int, default=5, help="Files per docstring request")
+        parser.add_argument('--output', default='-', help="Where to write the JSON results ('-': stdout)")
+        parser.add_argument('--workdir', help="Directory for the repository, caches and database (default: temp)")
+        parser.add_argument('--keep', action='store_true', help="Keep the work directory afterwards")
+
+    def handle(self, *args, **options):
+        manifests = [m for m in _csv(options['manifests']) if m != 'none']
+        unknown = set(manifests) - set(benchmark.MANIFESTS)
+        if unknown:
+            raise CommandError(f"Unknown manifests: {', '.join(sorted(unknown))}")
+        try:
+            levels = [int(level) for level in _csv(options['concurrency'])]
+        except ValueError:
+            raise CommandError("--concurrency takes comma-separated integers")
+        if not levels or min(levels) < 1:
+            raise CommandError("--concurrency needs at least one level of 1 or more")
+
+        scenarios = benchmark.SCENARIOS
+        if options['scenarios']:
+            wanted = set(_csv(options['scenarios']))
+            scenarios = [s for s in scenarios if s.name in wanted or s.name.split(':')[0] in wanted]
+            known = {s.name for s in benchmark.SCENARIOS} | {s.name.split(':')[0] for s in benchmark.SCENARIOS}
+            if wanted - known:
+                raise CommandError(f"Unknown scenarios: {', '.join(sorted(wanted - known))}")
+
+        workdir = options['workdir'] or tempfile.mkdtemp(prefix='repoanalyze-bench-')
+        os.makedirs(workdir, exist_ok=True)
+        spec = benchmark.RepoSpec(files=options['files'], commits=options['commits'],
+                                  manifests=tuple(manifests), seed=options['seed'])
+        try:
+            report = self._run(workdir, spec, scenarios, levels, options)
+        finally:
+            if not options['keep']:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        output = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Results written to {options['output']}")
+
+    def _run(self, workdir: str, spec, scenarios: list, levels: list, options: dict) -> dict:
+        started = time.perf_counter()
+        repo_path = benchmark.make_repo(workdir, spec)
+        head = subprocess.run(['git', '-C', repo_path, 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+        self.stderr.write(f"Synthetic repository at {head[:12]} ({spec.files} files, {spec.commits} commits) "
+                          f"in {time.perf_counter() - started:.1f}s")
+
+        # The documentation pool is spawned and reads its settings from the
+        # environment, so these are exported as well as overridden. Eviction
+        # is kept out of the way so the shared clone and build survive.
+        overrides = {
+            'REPO_CACHE_DIR': os.path.join(workdir, 'cache'),
+            'REPO_CACHE_MAX_BYTES': 1 << 40,
+            'DOCS_CACHE_MAX_BUILDS': 1_000_000,
+            'DOCS_CACHE_MAX_WORKSPACES': 1_000_000,
+        }
+        os.environ.update({name: str(value) for name, value in overrides.items()})
+
+        model = llm.create_backend('stub', latency=options['model_latency'], tokens_per_second=options['model_tps'])
+        ctx = benchmark.Context(root=workdir, repo_url=f"file://{repo_path}", doc_batch=options['doc_files'])
+        connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'db.sqlite3')
+        old_db_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        original_model = llm.set_backend(model)
+        try:
+            # Docstring requests link to the synthetic repository with file:// URLs
+            local = override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost'], DOCSTRINGS_ALLOW_FILE_URLS=True,
+                                      **overrides)
+            with local, _stdout_to_stderr():
+                results = asyncio.run(benchmark.run_scenarios(
+                    get_asgi_application(), ctx, scenarios, levels, options['requests'],
+                    options['slow_requests'], log=self.stderr.write,
+                ))
+        finally:
+            llm.set_backend(original_model)
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+
+        return {
+            'environment': benchmark.environment(),
+            'config': {
+                'files': spec.files,
+                'commits': spec.commits,
+                'manifests': list(spec.manifests),
+                'seed': spec.seed,
+                'concurrency': levels,
+                'requests': options['requests'],
+                'slow_requests': options['slow_requests'],
+                'model_latency': options['model_latency'],
+                'model_tps': options['model_tps'],
+                'doc_files': options['doc_files'],
+            },
+            'repository': {'head': head},
+            'model_calls': model.calls,
+            'results': results,
+            'max_rss_bytes': benchmark.max_rss(),
+            'total_seconds': round(time.perf_counter() - started, 2),
+        }
@@ -0,0 +1,298 @@
+"""
+Lightweight request instrumentation.
+
+Stages of a request (repository sync, tree listing, dependency parsing,
+model calls, Sphinx, ...) are timed with `stage()`. TimingMiddleware sends
+the current request's stage timings back in a Server-Timing header, and
+every measurement also feeds the process-wide counters and histograms that
+/metrics exposes in the Prometheus text format.
+
+Metrics live in process memory, so each server process reports its own
+series; run one (async) worker per instance, or scrape instances
+individually. Stages that run in the build pool are timed in the worker and
+recorded by the parent with `record()`.
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .files import dir_size
+
+# Seconds; covers fast cache hits up to slow clones and documentation builds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Disk usage is measured by walking directories, so reuse it for a while
+DISK_USAGE_TTL = 60
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with _lock:
+            return self._values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def render(self) -> list:
+        with _lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in values]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # labels -> [per-bucket counts (plus +Inf), sum]
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with _lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> list:
+        with _lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose values are computed at scrape time by collect() -> {label values: value}"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple, collect):
+        self.name, self.help, self.labels, self.collect = name, help, labels, collect
+        _registry.append(self)
+
+    def render(self) -> list:
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in sorted(self.collect().items())]
+
+
+REQUEST_SECONDS = Histogram('repoanalyze_request_seconds', 'Request latency', ('endpoint', 'method', 'status'))
+STAGE_SECONDS = Histogram('repoanalyze_stage_seconds', 'Time spent in one stage of a request', ('endpoint', 'stage'))
+CACHE_REQUESTS = Counter('repoanalyze_cache_requests_total', 'Cache lookups by cache and result', ('cache', 'result'))
+GIT_COMMANDS = Counter('repoanalyze_git_commands_total', 'git subprocesses started', ('command',))
+LLM_TOKENS = Counter('repoanalyze_llm_tokens_total', 'Model tokens sent and received', ('backend', 'direction'))
+LLM_QUOTA_ERRORS = Counter('repoanalyze_llm_quota_errors_total', 'Model calls refused for quota, each pausing all workers', ('backend',))
+
+
+# =============================================================================
+# STAGES
+# =============================================================================
+
+class RequestTiming:
+    def __init__(self):
+        self.endpoint = None
+        self.stages = []
+
+
+_current = contextvars.ContextVar('request_timing', default=None)
+
+
+def record(name: str, seconds: float):
+    """Record a stage measured elsewhere (e.g. in a worker process)"""
+    timing = _current.get()
+    STAGE_SECONDS.observe(seconds, endpoint=(timing and timing.endpoint) or 'background', stage=name)
+    if timing is not None:
+        timing.stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+@contextmanager
+def collect():
+    """Collect the stages timed inside the block into a list of (name, seconds)"""
+    timing = RequestTiming()
+    token = _current.set(timing)
+    try:
+        yield timing.stages
+    finally:
+        _current.reset(token)
+
+
+def cache_lookup(cache: str, result: str, count: int = 1):
+    if count:
+        CACHE_REQUESTS.inc(count, cache=cache, result=result)
+
+
+def git_started(cmd: list):
+    """Count a git subprocess by its subcommand (skipping -C <path> and -c <config>)"""
+    args = iter(cmd[1:] if cmd and cmd[0] == 'git' else cmd)
+    for arg in args:
+        if arg in ('-C', '-c'):
+            next(args, None)
+        elif not arg.startswith('-'):
+            GIT_COMMANDS.inc(command=arg)
+            return
+    GIT_COMMANDS.inc(command='unknown')
+
+
+def server_timing(stages: list, total: float) -> str:
+    """Server-Timing header value; repeated stages are summed and counted"""
+    totals, counts = {}, {}
+    for name, seconds in stages:
+        totals[name] = totals.get(name, 0) + seconds
+        counts[name] = counts.get(name, 0) + 1
+    parts = []
+    for name, seconds in totals.items():
+        part = f"{name};dur={seconds * 1000:.1f}"
+        if counts[name] > 1:
+            part += f';desc="{counts[name]}x"'
+        parts.append(part)
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(parts)
+
+
+# =============================================================================
+# MIDDLEWARE
+# =============================================================================
+
+class TimingMiddleware:
+    """Time every request, add a Server-Timing header and record request latency"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timing, token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timing, started)
+
+    async def __acall__(self, request):
+        timing, token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timing, started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timing = _current.get()
+        if timing is not None:
+            timing.endpoint = request.resolver_match.url_name or view_func.__name__
+
+    def _start(self):
+        timing = RequestTiming()
+        return timing, _current.set(timing), time.perf_counter()
+
+    def _finish(self, request, response, timing, started):
+        elapsed = time.perf_counter() - started
+        # Unmatched paths share one label so scanners can't blow up the series count
+        endpoint = timing.endpoint or 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        response['Server-Timing'] = server_timing(timing.stages, elapsed)
+        return response
+
+
+# =============================================================================
+# DISK USAGE
+# =============================================================================
+
+_disk_usage = {'at': 0, 'values': {}}
+
+
+def _measure_disk_usage() -> dict:
+    from .repo_cache import _load_manifest
+
+    cache_dir = settings.REPO_CACHE_DIR
+    # Clone sizes are already tracked in the repository cache manifest
+    sizes = {('repos',): sum(entry.get('size', 0) for entry in _load_manifest().values())}
+    sizes[('docs',)] = dir_size(os.path.join(cache_dir, 'docs'))
+    other = 0
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name in ('repos', 'docs'):
+                continue
+            if os.path.isdir(path):
+                other += dir_size(path)
+            else:
+                try:
+                    other += os.path.getsize(path)
+                except OSError:
+                    # Removed since it was listed (e.g. a manifest being replaced)
+                    pass
+    sizes[('cache_other',)] = other
+    return sizes
+
+
+def _collect_disk_usage() -> dict:
+    now = time.monotonic()
+    if now - _disk_usage['at'] > DISK_USAGE_TTL:
+        _disk_usage['values'] = _measure_disk_usage()
+        _disk_usage['at'] = now
+    return _disk_usage['values']
+
+
+DISK_USAGE = Gauge('repoanalyze_disk_usage_bytes', 'Bytes on disk by area (refreshed at most once a minute)',
+                   ('area',), _collect_disk_usage)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
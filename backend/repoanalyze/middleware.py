@@ -0,0 +1,49 @@
+"""
+Static files for async deployments.
+
+WhiteNoiseMiddleware is synchronous only. Under ASGI Django then runs it,
+and through async_to_sync everything after it, on the one thread it keeps
+for thread-sensitive code, so every request in the process queues behind
+the one in flight, async views included. This subclass serves the same
+files in both modes; under ASGI the lookup and the file reads run in the
+worker pool.
+"""
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .threads import aiter_in_thread, run_in_thread
+
+CHUNK_SIZE = 64 * 1024
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, **kwargs):
+        super().__init__(get_response, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await run_in_thread(self.find_file, request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is None:
+            return await self.get_response(request)
+
+        response = await run_in_thread(self.serve, static_file, request)
+        if response.file_to_stream is not None:
+            # The file stays registered for closing with the response
+            response.streaming_content = aiter_in_thread(
+                iter(partial(response.file_to_stream.read, CHUNK_SIZE), b'')
+            )
+        return response
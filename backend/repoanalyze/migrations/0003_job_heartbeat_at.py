@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repoanalyze', '0002_llmresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
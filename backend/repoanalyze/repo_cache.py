@@ -0,0 +1,610 @@
+"""
+Shared on-disk cache of cloned repositories.
+
+Every clone lives in its own directory keyed by the normalized
+host/owner/repo (plus branch), so two repositories with the same name never
+collide. A JSON manifest records last access time and size for each entry,
+and the least recently used entries are evicted once the cache grows past
+REPO_CACHE_MAX_BYTES. All git work on an entry happens under an exclusive
+file lock; readers hold a shared lock so eviction never removes a checkout
+that another request (or gunicorn worker) is still reading.
+
+Concurrent requests for the same entry are coalesced: within a process they
+share one in-flight sync, and across processes a worker that waited on the
+lock skips its own sync if another worker finished one in the meantime.
+
+Async views use open_repo_async and deepen_async, where git runs as an
+asyncio subprocess that is stopped on timeout or when the request is
+cancelled, and locks are polled instead of blocking the event loop.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from . import metrics
+from .files import dir_size, write_json
+from .git_reader import close_reader
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .threads import run_sync
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class CloneError(Exception):
+    """Raised when a repository can't be cloned or updated."""
+
+
+@dataclass
+class CachedRepo:
+    key: str
+    path: str
+    sha: str = None
+
+
+# =============================================================================
+# KEYS AND PATHS
+# =============================================================================
+
+# Hosts that treat owner/repo case-insensitively
+CASE_INSENSITIVE_HOSTS = {'github.com', 'gitlab.com'}
+
+SCP_URL_RE = re.compile(r'^(?:[\w.-]+@)?(?P<host>[\w.-]+):(?P<path>[^/].*)$')
+
+
+def normalize_repo_url(url: str) -> str:
+    """Return the canonical host/owner/repo form of a repository URL"""
+    url = url.strip().rstrip('/')
+    parts = urlsplit(url)
+    if parts.scheme == 'file':
+        host, path = 'file', parts.path
+    elif parts.scheme:
+        host, path = parts.hostname or '', parts.path
+    else:
+        match = SCP_URL_RE.match(url)
+        if not match:
+            raise ValueError(f"Unrecognized repository URL: {url}")
+        host, path = match.group('host'), match.group('path')
+
+    host = host.lower()
+    path = path.strip('/')
+    if path.endswith('.git'):
+        path = path[:-4]
+    if host in CASE_INSENSITIVE_HOSTS:
+        path = path.lower()
+    if not path:
+        raise ValueError(f"Unrecognized repository URL: {url}")
+    return f"{host}/{path}"
+
+
+def cache_key(url: str, branch: str = None) -> str:
+    key = normalize_repo_url(url)
+    if branch:
+        key += f"@{branch}"
+    return key
+
+
+def _digest(key: str) -> str:
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def get_cache_root() -> str:
+    root = settings.REPO_CACHE_DIR
+    os.makedirs(os.path.join(root, 'repos'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'locks'), exist_ok=True)
+    return root
+
+
+def entry_path(key: str) -> str:
+    """Directory holding the clone for a cache key"""
+    repo_name = re.sub(r'[^\w.-]', '_', key.split('@')[0].rsplit('/', 1)[-1])
+    return os.path.join(get_cache_root(), 'repos', f"{repo_name}-{_digest(key)}")
+
+
+# =============================================================================
+# FILE LOCKS
+# =============================================================================
+
+class FileLock:
+    """Advisory inter-process lock on a file (shared or exclusive)"""
+
+    def __init__(self, path: str, shared: bool = False):
+        self.path = path
+        self.shared = shared
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+                if not blocking:
+                    flags |= fcntl.LOCK_NB
+                fcntl.flock(fd, flags)
+            else:
+                # msvcrt only offers exclusive locks
+                mode = msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK
+                msvcrt.locking(fd, mode, 1)
+        except OSError:
+            os.close(fd)
+            if blocking:
+                raise
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def entry_lock(key: str, shared: bool = False) -> FileLock:
+    return FileLock(os.path.join(get_cache_root(), 'locks', f"{_digest(key)}.lock"), shared=shared)
+
+
+def _manifest_lock() -> FileLock:
+    return FileLock(os.path.join(get_cache_root(), 'manifest.lock'))
+
+
+# =============================================================================
+# MANIFEST
+# =============================================================================
+
+def _manifest_path() -> str:
+    return os.path.join(get_cache_root(), 'manifest.json')
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(_manifest_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest: dict):
+    write_json(_manifest_path(), manifest)
+
+
+def update_manifest(key: str, **fields):
+    """Merge fields into a manifest entry, creating it if needed"""
+    with _manifest_lock():
+        manifest = _load_manifest()
+        entry = manifest.setdefault(key, {'path': entry_path(key), 'size': 0})
+        entry.update(fields)
+        _save_manifest(manifest)
+        return dict(entry)
+
+
+def get_manifest_entry(key: str) -> dict:
+    with _manifest_lock():
+        return _load_manifest().get(key, {})
+
+
+def _remove_manifest_entry(key: str):
+    with _manifest_lock():
+        manifest = _load_manifest()
+        if manifest.pop(key, None) is not None:
+            _save_manifest(manifest)
+
+
+def _remove_clone(path: str):
+    # Stop this process's object reader before its repository disappears
+    close_reader(path)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def evict(exclude: str = None):
+    """Remove least recently used entries until the cache fits its byte budget"""
+    max_bytes = settings.REPO_CACHE_MAX_BYTES
+    with _manifest_lock():
+        manifest = _load_manifest()
+
+    total = sum(entry.get('size', 0) for entry in manifest.values())
+    if not max_bytes or total <= max_bytes:
+        return
+
+    by_age = sorted(manifest.items(), key=lambda item: item[1].get('last_access', 0))
+    for key, entry in by_age:
+        if total <= max_bytes:
+            break
+        if key == exclude:
+            continue
+        lock = entry_lock(key)
+        # Entries that are in use by another request are skipped, not waited on
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            print(f"Evicting cached repo: {key}")
+            _remove_clone(entry_path(key))
+            _remove_manifest_entry(key)
+            total -= entry.get('size', 0)
+        finally:
+            lock.release()
+
+
+# =============================================================================
+# GIT PROCESSES
+# =============================================================================
+
+# Children get their own process group so stopping git also stops the
+# helpers it started (upload-pack, git-remote-https, ssh), which would
+# otherwise keep running and hold the pipes open.
+NEW_SESSION = os.name == 'posix'
+
+
+def _signal(process, sig):
+    # os.kill rather than process.send_signal(): Popen polls the child first,
+    # which can reap it behind the event loop's child watcher.
+    try:
+        if NEW_SESSION:
+            os.killpg(process.pid, sig)
+        else:
+            os.kill(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+@asynccontextmanager
+async def git_process(*args):
+    """
+    Start git as an asyncio child with its output piped.
+
+    However the block is left (normally, by an exception, or because the
+    request was cancelled when the client went away) git and everything it
+    started are stopped: SIGTERM first so git can remove its lock files,
+    then SIGKILL.
+    """
+    cmd = ['git', *args]
+    metrics.git_started(cmd)
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        start_new_session=NEW_SESSION,
+    )
+    try:
+        yield process
+    finally:
+        if process.returncode is None:
+            _signal(process, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), 5)
+            except asyncio.TimeoutError:
+                _signal(process, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                await process.wait()
+
+
+async def run_git(*args, timeout: int = 60) -> subprocess.CompletedProcess:
+    """
+    Run git without blocking the event loop.
+
+    git is stopped if the awaiting task is cancelled, or once `timeout`
+    expires, raising subprocess.TimeoutExpired like subprocess.run.
+    """
+    async with git_process(*args) as process:
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(['git', *args], timeout)
+    return subprocess.CompletedProcess(
+        ['git', *args], process.returncode,
+        stdout.decode('utf-8', errors='replace'), stderr.decode('utf-8', errors='replace'),
+    )
+
+
+@asynccontextmanager
+async def _locked(lock: FileLock):
+    """Hold a FileLock, polling for it so the event loop keeps running"""
+    delay = 0.02
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+    try:
+        yield lock
+    finally:
+        lock.release()
+
+
+# =============================================================================
+# CLONE / UPDATE
+# =============================================================================
+# Written once as coroutines: async views await them directly, so git is
+# stopped when the client disconnects, and open_repo()/deepen() drive them
+# from blocking code with run_sync().
+
+# Commits of history a new clone starts with; deepen() extends it on demand
+CLONE_DEPTH = 50
+
+
+def _clone_args() -> list:
+    args = ['clone', '--depth', str(CLONE_DEPTH)]
+    if settings.REPO_PARTIAL_CLONE:
+        # Blobless clone with nothing checked out; readers fetch the blobs
+        # they need through the object store.
+        args.extend(['--filter=blob:none', '--no-checkout'])
+    return args
+
+
+async def _clone(url: str, path: str, branch: str = None) -> str:
+    """Clone into path and return the remote ref that was checked out"""
+    cmd = _clone_args()
+    if branch:
+        cmd.extend(['--branch', branch])
+
+    result = await run_git(*cmd, url, path, timeout=120)
+    if result.returncode == 0:
+        return f"refs/heads/{branch}" if branch else 'HEAD'
+    if branch:
+        # Try without branch specification
+        await asyncio.to_thread(_remove_clone, path)
+        result = await run_git(*_clone_args(), url, path, timeout=120)
+        if result.returncode == 0:
+            return 'HEAD'
+    print(f"Clone failed for {url}: {result.stderr.strip()}")
+    await asyncio.to_thread(_remove_clone, path)
+    return None
+
+
+async def _remote_head(url: str, ref: str) -> str:
+    """Look up the SHA a remote ref points at without fetching anything"""
+    try:
+        result = await run_git('ls-remote', url, ref, timeout=30)
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode != 0:
+        return None
+    for line in result.stdout.splitlines():
+        sha, _, name = line.partition('\t')
+        if name == ref:
+            return sha
+    return None
+
+
+async def _local_head(path: str) -> str:
+    result = await run_git('-C', path, 'rev-parse', 'HEAD', timeout=10)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def _update_commands(path: str, partial: bool) -> list:
+    """git commands that move an entry to FETCH_HEAD; a partial clone has no working tree, so only HEAD moves"""
+    if partial:
+        return [['-C', path, 'reset', '--soft', 'FETCH_HEAD']]
+    return [['-C', path, 'reset', '--hard', 'FETCH_HEAD']]
+
+
+async def _fetch(path: str, ref: str, depth: int = CLONE_DEPTH, partial: bool = False) -> bool:
+    """Fetch and check out ref; depth None keeps a full clone's history complete"""
+    depth_args = ['--depth', str(depth)] if depth else []
+    result = await run_git('-C', path, 'fetch', *depth_args, 'origin', ref, timeout=60)
+    if result.returncode != 0:
+        return False
+    for cmd in _update_commands(path, partial):
+        if (await run_git(*cmd, timeout=60)).returncode != 0:
+            return False
+    return True
+
+
+async def _sync(url: str, branch: str, key: str, path: str):
+    """Clone or update an entry. Caller must hold its exclusive lock."""
+    entry = get_manifest_entry(key)
+    ref = entry.get('ref') or (f"refs/heads/{branch}" if branch else 'HEAD')
+    now = time.time()
+
+    if os.path.exists(path):
+        remote_sha = await _remote_head(url, ref)
+        if remote_sha is None:
+            # Remote unreachable; keep serving the cached copy until the next check
+            print(f"ls-remote failed for {url}, using cached copy")
+            update_manifest(key, checked_at=now)
+            metrics.cache_lookup('repo', 'stale')
+            return
+
+        local_sha = entry.get('sha') or await _local_head(path)
+        if remote_sha == local_sha:
+            update_manifest(key, sha=local_sha, checked_at=now, synced_at=now)
+            metrics.cache_lookup('repo', 'revalidated')
+            return
+
+        try:
+            # Keep history that was deepened on demand
+            if await _fetch(path, ref, entry.get('depth', CLONE_DEPTH), entry.get('partial', False)):
+                update_manifest(key, sha=await _local_head(path), size=await asyncio.to_thread(dir_size, path),
+                                checked_at=now, synced_at=now)
+                metrics.cache_lookup('repo', 'fetched')
+                return
+        except subprocess.TimeoutExpired:
+            pass
+        # If fetch fails, remove and re-clone
+        await asyncio.to_thread(_remove_clone, path)
+
+    ref = await _clone(url, path, branch)
+    if not ref:
+        _remove_manifest_entry(key)
+        raise CloneError(f"Failed to clone {url}")
+    update_manifest(key, url=url, branch=branch, ref=ref, sha=await _local_head(path),
+                    partial=settings.REPO_PARTIAL_CLONE, depth=CLONE_DEPTH,
+                    size=await asyncio.to_thread(dir_size, path), checked_at=now, synced_at=now)
+    metrics.cache_lookup('repo', 'cloned')
+
+
+def is_shallow(path: str) -> bool:
+    # What `git rev-parse --is-shallow-repository` checks, without starting git
+    return os.path.exists(os.path.join(path, '.git', 'shallow'))
+
+
+async def deepen_async(url: str, commits: int = None, branch: str = None) -> bool:
+    """
+    Fetch `commits` more history into a cached shallow clone, or all of it if None.
+
+    Returns False if there was nothing to deepen (full history already
+    present, or the fetch failed). Must not be called while holding the
+    entry via open_repo.
+    """
+    key = cache_key(url, branch)
+    path = entry_path(key)
+    async with _locked(entry_lock(key)):
+        if not os.path.isdir(path) or not is_shallow(path):
+            return False
+        deepen_arg = f'--deepen={commits}' if commits else '--unshallow'
+        try:
+            with metrics.stage('git_deepen'):
+                result = await run_git('-C', path, 'fetch', deepen_arg, 'origin', timeout=300 if commits else 1800)
+        except subprocess.TimeoutExpired:
+            return False
+        if result.returncode != 0:
+            print(f"Deepen failed for {url}: {result.stderr.strip()}")
+            return False
+        # A depth of None marks a full clone that later fetches must not re-shorten
+        depth = (get_manifest_entry(key).get('depth') or CLONE_DEPTH) + commits if commits else None
+        update_manifest(key, depth=depth, size=await asyncio.to_thread(dir_size, path))
+        return True
+
+
+def deepen(url: str, commits: int = None, branch: str = None) -> bool:
+    """deepen_async for blocking code"""
+    return run_sync(deepen_async(url, commits, branch))
+
+
+def _is_fresh(entry: dict, path: str) -> bool:
+    age = time.time() - entry.get('checked_at', 0)
+    return os.path.isdir(path) and age < settings.REPO_FRESHNESS_TTL
+
+
+def _fresh_hit(key: str, path: str) -> bool:
+    # Checked against the remote recently enough; no network at all
+    if _is_fresh(get_manifest_entry(key), path):
+        metrics.cache_lookup('repo', 'hit')
+        return True
+    return False
+
+
+async def _ensure_synced(url: str, branch: str, key: str, path: str):
+    requested_at = time.time()
+    async with _locked(entry_lock(key)):
+        # Another worker process may have synced the entry while we were
+        # waiting for the lock; its result is as fresh as ours would be.
+        entry = get_manifest_entry(key)
+        if _is_fresh(entry, path) or (os.path.isdir(path) and entry.get('synced_at', 0) >= requested_at):
+            metrics.cache_lookup('repo', 'hit')
+        else:
+            try:
+                with metrics.stage('repo_sync'):
+                    await _sync(url, branch, key, path)
+            except subprocess.TimeoutExpired:
+                await asyncio.to_thread(_remove_clone, path)
+                _remove_manifest_entry(key)
+                raise CloneError(f"Timed out cloning {url}")
+            except asyncio.CancelledError:
+                # An interrupted fetch leaves the old checkout, which the next
+                # sync repairs; an interrupted first clone leaves nothing worth
+                # keeping. Removed in place, as awaiting here could be cancelled too.
+                if not get_manifest_entry(key).get('sha'):
+                    _remove_clone(path)
+                    _remove_manifest_entry(key)
+                raise
+    await asyncio.to_thread(evict, key)
+
+
+def _open_key(url: str, branch: str):
+    try:
+        key = cache_key(url, branch)
+    except ValueError as e:
+        raise CloneError(str(e))
+    return key, entry_path(key)
+
+
+# Concurrent syncs of the same entry within this process share one git run
+_inflight = SingleFlight()
+_inflight_async = AsyncSingleFlight()
+
+
+@contextmanager
+def open_repo(url: str, branch: str = None):
+    """
+    Make sure a fresh clone of the repository is cached and yield it.
+
+    Entries checked against the remote within REPO_FRESHNESS_TTL are used
+    as-is; older ones are compared with `git ls-remote` and only fetched when
+    the remote SHA has moved.
+
+    With REPO_PARTIAL_CLONE the clone is blobless and nothing is checked
+    out; callers read files through git_reader, which fetches only the blobs
+    they ask for.
+
+    The entry is held under a shared lock for the duration of the block, so
+    it can't be evicted or rewritten while the caller is reading it.
+    """
+    key, path = _open_key(url, branch)
+
+    # The entry can be evicted between dropping the exclusive lock and taking
+    # the shared one; retry a few times if that happens.
+    for _ in range(3):
+        if not _fresh_hit(key, path):
+            _inflight.do(key, lambda: run_sync(_ensure_synced(url, branch, key, path)))
+
+        lock = entry_lock(key, shared=True)
+        lock.acquire()
+        if os.path.isdir(path):
+            break
+        lock.release()
+    else:
+        raise CloneError(f"Failed to clone {url}")
+
+    try:
+        entry = update_manifest(key, last_access=time.time())
+        yield CachedRepo(key=key, path=path, sha=entry.get('sha'))
+    finally:
+        lock.release()
+
+
+@asynccontextmanager
+async def open_repo_async(url: str, branch: str = None):
+    """
+    open_repo for async views.
+
+    Concurrent requests for the same entry share one sync, which is only
+    cancelled (stopping git and discarding a partial first clone) once
+    every request waiting on it has gone.
+    """
+    key, path = _open_key(url, branch)
+
+    for _ in range(3):
+        if not _fresh_hit(key, path):
+            await _inflight_async.do(key, lambda: _ensure_synced(url, branch, key, path))
+
+        lock = entry_lock(key, shared=True)
+        async with _locked(lock):
+            if os.path.isdir(path):
+                entry = update_manifest(key, last_access=time.time())
+                yield CachedRepo(key=key, path=path, sha=entry.get('sha'))
+                return
+    raise CloneError(f"Failed to clone {url}")
@@ -0,0 +1,359 @@
+"""
+Fair scheduling of model calls across clients and worker processes.
+
+Every model call takes a ticket first. Tickets are ordered by start-time
+fair queuing: a client's tickets get virtual tags that advance by the
+tokens the client asked for divided by its weight. A client with a
+200-file batch therefore queues behind its own earlier work, while a new
+client's first call starts at the current virtual time and goes next.
+Batch work (background jobs, large selections) has a lower weight, so it
+soaks up the capacity interactive requests leave.
+
+The eligible ticket with the smallest tag is dispatched once four things
+hold:
+- the global requests-per-minute and tokens-per-minute buckets (the API
+  quota) have room;
+- no quota backoff is in effect;
+- the client's own bucket has a request left;
+- its worker has a free concurrency slot.
+
+State is a JSON file under REPO_CACHE_DIR behind a file lock, so every
+worker process on the host shares one queue and one budget. Threads whose
+worker has no free slot wait on an in-process condition rather than
+polling that file; the others poll it with backoff while tickets ahead of
+theirs go first, and wake early whenever a call of their own process
+starts or finishes. A quota error
+pauses dispatch for all workers with exponential backoff. Token
+reservations are estimates, settled against the usage the backend reports
+once the call finishes.
+"""
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from .files import write_json
+from .repo_cache import FileLock
+
+INTERACTIVE, BATCH = 'interactive', 'batch'
+# Share of capacity per kind of work when both are waiting
+WEIGHTS = {INTERACTIVE: 1.0, BATCH: 0.25}
+
+DEFAULT_CLIENT = 'anonymous'
+
+# Waiting tickets are marked as seen every SEEN_EVERY seconds; one not seen
+# for STALE_AFTER belonged to a process that died and is dropped
+STALE_AFTER = 15
+SEEN_EVERY = 5
+POLL_MIN = 0.02
+POLL_MAX = 0.5
+MAX_BACKOFF = 60
+
+
+class QueueTimeout(Exception):
+    """Raised when a ticket isn't dispatched within its timeout"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class Limits:
+    rpm: int = 0
+    tpm: int = 0
+    client_rpm: int = 0
+    concurrency: int = 4
+
+
+@dataclass
+class Ticket:
+    id: str
+    client: str
+    cost: int
+
+
+# =============================================================================
+# TOKEN BUCKETS
+# =============================================================================
+# Buckets are {'level', 'at'} dicts in the shared state; per_minute 0 means unlimited.
+
+def _capacity(per_minute: float, burst_seconds: float) -> float:
+    return max(1.0, per_minute * burst_seconds / 60)
+
+
+def _refill(bucket: dict, per_minute: float, capacity: float, now: float):
+    elapsed = max(0.0, now - bucket['at'])
+    bucket['level'] = min(capacity, bucket['level'] + elapsed * per_minute / 60)
+    bucket['at'] = now
+
+
+def _wait_for(bucket: dict, amount: float, per_minute: float) -> float:
+    """Seconds until the bucket holds amount"""
+    missing = amount - bucket['level']
+    return missing * 60 / per_minute if missing > 0 else 0.0
+
+
+def _new_bucket(capacity: float, now: float) -> dict:
+    return {'level': capacity, 'at': now}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# =============================================================================
+# SCHEDULER
+# =============================================================================
+
+class Scheduler:
+    """Shared fair queue and budget for one model backend"""
+
+    # The global budget may be spent a full minute at once, like the API's
+    # per-minute quota; a client gets fifteen seconds' worth
+    GLOBAL_BURST = 60
+    CLIENT_BURST = 15
+
+    def __init__(self, name: str, limits: Limits):
+        self.name = name
+        self.limits = limits
+        # Calls this process is running; notified when one starts or finishes
+        self._local = threading.Condition()
+        self._running = 0
+
+    def _path(self, suffix: str) -> str:
+        state_dir = os.path.join(settings.REPO_CACHE_DIR, 'llm')
+        os.makedirs(state_dir, exist_ok=True)
+        return os.path.join(state_dir, f"{self.name}.{suffix}")
+
+    def _load(self) -> dict:
+        try:
+            with open(self._path('json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'vtime': 0.0, 'backoff_until': 0.0, 'strikes': 0,
+                    'rpm': None, 'tpm': None, 'clients': {}, 'queue': {}, 'running': {}}
+
+    def _save(self, state: dict):
+        write_json(self._path('json'), state, separators=(',', ':'))
+
+    @contextmanager
+    def _state(self, write: bool = True):
+        with FileLock(self._path('lock')):
+            state = self._load()
+            yield state
+            if write:
+                self._save(state)
+
+    @contextmanager
+    def _poll_state(self):
+        """Like _state, but saved only if the block sets state['changed']"""
+        with FileLock(self._path('lock')):
+            state = self._load()
+            yield state
+            if state.pop('changed', False):
+                self._save(state)
+
+    def _refill_all(self, state: dict, now: float):
+        limits = self.limits
+        for name, per_minute in (('rpm', limits.rpm), ('tpm', limits.tpm)):
+            if per_minute:
+                capacity = _capacity(per_minute, self.GLOBAL_BURST)
+                state[name] = state[name] or _new_bucket(capacity, now)
+                _refill(state[name], per_minute, capacity, now)
+        if limits.client_rpm:
+            capacity = _capacity(limits.client_rpm, self.CLIENT_BURST)
+            for client in state['clients'].values():
+                _refill(client['bucket'], limits.client_rpm, capacity, now)
+
+    def _expire(self, state: dict, now: float) -> bool:
+        """Drop tickets of dead processes and clients with nothing left to remember; True if any were"""
+        expired = False
+        for ticket_id, ticket in list(state['queue'].items()):
+            if now - ticket['seen'] > STALE_AFTER:
+                del state['queue'][ticket_id]
+                expired = True
+        for ticket_id, running in list(state['running'].items()):
+            if not _pid_alive(running['pid']):
+                del state['running'][ticket_id]
+                expired = True
+        waiting = {ticket['client'] for ticket in state['queue'].values()}
+        capacity = _capacity(self.limits.client_rpm, self.CLIENT_BURST)
+        for name, client in list(state['clients'].items()):
+            idle = name not in waiting and client['finish'] <= state['vtime']
+            if idle and (not self.limits.client_rpm or client['bucket']['level'] >= capacity):
+                del state['clients'][name]
+                expired = True
+        return expired
+
+    def _client(self, state: dict, name: str, now: float) -> dict:
+        client = state['clients'].get(name)
+        if client is None:
+            capacity = _capacity(self.limits.client_rpm, self.CLIENT_BURST) if self.limits.client_rpm else 1
+            client = state['clients'][name] = {'finish': state['vtime'], 'bucket': _new_bucket(capacity, now)}
+        return client
+
+    def _enqueue(self, state: dict, ticket: Ticket, kind: str, now: float):
+        client = self._client(state, ticket.client, now)
+        start = max(state['vtime'], client['finish'])
+        client['finish'] = start + ticket.cost / WEIGHTS[kind]
+        state['queue'][ticket.id] = {
+            'client': ticket.client, 'start': start, 'tag': client['finish'],
+            'cost': ticket.cost, 'pid': os.getpid(), 'seen': now,
+        }
+
+    def _try_dispatch(self, state: dict, ticket: Ticket, kind: str, now: float) -> tuple:
+        """
+        Dispatch the ticket if it's its turn; returns (seconds to wait, 0 if
+        dispatched or None while other tickets go first, and whether the
+        state needs saving).
+
+        Refilling buckets needs no save, since any later refill reaches the
+        same level; a ticket still waiting only rewrites the state to mark
+        itself seen every SEEN_EVERY seconds.
+        """
+        changed = self._expire(state, now)
+        if ticket.id not in state['queue']:
+            # Expired while this process was stalled; queue it again
+            self._enqueue(state, ticket, kind, now)
+            changed = True
+        if now - state['queue'][ticket.id]['seen'] >= SEEN_EVERY:
+            state['queue'][ticket.id]['seen'] = now
+            changed = True
+        self._refill_all(state, now)
+
+        if now < state['backoff_until']:
+            return state['backoff_until'] - now, changed
+
+        running = {}
+        for entry in state['running'].values():
+            running[entry['pid']] = running.get(entry['pid'], 0) + 1
+
+        def ready(entry: dict) -> bool:
+            if running.get(entry['pid'], 0) >= self.limits.concurrency:
+                return False
+            if self.limits.client_rpm:
+                client = state['clients'].get(entry['client'])
+                return client is None or client['bucket']['level'] >= 1
+            return True
+
+        mine = state['queue'][ticket.id]
+        if not ready(mine):
+            if self.limits.client_rpm and running.get(mine['pid'], 0) < self.limits.concurrency:
+                return _wait_for(state['clients'][ticket.client]['bucket'], 1, self.limits.client_rpm), changed
+            return None, changed
+        head = min((entry['tag'], ticket_id) for ticket_id, entry in state['queue'].items() if ready(entry))
+        if head[1] != ticket.id:
+            return None, changed
+
+        # Our turn; wait for the global budget
+        cost = ticket.cost
+        waits = [0.0]
+        if self.limits.rpm:
+            waits.append(_wait_for(state['rpm'], 1, self.limits.rpm))
+        if self.limits.tpm:
+            # A call larger than the bucket can only ever wait for a full one
+            cost = min(cost, _capacity(self.limits.tpm, self.GLOBAL_BURST))
+            waits.append(_wait_for(state['tpm'], cost, self.limits.tpm))
+        if max(waits) > 0:
+            return max(waits), changed
+
+        if self.limits.rpm:
+            state['rpm']['level'] -= 1
+        if self.limits.tpm:
+            state['tpm']['level'] -= cost
+        if self.limits.client_rpm:
+            state['clients'][ticket.client]['bucket']['level'] -= 1
+        state['vtime'] = max(state['vtime'], mine['start'])
+        del state['queue'][ticket.id]
+        state['running'][ticket.id] = {'pid': os.getpid(), 'tokens': cost, 'started': now}
+        return 0.0, True
+
+    def acquire(self, client: str, cost: int, kind: str = INTERACTIVE, timeout: float = None) -> Ticket:
+        """Wait for a ticket's turn; raises QueueTimeout after timeout seconds"""
+        ticket = Ticket(uuid.uuid4().hex, client or DEFAULT_CLIENT, max(1, int(cost)))
+        now = time.time()
+        deadline = now + timeout if timeout else None
+        with self._state() as state:
+            self._enqueue(state, ticket, kind, now)
+
+        poll = POLL_MIN
+        while True:
+            now = time.time()
+            with self._poll_state() as state:
+                wait, state['changed'] = self._try_dispatch(state, ticket, kind, now)
+                if wait is None:
+                    wait, poll = poll, min(poll * 2, POLL_MAX)
+                else:
+                    poll = POLL_MIN
+                if wait <= 0:
+                    self._add_running(1)
+                    return ticket
+                expired = deadline is not None and now + min(wait, POLL_MIN) >= deadline
+                if expired:
+                    state['queue'].pop(ticket.id, None)
+                    state['changed'] = True
+            if expired:
+                raise QueueTimeout(f"Model busy; no capacity within {timeout:.0f}s", retry_after=max(wait, POLL_MAX))
+            with self._local:
+                if self._running >= self.limits.concurrency:
+                    # No call of this process can start before one of its own
+                    # finishes, which wakes us; else look again to stay seen
+                    wait = SEEN_EVERY
+                else:
+                    wait = min(max(wait, POLL_MIN), POLL_MAX)
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                self._local.wait(wait)
+
+    def _add_running(self, calls: int):
+        with self._local:
+            self._running += calls
+            self._local.notify_all()
+
+    def release(self, ticket: Ticket, tokens: int = None, quota_error: bool = False,
+                retry_after: float = None) -> float:
+        """
+        Finish a dispatched ticket.
+
+        tokens settles the reservation against actual usage. A quota error
+        pauses dispatch for every worker; returns that pause in seconds.
+        """
+        now = time.time()
+        try:
+            with self._state() as state:
+                running = state['running'].pop(ticket.id, None)
+                if running and tokens is not None and self.limits.tpm and state['tpm']:
+                    capacity = _capacity(self.limits.tpm, self.GLOBAL_BURST)
+                    state['tpm']['level'] = min(capacity, state['tpm']['level'] + running['tokens'] - tokens)
+                if not quota_error:
+                    state['strikes'] = 0
+                    return 0.0
+                state['strikes'] += 1
+                delay = retry_after or min(2 ** state['strikes'], MAX_BACKOFF) * (0.5 + random.random())
+                state['backoff_until'] = max(state['backoff_until'], now + delay)
+                return state['backoff_until'] - now
+        finally:
+            # Waiting calls of this process poll again once the slot is free
+            self._add_running(-1)
+
+    def snapshot(self) -> dict:
+        """Queue length, calls running and remaining backoff, across all workers"""
+        with self._state(write=False) as state:
+            return {
+                'queued': len(state['queue']),
+                'running': len(state['running']),
+                'backoff': max(0.0, state['backoff_until'] - time.time()),
+            }
@@ -0,0 +1,71 @@
+"""
+In-process request coalescing.
+
+SingleFlight.do(key, fn) runs fn once per key at a time: the first caller
+executes it and every concurrent caller with the same key waits for and
+shares that result (or exception) instead of repeating the work.
+
+AsyncSingleFlight does the same for coroutines on an event loop. The shared
+call runs as its own task, so one caller being cancelled doesn't cancel it
+for the others; it is only cancelled once every caller has gone.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        # Tasks belong to one event loop; keep separate flights per loop
+        key = (asyncio.get_running_loop(), key)
+        call = self._calls.get(key)
+        # A call being cancelled may still be cleaning up; don't join it
+        if call is None or call['cancelled']:
+            call = self._calls[key] = {'task': asyncio.ensure_future(fn()), 'waiters': 0, 'cancelled': False}
+            call['task'].add_done_callback(lambda _: self._forget(key, call))
+
+        call['waiters'] += 1
+        try:
+            return await asyncio.shield(call['task'])
+        finally:
+            call['waiters'] -= 1
+            if not call['waiters'] and not call['task'].done():
+                # Nobody is left to use the result
+                call['cancelled'] = True
+                call['task'].cancel()
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,94 @@
+import os
+from unittest import mock
+
+from django.test import Client, SimpleTestCase
+
+from repoanalyze import analytics, repo_cache
+from repoanalyze.benchmark import RepoSpec, make_repo
+
+from .utils import CacheDirMixin, add_commit, git
+
+
+class AnalyticsTests(CacheDirMixin, SimpleTestCase):
+    spec = RepoSpec(files=6, commits=8)
+
+    def setUp(self):
+        super().setUp()
+        self.repo_path = make_repo(self.root, self.spec)
+        self.repo_url = f"file://{self.repo_path}"
+        self.key = repo_cache.cache_key(self.repo_url)
+        analytics._recent.clear()
+        self.addCleanup(analytics._recent.clear)
+
+    def expire(self):
+        repo_cache.update_manifest(self.key, checked_at=0)
+
+    def from_scratch(self) -> dict:
+        """Aggregates recomputed without anything stored"""
+        analytics._recent.clear()
+        os.remove(analytics._stats_path(self.key))
+        return analytics.get_stats(self.repo_url)
+
+    def test_totals_match_git(self):
+        stats = analytics.get_stats(self.repo_url)
+        self.assertEqual(stats['head'], git(self.repo_path, 'rev-parse', 'HEAD'))
+        self.assertEqual(stats['commits'], int(git(self.repo_path, 'rev-list', '--count', '--no-merges', 'HEAD')))
+        added = sum(int(line.split()[0]) for line in
+                    git(self.repo_path, 'log', '--no-merges', '--numstat', '--format=').splitlines() if line)
+        self.assertEqual(stats['added'], added)
+        self.assertEqual(sum(week['commits'] for week in stats['weeks'].values()), stats['commits'])
+
+        summary = analytics.summarize(stats, top=2)
+        self.assertEqual(len(summary['hotspots']), 2)
+        self.assertEqual(summary['total_files'], len(stats['files']))
+        self.assertEqual(summary['weekly'], sorted(summary['weekly'], key=lambda week: week['week']))
+
+    def test_new_commits_are_folded_in_incrementally(self):
+        analytics.get_stats(self.repo_url)
+        head = add_commit(self.repo_path, {'notes.txt': 'one\ntwo\n'})
+        self.expire()
+        with mock.patch.object(analytics, 'fold', wraps=analytics.fold) as fold:
+            stats = analytics.get_stats(self.repo_url)
+        self.assertEqual(fold.call_count, 1)
+        self.assertEqual(stats['head'], head)
+        self.assertEqual(stats['files']['notes.txt'], {'commits': 1, 'added': 2, 'deleted': 0})
+        self.assertEqual(stats, self.from_scratch())
+
+    def test_repeated_request_reads_nothing(self):
+        analytics.get_stats(self.repo_url)
+        with mock.patch.object(analytics, 'iter_log') as iter_log:
+            analytics.get_stats(self.repo_url)
+            analytics._recent.clear()
+            analytics.get_stats(self.repo_url)
+        iter_log.assert_not_called()
+
+    def test_rewritten_history_is_rebuilt(self):
+        analytics.get_stats(self.repo_url)
+        work = os.path.join(self.root, 'work')
+        git(self.root, 'clone', '--quiet', self.repo_path, work)
+        git(work, 'reset', '--quiet', '--hard', 'HEAD~2')
+        git(work, 'commit', '--quiet', '--allow-empty', '-m', 'Rewritten')
+        git(work, 'push', '--quiet', '--force', 'origin', 'HEAD:main')
+        self.expire()
+
+        stats = analytics.get_stats(self.repo_url)
+        self.assertEqual(stats['head'], git(work, 'rev-parse', 'HEAD'))
+        self.assertEqual(stats['commits'], int(git(work, 'rev-list', '--count', '--no-merges', 'HEAD')))
+
+    def test_view(self):
+        response = Client().post('/repoanalyze/get_repository_analytics/', {'input': self.repo_url, 'top': 1},
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['commit'], git(self.repo_path, 'rev-parse', 'HEAD'))
+        self.assertEqual(len(data['authors']), 1)
+
+
+class ShallowCloneTests(CacheDirMixin, SimpleTestCase):
+    def test_shallow_clone_is_deepened_for_the_first_run(self):
+        repo_path = make_repo(self.root, RepoSpec(files=3, commits=repo_cache.CLONE_DEPTH + 5))
+        with repo_cache.open_repo(f"file://{repo_path}") as repo:
+            self.assertTrue(repo_cache.is_shallow(repo.path))
+        stats = analytics.get_stats(f"file://{repo_path}")
+        self.assertEqual(stats['commits'], int(git(repo_path, 'rev-list', '--count', '--no-merges', 'HEAD')))
+        self.assertFalse(repo_cache.is_shallow(repo.path))
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import uuid
+
+from django.test import AsyncClient, Client, SimpleTestCase, TransactionTestCase, override_settings
+
+from repoanalyze.middleware import AsyncWhiteNoiseMiddleware
+from repoanalyze.models import Job
+from repoanalyze.threads import aiter_in_thread, run_in_thread
+
+
+async def read_streaming(response) -> bytes:
+    return b''.join([chunk async for chunk in response.streaming_content])
+
+
+class StaticFilesTests(SimpleTestCase):
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+        with open(os.path.join(self.static_root, 'app.css'), 'w') as f:
+            f.write('body { color: red; }\n' * 100)
+
+    def test_middleware_is_async_capable(self):
+        self.assertTrue(AsyncWhiteNoiseMiddleware.async_capable)
+        self.assertTrue(AsyncWhiteNoiseMiddleware.sync_capable)
+
+    def test_serves_static_files_under_wsgi(self):
+        with override_settings(STATIC_ROOT=self.static_root):
+            response = Client().get('/static/app.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'body { color: red; }\n' * 100)
+
+    async def test_serves_static_files_as_async_stream_under_asgi(self):
+        with override_settings(STATIC_ROOT=self.static_root):
+            response = await AsyncClient().get('/static/app.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(await read_streaming(response), b'body { color: red; }\n' * 100)
+
+
+class ThreadTests(SimpleTestCase):
+    async def test_run_in_thread_returns_result(self):
+        self.assertEqual(await run_in_thread(sum, [1, 2, 3]), 6)
+
+    async def test_aiter_in_thread_closes_generator(self):
+        closed = []
+
+        def numbers():
+            try:
+                yield from range(10)
+            finally:
+                closed.append(True)
+
+        stream = aiter_in_thread(numbers())
+        self.assertEqual([await anext(stream), await anext(stream)], [0, 1])
+        await stream.aclose()
+        # The close is handed to the pool
+        for _ in range(50):
+            if closed:
+                break
+            await run_in_thread(lambda: None)
+        self.assertEqual(closed, [True])
+
+
+class AsyncViewTests(TransactionTestCase):
+    async def test_job_status(self):
+        job = await run_in_thread(Job.objects.create, kind='docstrings', status=Job.SUCCEEDED,
+                                  result={'output': 'done'})
+        response = await AsyncClient().get(f'/repoanalyze/jobs/{job.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['result'], {'output': 'done'})
+
+        response = await AsyncClient().get(f'/repoanalyze/jobs/{uuid.uuid4()}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_job_status_under_wsgi(self):
+        response = Client().get(f'/repoanalyze/jobs/{uuid.uuid4()}/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_serve_docs_missing_build(self):
+        response = await AsyncClient().get(f'/repoanalyze/docs/{"0" * 32}/index.html')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+
+from repoanalyze import benchmark
+from repoanalyze.benchmark import RepoSpec, make_repo
+
+from .utils import CacheDirMixin, git
+
+
+class SyntheticRepoTests(CacheDirMixin, SimpleTestCase):
+    def test_same_spec_gives_the_same_repository(self):
+        spec = RepoSpec(files=12, commits=4, manifests=('requirements.txt', 'package.json'))
+        first = make_repo(os.path.join(self.root, 'a'), spec)
+        second = make_repo(os.path.join(self.root, 'b'), spec)
+        self.assertEqual(git(first, 'rev-parse', 'HEAD'), git(second, 'rev-parse', 'HEAD'))
+        self.assertEqual(git(first, 'rev-list', '--count', 'HEAD'), '4')
+        self.assertIn('package.json', git(first, 'ls-tree', '--name-only', 'HEAD').split())
+
+        other = make_repo(os.path.join(self.root, 'c'), RepoSpec(files=12, commits=4, seed=1))
+        self.assertNotEqual(git(other, 'rev-parse', 'HEAD'), git(first, 'rev-parse', 'HEAD'))
+
+    def test_generated_modules_parse(self):
+        path = make_repo(self.root, RepoSpec(files=5, commits=1))
+        for name in git(path, 'ls-tree', '-r', '--name-only', 'HEAD').split():
+            if name.endswith('.py'):
+                compile(git(path, 'show', f'HEAD:{name}'), name, 'exec')
+
+
+class StatisticsTests(SimpleTestCase):
+    def test_nearest_rank_percentiles(self):
+        values = [i / 1000 for i in range(1, 101)]
+        summary = benchmark.summarize_latencies(values)
+        self.assertEqual((summary['p50'], summary['p95'], summary['p99']), (50.0, 95.0, 99.0))
+        self.assertEqual((summary['min'], summary['max']), (1.0, 100.0))
+        self.assertIsNone(benchmark.summarize_latencies([])['p50'])
+
+
+class CommandTests(CacheDirMixin, SimpleTestCase):
+    def test_invalid_options(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark', manifests='Gemfile')
+        with self.assertRaises(CommandError):
+            call_command('benchmark', concurrency='0')
+        with self.assertRaises(CommandError):
+            call_command('benchmark', scenarios='nothing')
+
+    def test_run_writes_results(self):
+        output = os.path.join(self.root, 'results.json')
+        subprocess.run(
+            [sys.executable, 'manage.py', 'benchmark', '--files', '10', '--commits', '3', '--concurrency', '1,2',
+             '--requests', '2', '--scenarios', 'get_dependencies', '--model-latency', '0', '--output', output],
+            cwd=settings.BASE_DIR, capture_output=True, check=True, timeout=300,
+        )
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual([(r['scenario'], r['concurrency']) for r in report['results']],
+                         [('get_dependencies', 1), ('get_dependencies', 2)])
+        self.assertEqual([r['status'] for r in report['results']], [{'200': 2}, {'200': 2}])
+        self.assertEqual(report['config']['files'], 10)
@@ -0,0 +1,107 @@
+import json
+import os
+
+from django.test import Client, SimpleTestCase, override_settings
+
+from repoanalyze import dependencies, repo_cache
+from repoanalyze.benchmark import RepoSpec
+from repoanalyze.git_reader import get_reader
+
+from .utils import RepoTestCase, add_commit
+
+
+def summary(deps: list) -> list:
+    return [(dep.name, dep.spec, dep.kind) for dep in deps]
+
+
+class ParserTests(SimpleTestCase):
+    def test_requirements_with_includes_editables_and_hashes(self):
+        files = {'requirements/base.txt': 'requests>=2.0  # HTTP\nclick==8.1 \\\n    --hash=sha256:abc\n'}
+        text = '-r requirements/base.txt\n-e git+https://example.com/lib.git#egg=lib\n--index-url https://pypi\nDjango[argon2]<6\n'
+        deps = dependencies.parse_requirements(text, 'requirements.txt', files.get)
+        self.assertEqual(summary(deps), [
+            ('requests', '>=2.0', 'runtime'), ('click', '==8.1', 'runtime'),
+            ('lib', 'git+https://example.com/lib.git#egg=lib', 'runtime'), ('Django', '[argon2]<6', 'runtime'),
+        ])
+        self.assertEqual(dependencies.parse_requirements('pytest\n', 'requirements-dev.txt', files.get)[0].kind, 'dev')
+
+    def test_pyproject_pep621_and_poetry(self):
+        text = '''
+[project]
+dependencies = ["httpx>=0.27"]
+[project.optional-dependencies]
+cli = ["rich"]
+[tool.poetry.dependencies]
+python = "^3.11"
+pydantic = {version = "^2.0", optional = true}
+[tool.poetry.group.test.dependencies]
+pytest = "^8"
+'''
+        deps = dependencies.parse_pyproject(text, 'pyproject.toml', None)
+        self.assertEqual(summary(deps), [
+            ('httpx', '>=0.27', 'runtime'), ('rich', '', 'optional'),
+            ('pydantic', '^2.0', 'optional'), ('pytest', '^8', 'dev'),
+        ])
+
+    def test_setup_py_is_read_not_run(self):
+        text = ('import os\nos.system("exit 1")\nfrom setuptools import setup\n'
+                'setup(install_requires=["six"], extras_require={"yaml": "PyYAML"}, tests_require=get())\n')
+        deps = dependencies.parse_setup_py(text, 'setup.py', None)
+        self.assertEqual(summary(deps), [('six', '', 'runtime'), ('PyYAML', '', 'optional')])
+
+    def test_javascript_manifests(self):
+        package = json.dumps({'dependencies': {'react': '^18'}, 'devDependencies': {'jest': '^29'}})
+        self.assertEqual(summary(dependencies.parse_package_json(package, 'package.json', None)),
+                         [('react', '^18', 'runtime'), ('jest', '^29', 'dev')])
+        yarn = ('# yarn lockfile v1\n\n"@scope/pkg@^1.0.0", "@scope/pkg@^1.1":\n  version "1.2.0"\n\n'
+                'lodash@^4.17.21:\n  version "4.17.21"\n')
+        self.assertEqual([(dep.name, dep.spec) for dep in dependencies.parse_yarn_lock(yarn, 'yarn.lock', None)],
+                         [('@scope/pkg', '1.2.0'), ('lodash', '4.17.21')])
+
+    def test_go_mod(self):
+        text = 'module example.com/app\n\nrequire golang.org/x/text v0.14.0\nrequire (\n\tgithub.com/a/b v1.0.0 // indirect\n)\n'
+        deps = dependencies.parse_go_mod(text, 'go.mod', None)
+        self.assertEqual(summary(deps), [('golang.org/x/text', 'v0.14.0', 'runtime'),
+                                         ('github.com/a/b', 'v1.0.0', 'indirect')])
+        self.assertEqual({dep.ecosystem for dep in deps}, {'go'})
+
+    def test_parsers_are_found_by_file_name(self):
+        self.assertEqual(dependencies.find_parser('api/requirements-test.txt')[0], 'python')
+        self.assertEqual(dependencies.find_parser('web/package-lock.json')[0], 'npm')
+        self.assertIsNone(dependencies.find_parser('README.md'))
+
+
+class ExtractTests(RepoTestCase):
+    spec = RepoSpec(files=4, commits=1, manifests=('requirements.txt', 'package.json'))
+
+    def test_every_manifest_is_parsed_and_broken_ones_reported(self):
+        add_commit(self.repo_path, {'tools/pyproject.toml': '[project\n', 'go.mod': 'require example.com/m v1.0.0\n'})
+        response = self.post(Client(), '/repoanalyze/get_dependencies/', {'input': self.repo_url})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(sorted(data['manifests']), ['go.mod', 'package.json', 'requirements.txt', 'tools/pyproject.toml'])
+        self.assertEqual([error['source'] for error in data['errors']], ['tools/pyproject.toml'])
+        self.assertEqual({dep['ecosystem'] for dep in data['dependencies']}, {'python', 'npm', 'go'})
+        self.assertFalse(data['inferred'])
+        self.assertIn('# requirements.txt\nrequests==2.31.0', data['output'])
+
+        # Cached per commit on disk
+        cached = os.listdir(os.path.join(self.cache_dir, 'deps'))
+        self.assertEqual(cached, [f"{data['commit']}-v{dependencies.PARSER_VERSION}.json"])
+
+    @override_settings(DEPENDENCY_CACHE_MAX_FILES=2)
+    def test_cached_results_are_evicted_least_recently_used_first(self):
+        commits = [add_commit(self.repo_path, {f'new{i}.py': ''}) for i in range(3)]
+        with repo_cache.open_repo(self.repo_url) as repo:
+            reader = get_reader(repo.path)
+            for commit in commits[:2]:
+                dependencies.extract(reader, commit)
+            os.utime(dependencies._cache_path(commits[0]), (1, 1))
+            os.utime(dependencies._cache_path(commits[1]), (2, 2))
+            # A hit on disk counts as a use
+            dependencies._results.clear()
+            dependencies.extract(reader, commits[0])
+            dependencies.extract(reader, commits[2])
+
+        self.assertEqual(sorted(os.listdir(dependencies._cache_dir())),
+                         sorted(os.path.basename(dependencies._cache_path(c)) for c in (commits[0], commits[2])))
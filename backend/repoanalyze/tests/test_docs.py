@@ -0,0 +1,226 @@
+import io
+import json
+import os
+import zipfile
+from unittest import mock
+
+from django.test import AsyncClient, Client, SimpleTestCase, override_settings
+
+from repoanalyze import docs_build
+from repoanalyze.benchmark import RepoSpec, make_repo
+
+from .utils import CacheDirMixin, git
+
+API = '/repoanalyze/'
+BUILD_ID = 'a' * 32
+
+
+def make_build(key: str = BUILD_ID, pages: dict = None) -> str:
+    """A finished build on disk, without running Sphinx"""
+    build_dir = docs_build.build_path(key)
+    pages = pages or {'index.html': '<h1>Index</h1>', '_static/site.css': 'body {}'}
+    for rel_path, text in pages.items():
+        path = os.path.join(build_dir, 'html', rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+    with open(os.path.join(build_dir, docs_build.BUILD_META), 'w') as f:
+        json.dump({'key': key, 'commit': '0' * 40, 'files_documented': 1}, f)
+    return build_dir
+
+
+class ZipDownloadTests(CacheDirMixin, SimpleTestCase):
+    async def test_zip_is_streamed_asynchronously_under_asgi(self):
+        make_build()
+        response = await AsyncClient().get(f'{API}download_documentation/{BUILD_ID}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['_static/site.css', 'index.html'])
+            self.assertEqual(archive.read('index.html'), b'<h1>Index</h1>')
+
+    def test_zip_download_by_build_id_under_wsgi(self):
+        make_build()
+        response = Client().post(f'{API}download_documentation/', json.dumps({'input': BUILD_ID}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertIn('index.html', archive.namelist())
+
+    def test_unknown_build(self):
+        response = Client().get(f'{API}download_documentation/{"b" * 32}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_remove_zip_endpoint_is_gone(self):
+        victim = os.path.join(self.root, 'victim.txt')
+        open(victim, 'w').close()
+        response = Client().post(f'{API}remove_zip/', json.dumps({'input': victim}), content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(os.path.exists(victim))
+
+
+class FileResponseTests(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.build_dir = make_build()
+        self.data = bytes(range(256)) * 4
+        with open(os.path.join(self.build_dir, docs_build.ZIP_NAME), 'wb') as f:
+            f.write(self.data)
+
+    async def test_prebuilt_zip_is_streamed_asynchronously(self):
+        response = await AsyncClient().get(f'{API}download_documentation/{BUILD_ID}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.data)
+
+    async def test_range_request(self):
+        response = await AsyncClient().get(f'{API}download_documentation/{BUILD_ID}/', headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.data[10:20])
+
+    def test_suffix_range_and_unsatisfiable_range(self):
+        response = Client().get(f'{API}download_documentation/{BUILD_ID}/', headers={'Range': 'bytes=-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[-5:])
+
+        response = Client().get(f'{API}download_documentation/{BUILD_ID}/', headers={'Range': 'bytes=5000-'})
+        self.assertEqual(response.status_code, 416)
+
+    def test_stale_if_range_sends_the_whole_file(self):
+        response = Client().get(f'{API}download_documentation/{BUILD_ID}/',
+                                headers={'Range': 'bytes=10-19', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+    async def test_docs_page_is_streamed_asynchronously(self):
+        response = await AsyncClient().get(f'{API}docs/{BUILD_ID}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'<h1>Index</h1>')
+
+    def test_docs_precompressed_variant_and_revalidation(self):
+        with open(os.path.join(self.build_dir, 'html', 'index.html.gz'), 'wb') as f:
+            f.write(b'gzipped')
+        response = Client().get(f'{API}docs/{BUILD_ID}/index.html', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(b''.join(response.streaming_content), b'gzipped')
+
+        response = Client().get(f'{API}docs/{BUILD_ID}/index.html',
+                                headers={'Accept-Encoding': 'gzip', 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_docs_path_outside_build(self):
+        response = Client().get(f'{API}docs/{BUILD_ID}/../{docs_build.BUILD_META}')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(DOCS_CACHE_MAX_BUILDS=1, DOCS_CACHE_MAX_WORKSPACES=1)
+class EvictionTests(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.old = make_build('b' * 32, {'index.html': '<h1>Old</h1>'})
+        os.utime(os.path.join(self.old, docs_build.BUILD_META), (1, 1))
+        make_build()
+
+    def test_least_recently_used_build_is_evicted(self):
+        docs_build.evict()
+        self.assertFalse(os.path.exists(self.old))
+        self.assertTrue(docs_build.find_build(BUILD_ID))
+
+    def test_build_being_read_is_kept(self):
+        with docs_build.build_lock('b' * 32, shared=True):
+            docs_build.evict()
+            self.assertTrue(os.path.exists(self.old))
+        docs_build.evict()
+        self.assertFalse(os.path.exists(self.old))
+
+    def test_zip_stream_holds_the_build(self):
+        stream = docs_build.stream_zip('b' * 32)
+        chunks = [next(stream)]
+        docs_build.evict()
+        self.assertTrue(os.path.exists(self.old))
+        chunks.extend(stream)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.read('index.html'), b'<h1>Old</h1>')
+        docs_build.evict()
+        self.assertFalse(os.path.exists(self.old))
+
+    def test_page_response_survives_eviction(self):
+        response = Client().get(f'{API}docs/{"b" * 32}/index.html')
+        docs_build.evict()
+        self.assertFalse(os.path.exists(self.old))
+        self.assertEqual(b''.join(response.streaming_content), b'<h1>Old</h1>')
+
+    def test_least_recently_built_workspace_is_evicted(self):
+        old = docs_build.workspace_path('https://github.com/example/old')
+        new = docs_build.workspace_path('https://github.com/example/new')
+        for path, mtime in ((old, 1), (new, 2)):
+            os.makedirs(os.path.join(path, 'doctrees'))
+            os.utime(path, (mtime, mtime))
+
+        with docs_build._workspace_lock(os.path.basename(old)):
+            docs_build.evict_workspaces()
+            self.assertTrue(os.path.exists(old))
+        docs_build.evict_workspaces()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+
+class BuildTests(CacheDirMixin, SimpleTestCase):
+    repo_url = 'https://github.com/example/project'
+    sources = {
+        'project/__init__.py': b'',
+        'project/core.py': b'def answer():\n    """The answer."""\n    return 42\n',
+        'project/util.py': b'def helper():\n    """Help."""\n',
+    }
+
+    def test_build_is_published_and_reused(self):
+        cwd = os.getcwd()
+        meta = docs_build.build(self.repo_url, 'c1', 'project', self.sources)
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(meta['files_documented'], 2)
+        html = os.path.join(docs_build.build_path(meta['key']), 'html')
+        with open(os.path.join(html, 'index.html')) as f:
+            self.assertIn('project', f.read())
+        self.assertTrue(os.path.exists(os.path.join(html, 'index.html.gz')))
+        self.assertTrue(os.path.exists(os.path.join(html, 'index.html.br')))
+
+        self.assertEqual(docs_build.build(self.repo_url, 'c1', 'project', {}), meta)
+
+    def test_next_commit_rewrites_only_changed_sources(self):
+        docs_build.build(self.repo_url, 'c1', 'project', self.sources)
+        changed = {**self.sources, 'project/util.py': b'def helper():\n    """Help more."""\n'}
+        meta = docs_build.build(self.repo_url, 'c2', 'project', changed)
+        self.assertEqual(meta['changed_files'], 1)
+        self.assertTrue(docs_build.find_build(docs_build.build_key(self.repo_url, 'c1')))
+
+    @override_settings(DOCS_BUILD_WORKERS=0, DOCS_BUILD_QUEUE=0)
+    def test_full_queue_is_refused(self):
+        with self.assertRaises(docs_build.BuildQueueFull):
+            docs_build.build_in_pool(self.repo_url, 'c1', 'project', queued=self.fail)
+
+
+class BuildPoolTests(CacheDirMixin, SimpleTestCase):
+    def test_build_runs_in_a_worker_process(self):
+        repo_path = make_repo(self.root, RepoSpec(files=4, commits=1))
+        repo_url = f"file://{repo_path}"
+        # Pool workers are spawned and read their settings from the environment
+        with mock.patch.dict(os.environ, {'REPO_CACHE_DIR': self.cache_dir, 'DOCS_BUILD_WORKERS': '1'}):
+            self.addCleanup(self.stop_pool)
+            queued = mock.Mock()
+            meta = docs_build.build_in_pool(repo_url, git(repo_path, 'rev-parse', 'HEAD'), 'synthetic',
+                                            queued=queued)
+        queued.assert_called_once_with()
+        self.assertEqual(meta['commit'], git(repo_path, 'rev-parse', 'HEAD'))
+        self.assertTrue(docs_build.find_build(meta['key']))
+
+    def stop_pool(self):
+        if docs_build._pool is not None:
+            docs_build._pool.shutdown()
+            docs_build._pool = None
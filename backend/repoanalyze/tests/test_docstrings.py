@@ -0,0 +1,232 @@
+import json
+from unittest import mock
+
+from django.test import AsyncClient, Client, SimpleTestCase, override_settings
+
+from repoanalyze import docstrings, llm
+
+from .utils import RepoTestCase
+
+API = '/repoanalyze/'
+
+
+class DocstringStreamTests(RepoTestCase):
+    def python_files(self, client=None) -> list:
+        response = self.post(client or Client(), f'{API}get_files_from_repository/', {'input': self.repo_url})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['output']
+
+    async def test_ndjson_stream_is_async_under_asgi(self):
+        client = AsyncClient()
+        files = (await self.post(client, f'{API}get_files_from_repository/', {'input': self.repo_url})).json()['output']
+        response = await self.post(client, f'{API}generate_doc_strings/', {'input': files[:3], 'stream': 'ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        events = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(events[0]['event'], 'start')
+        self.assertEqual(events[-1]['event'], 'summary')
+        results = [event for event in events if event['event'] == 'result']
+        self.assertEqual(sorted(event['index'] for event in results), [0, 1, 2])
+        self.assertTrue(all('content' in event for event in results))
+
+    def test_sse_stream_under_wsgi(self):
+        files = self.python_files()
+        response = self.post(Client(), f'{API}generate_doc_strings/', {'input': files[:2]},
+                             HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertFalse(response.is_async)
+
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual([line for line in body.splitlines() if line.startswith('event: ')],
+                         ['event: start', 'event: result', 'event: result', 'event: summary'])
+
+    def test_invalid_file_url_fails_before_streaming(self):
+        response = self.post(Client(), f'{API}generate_doc_strings/',
+                             {'input': ['https://example.com/a.py'], 'stream': 'ndjson'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_local_repository_links_are_refused_by_default(self):
+        files = self.python_files()
+        with override_settings(DOCSTRINGS_ALLOW_FILE_URLS=False):
+            response = self.post(Client(), f'{API}generate_doc_strings/', {'input': files[:1]})
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('content', response.content.decode())
+
+
+class ForgetfulBackend(llm.StubBackend):
+    """Stub model that leaves the first definition of every prompt out of its answer"""
+
+    def answer(self, prompt: str) -> str:
+        answer = json.loads(super().answer(prompt))
+        answer.pop(next(iter(answer)))
+        return json.dumps(answer)
+
+
+class PartialResultTests(RepoTestCase):
+    def test_partial_results_are_reported_and_not_cached(self):
+        backend = ForgetfulBackend(latency=0)
+        previous = llm.set_backend(backend)
+        self.addCleanup(llm.set_backend, previous)
+        response = self.post(Client(), f'{API}get_files_from_repository/', {'input': self.repo_url})
+        files = response.json()['output']
+
+        def results():
+            response = self.post(Client(), f'{API}generate_doc_strings/', {'input': files, 'stream': 'ndjson'})
+            events = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+            return {event['file']: event for event in events if event['event'] == 'result'}
+
+        first = results()
+        partial = {name for name, event in first.items() if event.get('undocumented')}
+        self.assertTrue(partial)
+        calls = backend.calls
+        second = results()
+        # Complete results come from the cache; partial ones go back to the model
+        self.assertGreater(backend.calls, calls)
+        self.assertLessEqual({name for name, event in second.items() if event.get('undocumented')}, partial)
+        for name in set(first) - partial:
+            self.assertEqual(second[name]['content'], first[name]['content'])
+
+
+class DocumentSourcesTests(SimpleTestCase):
+    def test_missing_definitions_are_named(self):
+        source = 'def first():\n    pass\n\n\ndef second():\n    pass\n'
+
+        def generate(prompt):
+            return json.dumps({'f0.module': 'Module.', 'f0.t1': 'First.'})
+
+        [(index, result, missing)] = docstrings.document_sources([('a.py', source)], generate)
+        self.assertIn('"""First."""', result)
+        self.assertEqual(missing, ['second'])
+
+
+class SpliceTests(SimpleTestCase):
+    source = (
+        '"""Already documented."""\n'
+        'import functools\n'
+        '\n'
+        '\n'
+        '@functools.cache\n'
+        'def cached(x):\n'
+        '    return x\n'
+        '\n'
+        '\n'
+        'class Widget:\n'
+        '    def documented(self):\n'
+        '        """Kept."""\n'
+        '\n'
+        '    async def run(self):\n'
+        '        return 1\n'
+        '\n'
+        '\n'
+        'def one_liner(): pass\n'
+    )
+
+    def test_only_undocumented_definitions_are_targets(self):
+        targets = docstrings.find_undocumented(self.source)
+        self.assertEqual([(t.kind, t.name) for t in targets],
+                         [('function', 'cached'), ('class', 'Widget'), ('function', 'Widget.run')])
+        self.assertEqual([t.indent for t in targets], ['    ', '    ', '        '])
+        # Class outlines carry signatures, not bodies
+        self.assertNotIn('Kept', targets[1].snippet)
+
+    def test_docstrings_are_spliced_at_their_definitions(self):
+        prompts = []
+
+        def generate(prompt):
+            prompts.append(prompt)
+            return json.dumps({'f0.t0': 'Cached.', 'f0.t1': 'A widget.\n\nDetails.', 'f0.t2': 'Run it.'})
+
+        result = docstrings.add_docstrings(self.source, generate)
+        self.assertEqual(len(prompts), 1)
+        self.assertNotIn('Already documented', prompts[0])
+        self.assertNotIn('Kept', prompts[0])
+        self.assertIn('def cached(x):\n    """Cached."""\n    return x\n', result)
+        self.assertIn('class Widget:\n    """A widget.\n\n    Details.\n    """\n    def documented', result)
+        self.assertIn('async def run(self):\n        """Run it."""\n        return 1\n', result)
+        compile(result, 'result.py', 'exec')
+
+    def test_fully_documented_source_makes_no_call(self):
+        source = '"""Module."""\n\n\ndef f():\n    """F."""\n'
+        self.assertEqual(docstrings.add_docstrings(source, lambda prompt: self.fail(prompt)), source)
+
+    def test_quotes_in_docstrings_are_escaped(self):
+        result = docstrings.add_docstrings('def f():\n    pass\n', lambda prompt: json.dumps(
+            {'f0.module': 'Module.', 'f0.t1': 'Uses """ and \\ safely.'}))
+        namespace = {}
+        exec(compile(result, 'result.py', 'exec'), namespace)
+        self.assertEqual(namespace['f'].__doc__, 'Uses """ and \\ safely.')
+
+    def test_trailing_quote_does_not_close_the_string(self):
+        result = docstrings.add_docstrings('def f():\n    pass\n', lambda prompt: json.dumps(
+            {'f0.module': 'Module.', 'f0.t1': 'Say "hi"'}))
+        namespace = {}
+        exec(compile(result, 'result.py', 'exec'), namespace)
+        self.assertEqual(namespace['f'].__doc__, 'Say "hi"')
+
+    def test_body_on_the_signature_line_is_skipped(self):
+        source = 'def f(a,\n      b): return a\n\n\ndef g(\n    a,\n):\n    return a\n'
+        self.assertEqual([t.name for t in docstrings.find_undocumented(source)], ['<module>', 'g'])
+
+    def test_result_that_does_not_parse_fails_the_file(self):
+        answer = json.dumps({'f0.module': 'Module.', 'f0.t1': 'F.'})
+        with mock.patch.object(docstrings, 'format_docstring', return_value='    )\n'):
+            [(_, result, missing)] = docstrings.document_sources([('m.py', 'def f():\n    pass\n')],
+                                                                 lambda prompt: answer)
+        self.assertIsInstance(result, docstrings.SpliceError)
+        self.assertEqual(missing, [])
+
+
+class PackingTests(SimpleTestCase):
+    def target(self, index: int, chars: int = 40) -> tuple:
+        return index, docstrings.Target(f't{index}', 'function', f'f{index}', 2, '    ', 'x' * chars)
+
+    @override_settings(LLM_PACK_INPUT_TOKENS=docstrings.PROMPT_OVERHEAD_TOKENS + 100, LLM_PACK_OUTPUT_TOKENS=10_000)
+    def test_packs_fit_the_input_budget_in_order(self):
+        items = [self.target(i, chars=160) for i in range(5)]
+        packs = docstrings.pack_targets(items)
+        # 41 estimated tokens each, so two per pack
+        self.assertEqual([[i for i, _ in pack] for pack in packs], [[0, 1], [2, 3], [4]])
+
+    @override_settings(LLM_PACK_OUTPUT_TOKENS=docstrings.DOCSTRING_TOKENS * 3)
+    def test_packs_fit_the_output_budget(self):
+        packs = docstrings.pack_targets([self.target(i) for i in range(7)])
+        self.assertEqual([len(pack) for pack in packs], [3, 3, 1])
+
+    @override_settings(LLM_PACK_INPUT_TOKENS=docstrings.PROMPT_OVERHEAD_TOKENS + 10)
+    def test_oversized_definition_gets_a_pack_of_its_own(self):
+        packs = docstrings.pack_targets([self.target(0, chars=1000), self.target(1)])
+        self.assertEqual(len(packs), 2)
+
+    def test_small_files_share_one_call(self):
+        backend = llm.StubBackend(latency=0)
+        calls = []
+
+        def generate(prompt):
+            calls.append(prompt)
+            return backend.answer(prompt)
+
+        # A module and a function docstring each: ten definitions
+        sources = [(f'm{i}.py', f'def f{i}():\n    pass\n') for i in range(5)]
+        results = {index: result for index, result, _ in docstrings.document_sources(sources, generate)}
+        self.assertEqual(len(calls), 1)
+        self.assertIn('(function f4 in m4.py)', calls[0])
+        self.assertEqual(sorted(results), [0, 1, 2, 3, 4])
+        self.assertTrue(all(f'"""Function f{i}.' in result for i, result in results.items()))
+
+    def test_unusable_answer_splits_the_pack(self):
+        calls = []
+
+        def generate(prompt):
+            calls.append(prompt)
+            # Packs of more than one definition get garbage back
+            if prompt.count('### ') > 1:
+                return 'Sorry, I cannot help with that.'
+            return llm.StubBackend(latency=0).answer(prompt)
+
+        sources = [('a.py', 'def f():\n    pass\n'), ('b.py', 'def g():\n    pass\n')]
+        results = list(docstrings.document_sources(sources, generate))
+        self.assertEqual([missing for _, _, missing in results], [[], []])
+        # One whole pack, then its halves down to single definitions: 1 + 2 + 4
+        self.assertEqual(len(calls), 7)
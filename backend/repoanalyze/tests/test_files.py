@@ -0,0 +1,34 @@
+import json
+import os
+
+from django.test import SimpleTestCase
+
+from repoanalyze import files
+
+from .utils import CacheDirMixin
+
+
+class WriteJsonTests(CacheDirMixin, SimpleTestCase):
+    def test_file_is_replaced(self):
+        path = os.path.join(self.root, 'state.json')
+        files.write_json(path, {'a': 1})
+        files.write_json(path, {'b': 2}, separators=(',', ':'))
+        with open(path) as f:
+            self.assertEqual(f.read(), '{"b":2}')
+        self.assertEqual(os.listdir(self.root), ['state.json'])
+
+    def test_failed_write_keeps_the_old_file_and_no_temp_file(self):
+        path = os.path.join(self.root, 'state.json')
+        files.write_json(path, {'a': 1})
+        with self.assertRaises(TypeError):
+            files.write_json(path, {'a': object()})
+        with open(path) as f:
+            self.assertEqual(json.load(f), {'a': 1})
+        self.assertEqual(os.listdir(self.root), ['state.json'])
+
+    def test_dir_size(self):
+        os.makedirs(os.path.join(self.root, 'sub'))
+        for name, size in (('a', 3), ('sub/b', 5)):
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(b'x' * size)
+        self.assertEqual(files.dir_size(self.root), 8)
@@ -0,0 +1,94 @@
+import os
+import shutil
+
+from django.test import SimpleTestCase
+
+from repoanalyze import git_reader, repo_cache
+from repoanalyze.benchmark import RepoSpec, make_repo
+
+from .test_repo_cache import local_blobs
+from .utils import CacheDirMixin, add_commit, git
+
+
+class ReadingTests(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repo_path = make_repo(self.root, RepoSpec(files=3, commits=1))
+        self.first = git(self.repo_path, 'rev-parse', 'HEAD')
+        self.second = add_commit(self.repo_path, {'requirements.txt': 'django\n'})
+        self.reader = git_reader.GitObjectReader(self.repo_path)
+        self.addCleanup(self.reader.close)
+
+    def test_files_of_several_commits_through_one_process(self):
+        old = self.reader.read_file(self.first, 'requirements.txt')
+        process = self.reader._batch.proc
+        self.assertEqual(self.reader.read_file(self.second, 'requirements.txt'), b'django\n')
+        self.assertNotEqual(old, b'django\n')
+        self.assertIs(self.reader._batch.proc, process)
+
+    def test_missing_objects(self):
+        self.assertIsNone(self.reader.read_object('0' * 40))
+        self.assertIsNone(self.reader.object_info(f'{self.second}:nothing.txt'))
+        with self.assertRaises(git_reader.GitReadError):
+            self.reader.read_file(self.second, 'nothing.txt')
+        with self.assertRaises(git_reader.GitReadError):
+            self.reader.read_blob(self.second)
+
+    def test_tree_listing_and_object_info(self):
+        entries = {entry.path: entry for entry in self.reader.list_tree(self.second)}
+        entry = entries['requirements.txt']
+        self.assertEqual(entry.type, 'blob')
+        self.assertEqual(self.reader.object_info(entry.sha), (entry.sha, 'blob', len(b'django\n')))
+        self.assertEqual(self.reader.read_blob(entry.sha), b'django\n')
+        self.assertEqual({e.type for e in self.reader.list_tree(self.second, recursive=False)}, {'blob', 'tree'})
+
+    def test_prefetch_downloads_missing_blobs_in_one_go(self):
+        with repo_cache.open_repo(f"file://{self.repo_path}") as repo:
+            reader = git_reader.get_reader(repo.path)
+            entries = [entry for entry in reader.list_tree(repo.sha) if entry.type == 'blob']
+            self.assertEqual(len(reader.missing_blobs(repo.sha)), len({entry.sha for entry in entries}))
+            reader.prefetch(repo.sha, [entry.sha for entry in entries[:2]])
+            self.assertEqual(local_blobs(repo.path), 2)
+
+    def test_pool_replaces_readers_of_replaced_repositories(self):
+        clone = os.path.join(self.root, 'clone')
+        git(self.root, 'clone', '--quiet', self.repo_path, clone)
+        reader = git_reader.get_reader(clone)
+        self.addCleanup(git_reader.close_reader, clone)
+        self.assertIs(git_reader.get_reader(clone), reader)
+
+        # Cloned before the old one goes, so the new .git can't reuse its inode
+        git(self.root, 'clone', '--quiet', self.repo_path, f'{clone}.new')
+        shutil.rmtree(clone)
+        os.rename(f'{clone}.new', clone)
+        replaced = git_reader.get_reader(clone)
+        self.assertIsNot(replaced, reader)
+        self.assertEqual(replaced.read_file(self.second, 'requirements.txt'), b'django\n')
+
+
+class ReaderProcessTests(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repo_path = make_repo(self.root, RepoSpec(files=3, commits=1))
+        self.head = git(self.repo_path, 'rev-parse', 'HEAD')
+
+    def test_dead_process_is_reaped_before_restarting(self):
+        reader = git_reader.GitObjectReader(self.repo_path)
+        self.addCleanup(reader.close)
+        reader.read_object(self.head)
+        dead = reader._batch.proc
+        dead.kill()
+        dead.wait()
+
+        self.assertEqual(reader.read_object(self.head)[1], 'commit')
+        self.assertIsNot(reader._batch.proc, dead)
+        self.assertTrue(dead.stdin.closed and dead.stdout.closed)
+
+    def test_close_all_stops_pooled_readers(self):
+        reader = git_reader.get_reader(self.repo_path)
+        reader.read_object(self.head)
+        process = reader._batch.proc
+        git_reader.close_all()
+        self.assertIsNotNone(process.returncode)
+        self.assertIsNone(reader._batch)
+        self.assertNotIn(self.repo_path, git_reader._readers)
@@ -0,0 +1,135 @@
+import json
+import os
+import time
+from unittest import mock
+
+from django.test import AsyncClient, SimpleTestCase
+
+from repoanalyze import history
+from repoanalyze.benchmark import RepoSpec, make_repo
+from repoanalyze.threads import run_sync
+
+from .utils import CacheDirMixin, git
+
+
+def commit(repo: str, name: str, when: int):
+    with open(os.path.join(repo, f'{name}.txt'), 'w') as f:
+        f.write(name)
+    git(repo, 'add', f'{name}.txt')
+    date = f'{1_600_000_000 + when * 3600} +0000'
+    git(repo, 'commit', '--quiet', '-m', name, env={'GIT_AUTHOR_DATE': date, 'GIT_COMMITTER_DATE': date})
+
+
+def make_merge_repo(root: str) -> str:
+    """
+    main:  A - B - D - M - E
+            \\         /
+    side:    C1 - C2
+
+    By date the log interleaves the branches: E M D C2 B C1 A.
+    """
+    repo = os.path.join(root, 'merges')
+    git(root, 'init', '--quiet', '--initial-branch=main', repo)
+    commit(repo, 'A', 1)
+    git(repo, 'checkout', '--quiet', '-b', 'side')
+    commit(repo, 'C1', 2)
+    git(repo, 'checkout', '--quiet', 'main')
+    commit(repo, 'B', 3)
+    git(repo, 'checkout', '--quiet', 'side')
+    commit(repo, 'C2', 4)
+    git(repo, 'checkout', '--quiet', 'main')
+    commit(repo, 'D', 5)
+    date = f'{1_600_000_000 + 6 * 3600} +0000'
+    git(repo, 'merge', '--quiet', '--no-ff', '-m', 'M', 'side',
+        env={'GIT_AUTHOR_DATE': date, 'GIT_COMMITTER_DATE': date})
+    commit(repo, 'E', 7)
+    return repo
+
+
+class PaginationTests(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repo = make_merge_repo(self.root)
+        self.url = f"file://{self.repo}"
+        self.expected = git(self.repo, 'log', '--format=%s', 'main').split()
+
+    def pages(self, limit: int, **options) -> list:
+        messages, after = [], None
+        while True:
+            page = history.get_page(self.url, after=after, limit=limit, **options)
+            messages += [c.message for c in page['commits']]
+            after = page['next_cursor']
+            if not after:
+                return messages
+
+    def test_pages_cover_merged_history_exactly_once(self):
+        self.assertEqual(self.expected, ['E', 'M', 'D', 'C2', 'B', 'C1', 'A'])
+        for limit in (1, 2, 3, 4):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.pages(limit), self.expected)
+
+    def test_pages_with_filters(self):
+        paths = ['C1.txt', 'C2.txt', 'B.txt']
+        expected = git(self.repo, 'log', '--format=%s', 'main', '--', *paths).split()
+        self.assertEqual(expected, ['M', 'C2', 'B', 'C1'])
+        for limit in (1, 2):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.pages(limit, paths=paths), expected)
+
+    def test_abbreviated_cursor(self):
+        first = history.get_page(self.url, limit=3)
+        page = history.get_page(self.url, after=first['next_cursor'][:10], limit=3)
+        self.assertEqual([c.message for c in page['commits']], ['C2', 'B', 'C1'])
+
+    def test_unknown_cursor(self):
+        with self.assertRaises(history.HistoryError):
+            history.get_page(self.url, after='0' * 40)
+
+    @mock.patch.object(history, 'MAX_SKIP', 3)
+    def test_deep_cursor_is_refused(self):
+        first = history.get_page(self.url, limit=4)
+        self.assertEqual([c.message for c in first['commits']], ['E', 'M', 'D', 'C2'])
+        with self.assertRaisesRegex(history.HistoryError, 'more than 3 commits deep'):
+            history.get_page(self.url, after=first['next_cursor'], limit=3)
+        # The third commit is still in reach
+        page = history.get_page(self.url, after=first['commits'][2].sha, limit=3)
+        self.assertEqual([c.message for c in page['commits']], ['C2', 'B', 'C1'])
+
+    async def test_view_pages_cover_merged_history(self):
+        messages, after = [], None
+        while True:
+            response = await AsyncClient().post('/repoanalyze/get_commit_history/',
+                                                json.dumps({'input': self.url, 'after': after, 'limit': 3}),
+                                                content_type='application/json')
+            messages += [c['message'] for c in response.json()['commits']]
+            after = response.json()['next_cursor']
+            if not after:
+                break
+        self.assertEqual(messages, self.expected)
+
+
+class LogTimeoutTests(SimpleTestCase):
+    @mock.patch.object(history, 'LOG_TIMEOUT', 0.2)
+    def test_git_is_stopped_after_the_timeout(self):
+        slow_log = ['git', '-c', 'alias.slow-log=!sleep 10', 'slow-log']
+        with mock.patch.object(history, 'log_command', return_value=slow_log):
+            started = time.monotonic()
+            with self.assertRaisesRegex(history.HistoryError, 'longer than'):
+                run_sync(history._read_page('.', 'HEAD', None, 10))
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class ShallowPaginationTests(CacheDirMixin, SimpleTestCase):
+    def test_pages_past_the_shallow_boundary_deepen_the_clone(self):
+        repo = make_repo(self.root, RepoSpec(files=3, commits=120))
+        url = f"file://{repo}"
+        messages, after, deepened = [], None, 0
+        while True:
+            page = history.get_page(url, after=after, limit=40)
+            messages += [c.sha for c in page['commits']]
+            deepened += page['deepened']
+            after = page['next_cursor']
+            if not after:
+                break
+        self.assertEqual(messages, git(repo, 'log', '--format=%H', 'main').split())
+        self.assertGreater(deepened, 0)
@@ -0,0 +1,97 @@
+import sqlite3
+
+from django.test import SimpleTestCase, override_settings
+
+from repoanalyze import dependencies, imports, listing, repo_cache
+from repoanalyze.benchmark import RepoSpec, make_repo
+from repoanalyze.git_reader import get_reader
+
+from .utils import CacheDirMixin, add_commit
+
+
+class ResolutionTests(SimpleTestCase):
+    def test_local_modules_are_modules_and_packages_not_directories(self):
+        paths = [
+            'setup.py', 'app/__init__.py', 'app/sub/__init__.py', 'src/lib/core.py',
+            'backend/project/__init__.py', 'requests/fixture.py', 'docs/yaml/conf.py',
+        ]
+        self.assertEqual(imports.local_modules(paths), {'setup', 'app', 'lib', 'project'})
+
+    def test_distribution_names_do_not_depend_on_the_server(self):
+        self.assertEqual(imports.distribution_name('yaml', {}), 'PyYAML')
+        self.assertEqual(imports.distribution_name('google.cloud.storage', {}), 'google-cloud')
+        self.assertEqual(imports.distribution_name('django.db', {}), 'django')
+
+    def test_declared_names_win(self):
+        declared = {imports.normalize(name): name for name in ('Django', 'pyyaml', 'google-cloud-storage')}
+        self.assertEqual(imports.distribution_name('django.db', declared), 'Django')
+        self.assertEqual(imports.distribution_name('yaml', declared), 'pyyaml')
+        self.assertEqual(imports.distribution_name('google.cloud', declared), 'google-cloud')
+
+
+class ScanTests(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repo_path = make_repo(self.root, RepoSpec(files=0, commits=1, manifests=()))
+        self.repo_url = f"file://{self.repo_path}"
+
+    def scan(self, files: dict, declared=()) -> dict:
+        commit = add_commit(self.repo_path, files)
+        with repo_cache.open_repo(self.repo_url) as repo:
+            reader = get_reader(repo.path)
+            entries = [entry for entry in listing.get_tree(reader, commit) if entry.path in files]
+            return dict(imports.scan(reader, commit, entries, declared))
+
+    def test_local_and_sibling_imports_are_dropped(self):
+        found = self.scan({
+            'tools/run.py': 'import helper\nimport requests\nimport json\n',
+            'tools/helper.py': 'import app.models\n',
+            'app/__init__.py': '',
+            'app/models.py': 'from app import db\nimport yaml\n',
+        })
+        self.assertEqual(found, {'PyYAML': ['app/models.py'], 'requests': ['tools/run.py']})
+
+    def test_directory_named_like_a_package_is_not_local(self):
+        found = self.scan({'main.py': 'import requests\n', 'requests/data.py': ''})
+        self.assertEqual(found, {'requests': ['main.py']})
+
+    @override_settings(IMPORT_CACHE_MAX_BLOBS=2)
+    def test_blob_cache_is_capped(self):
+        self.scan({f'm{i}.py': f'import pkg{i}\n' for i in range(5)})
+        with sqlite3.connect(f'{self.cache_dir}/imports.sqlite3') as conn:
+            [(count,)] = conn.execute('SELECT COUNT(*) FROM blob_imports')
+        self.assertEqual(count, 2)
+
+
+class InferredDependencyTests(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repo_path = make_repo(self.root, RepoSpec(files=0, commits=1, manifests=()))
+        self.repo_url = f"file://{self.repo_path}"
+
+    def extract(self, files: dict) -> dict:
+        commit = add_commit(self.repo_path, files)
+        with repo_cache.open_repo(self.repo_url) as repo:
+            return dependencies.extract(get_reader(repo.path), commit)
+
+    def test_dev_only_manifest_still_infers_runtime_imports(self):
+        result = self.extract({
+            'requirements-dev.txt': 'PyYAML\npytest\n',
+            'app.py': 'import yaml\nimport click\n',
+        })
+        self.assertTrue(result['inferred'])
+        inferred = [dep['name'] for dep in result['dependencies'] if dep['source'] == dependencies.IMPORTS_SOURCE]
+        self.assertEqual(inferred, ['PyYAML', 'click'])
+
+    def test_label_without_a_manifest(self):
+        result = self.extract({'app.py': 'import click\n'})
+        self.assertIn('# Inferred from imports (no manifest found)\nclick', dependencies.format_text(result))
+
+    def test_label_with_manifests_that_declare_no_runtime_dependency(self):
+        result = self.extract({'requirements-dev.txt': 'pytest\n', 'app.py': 'import click\n'})
+        self.assertIn('# Inferred from imports (manifests declare no runtime dependency)\nclick',
+                      dependencies.format_text(result))
+
+    def test_runtime_manifest_is_not_second_guessed(self):
+        result = self.extract({'requirements.txt': 'click\n', 'app.py': 'import yaml\n'})
+        self.assertFalse(result['inferred'])
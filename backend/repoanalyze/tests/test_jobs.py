@@ -0,0 +1,104 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from repoanalyze import jobs
+from repoanalyze.models import Job
+
+
+def wait_for(job_id, statuses=(Job.SUCCEEDED, Job.FAILED), timeout: float = 5) -> Job:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = Job.objects.get(id=job_id)
+        if job.status in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} still {job.status}")
+
+
+class JobRecoveryTests(TransactionTestCase):
+    def setUp(self):
+        self.runs = []
+        jobs.register('test', lambda params, progress: self.runs.append(params) or {'ok': params['n']})
+
+    def orphan(self, age: float, status=Job.RUNNING, worker='other-host:123:abcdef01') -> Job:
+        heartbeat = timezone.now() - timedelta(seconds=age) if age is not None else None
+        return Job.objects.create(kind='test', params={'n': 1}, status=status, worker=worker, heartbeat_at=heartbeat)
+
+    def test_worker_ids_differ_between_processes_with_the_same_pid(self):
+        first = jobs._worker_id()
+        self.addCleanup(setattr, jobs, '_worker', jobs._worker)
+        jobs._worker = None
+        self.assertNotEqual(jobs._worker_id(), first)
+        self.assertEqual(jobs._worker_id(), jobs._worker_id())
+
+    @override_settings(JOB_LEASE_SECONDS=60)
+    def test_expired_job_from_another_host_is_recovered(self):
+        job = self.orphan(age=120)
+        self.assertEqual(jobs.recover_jobs(), 1)
+        job = wait_for(job.id)
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, {'ok': 1})
+        self.assertEqual(job.worker, jobs._worker_id())
+
+    @override_settings(JOB_LEASE_SECONDS=60)
+    def test_queued_job_of_a_dead_process_is_recovered(self):
+        job = self.orphan(age=120, status=Job.QUEUED, worker=jobs._worker_id().rsplit(':', 1)[0] + ':deadbeef')
+        self.assertEqual(jobs.recover_jobs(), 1)
+        self.assertEqual(wait_for(job.id).status, Job.SUCCEEDED)
+
+    @override_settings(JOB_LEASE_SECONDS=60)
+    def test_jobs_without_a_heartbeat_are_recovered(self):
+        job = self.orphan(age=None)
+        self.assertEqual(jobs.recover_jobs(), 1)
+        self.assertEqual(wait_for(job.id).status, Job.SUCCEEDED)
+
+    @override_settings(JOB_LEASE_SECONDS=60)
+    def test_live_jobs_are_left_alone(self):
+        job = self.orphan(age=5)
+        self.assertEqual(jobs.recover_jobs(), 0)
+        self.assertEqual(Job.objects.get(id=job.id).worker, 'other-host:123:abcdef01')
+        self.assertEqual(self.runs, [])
+
+    @override_settings(JOB_LEASE_SECONDS=1)
+    def test_running_job_renews_its_lease(self):
+        release = threading.Event()
+        jobs.register('slow', lambda params, progress: release.wait(5) and {'ok': True})
+        job = jobs.submit('slow', {})
+        wait_for(job.id, statuses=(Job.RUNNING,))
+        first = Job.objects.get(id=job.id).heartbeat_at
+        time.sleep(0.6)
+        self.assertGreater(Job.objects.get(id=job.id).heartbeat_at, first)
+        release.set()
+        self.assertEqual(wait_for(job.id).result, {'ok': True})
+
+    @override_settings(JOB_LEASE_SECONDS=1)
+    def test_jobs_queued_behind_a_running_one_keep_their_lease(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        jobs.register('slow', lambda params, progress: release.wait(5) and {'ok': True})
+        running = jobs.submit('slow', {})
+        wait_for(running.id, statuses=(Job.RUNNING,))
+        # Waiting in this process's pool for a free thread
+        waiting = self.orphan(age=0, status=Job.QUEUED, worker=jobs._worker_id())
+        time.sleep(1.2)
+        self.assertGreater(Job.objects.get(id=waiting.id).heartbeat_at, waiting.heartbeat_at)
+        release.set()
+        wait_for(running.id)
+
+    def test_job_taken_over_is_not_overwritten(self):
+        def handler(params, progress):
+            # Another worker decided this one was dead and took the job
+            Job.objects.filter(id=params['id']).update(worker='other-host:1:00000000', status=Job.QUEUED)
+            return {'stale': True}
+
+        jobs.register('taken', handler)
+        job = Job.objects.create(kind='taken', params={}, worker=jobs._worker_id())
+        Job.objects.filter(id=job.id).update(params={'id': str(job.id)})
+        jobs._run(job.id)
+        job = Job.objects.get(id=job.id)
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIsNone(job.result)
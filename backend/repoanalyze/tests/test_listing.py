@@ -0,0 +1,74 @@
+import os
+
+from django.test import Client, SimpleTestCase, override_settings
+
+from repoanalyze import listing, repo_cache
+from repoanalyze.benchmark import RepoSpec, make_repo
+from repoanalyze.git_reader import get_reader
+
+from .test_repo_cache import local_blobs
+from .utils import CacheDirMixin, RepoTestCase, add_commit
+
+
+class ListingTests(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repo_path = make_repo(self.root, RepoSpec(files=20, commits=1))
+        self.repo_url = f"file://{self.repo_path}"
+        listing._trees.clear()
+
+    def test_listing_fetches_no_blobs(self):
+        with repo_cache.open_repo(self.repo_url) as repo:
+            reader = get_reader(repo.path)
+            page, _ = listing.paginate(listing.get_tree(reader, repo.sha))
+            self.assertTrue(page)
+            self.assertEqual(local_blobs(repo.path), 0)
+
+    @override_settings(TREE_CACHE_MAX_FILES=2)
+    def test_tree_files_are_evicted_least_recently_used_first(self):
+        commits = [add_commit(self.repo_path, {f'new{i}.py': ''}) for i in range(3)]
+        with repo_cache.open_repo(self.repo_url) as repo:
+            reader = get_reader(repo.path)
+            for commit in commits[:2]:
+                listing.get_tree(reader, commit)
+            os.utime(listing._tree_cache_path(commits[0]), (1, 1))
+            os.utime(listing._tree_cache_path(commits[1]), (2, 2))
+            # A hit on disk counts as a use
+            listing._trees.clear()
+            listing.get_tree(reader, commits[0])
+            listing.get_tree(reader, commits[2])
+
+        self.assertEqual(sorted(os.listdir(listing._tree_dir())),
+                         sorted(f"{commit}.json" for commit in (commits[0], commits[2])))
+
+
+class PaginationTests(RepoTestCase):
+    spec = RepoSpec(files=25, commits=1)
+
+    def list_files(self, **options) -> dict:
+        response = self.post(Client(), '/repoanalyze/get_files_from_repository/', {'input': self.repo_url, **options})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_cover_every_file_once_in_path_order(self):
+        paths, cursor = [], None
+        while True:
+            page = self.list_files(limit=7, cursor=cursor)
+            self.assertLessEqual(len(page['files']), 7)
+            paths += [f['path'] for f in page['files']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(paths, sorted(paths))
+        self.assertEqual(len(paths), page['total'])
+        self.assertEqual(len(set(paths)), 20)
+
+    def test_extension_and_prefix_filters(self):
+        page = self.list_files(extensions='.md', prefix='docs/')
+        self.assertEqual(page['total'], 5)
+        self.assertTrue(all(f['path'].startswith('docs/') and f['path'].endswith('.md') for f in page['files']))
+
+    def test_invalid_limit_is_a_bad_request(self):
+        response = self.post(Client(), '/repoanalyze/get_files_from_repository/',
+                             {'input': self.repo_url, 'limit': 'abc'})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,166 @@
+import json
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from repoanalyze import docstrings, llm
+
+from .utils import CacheDirMixin
+
+
+class PeakBackend(llm.StubBackend):
+    """Stub model that records the most calls it ever had in flight"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.peak = 0
+
+    def complete(self, client, prompt: str, timeout: int) -> llm.Generation:
+        with self._lock:
+            self.peak = max(self.peak, self.in_flight)
+        return super().complete(client, prompt, timeout)
+
+
+class ConcurrencyTests(CacheDirMixin, SimpleTestCase):
+    def test_calls_run_in_parallel_up_to_the_limit(self):
+        backend = PeakBackend(latency=0.05, concurrency=2)
+        with ThreadPoolExecutor(6) as pool:
+            answers = list(pool.map(backend.generate, [f'prompt {i}' for i in range(6)]))
+        self.assertEqual(backend.calls, 6)
+        self.assertEqual(backend.peak, 2)
+        self.assertEqual(backend.scheduler.snapshot()['running'], 0)
+        self.assertEqual(answers, ['Generated offline.'] * 6)
+
+    def test_calls_are_stateless(self):
+        backend = llm.StubBackend(latency=0)
+        prompts = []
+        backend.answer = lambda prompt: prompts.append(prompt) or 'ok'
+        backend.generate('first')
+        backend.generate('second')
+        # No chat history is carried from one call to the next
+        self.assertEqual(prompts, ['first', 'second'])
+
+    @override_settings(LLM_PACK_OUTPUT_TOKENS=docstrings.DOCSTRING_TOKENS)
+    def test_packs_of_one_request_run_in_parallel(self):
+        backend = PeakBackend(latency=0.05, concurrency=3)
+        sources = [(f'm{i}.py', f'def f{i}():\n    pass\n') for i in range(2)]
+        results = list(docstrings.document_sources(sources, backend.generate, workers=3))
+        self.assertEqual(sorted(index for index, _, _ in results), [0, 1])
+        # A module and a function per file, one definition per pack
+        self.assertEqual(backend.calls, 4)
+        self.assertEqual(backend.peak, 3)
+        for _, result, missing in results:
+            self.assertEqual(missing, [])
+            self.assertIn('"""Function', result)
+
+
+class ErrorTests(CacheDirMixin, SimpleTestCase):
+    def test_failures_are_model_errors(self):
+        backend = llm.StubBackend(latency=0)
+        backend.answer = lambda prompt: json.loads('not json')
+        with self.assertRaises(llm.ModelError):
+            backend.generate('prompt')
+        self.assertEqual(backend.scheduler.snapshot()['running'], 0)
+
+
+class ModelServer(ThreadingHTTPServer):
+    """OpenAI-style chat completions endpoint answering from a list of (status, body)"""
+
+    def __init__(self, replies: list):
+        self.replies = replies
+        self.requests = []
+        self.connections = set()
+        super().__init__(('127.0.0.1', 0), ModelHandler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1/chat/completions"
+
+
+class ModelHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append((body, self.headers.get('Authorization')))
+        self.server.connections.add(self.client_address)
+        status, reply = self.server.replies.pop(0)
+        data = json.dumps(reply).encode()
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def completion(text: str) -> tuple:
+    return 200, {'choices': [{'message': {'content': text}}], 'usage': {'prompt_tokens': 3, 'completion_tokens': 2}}
+
+
+class BackendTests(CacheDirMixin, SimpleTestCase):
+    def serve(self, replies: list) -> ModelServer:
+        server = ModelServer(replies)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_registry(self):
+        self.assertEqual(set(llm.BACKENDS), {'gemini', 'http', 'stub'})
+        self.assertIsInstance(llm.create_backend('stub'), llm.StubBackend)
+        with self.assertRaises(ImproperlyConfigured):
+            llm.create_backend('gpt-2')
+
+    def test_vendor_sdk_is_not_imported_at_startup(self):
+        code = ('import django, sys; django.setup(); import repoanalyze.views, repoanalyze.llm as llm; '
+                'llm.get_backend(); print("google.generativeai" in sys.modules)')
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                                env={'DJANGO_SETTINGS_MODULE': 'backend.settings', 'LLM_BACKEND': 'gemini',
+                                     'PATH': '/usr/bin:/bin'}, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_unconfigured_backend(self):
+        with override_settings(LLM_HTTP_URL=''):
+            backend = llm.create_backend('http')
+            with self.assertRaises(llm.ModelError):
+                backend.generate('prompt')
+        self.assertIsNone(backend._client)
+
+    def test_http_backend_reuses_its_client_and_connection(self):
+        server = self.serve([completion('one'), completion('two')])
+        with override_settings(LLM_HTTP_URL=server.url, LLM_HTTP_API_KEY='secret'):
+            backend = llm.create_backend('http', model_name='local-model')
+            self.assertEqual([backend.generate('first'), backend.generate('second')], ['one', 'two'])
+        client = backend.client()
+        self.assertIs(backend.client(), client)
+        self.assertEqual(len(server.connections), 1)
+        body, authorization = server.requests[0]
+        self.assertEqual(body['model'], 'local-model')
+        self.assertEqual(body['messages'], [{'role': 'user', 'content': 'first'}])
+        self.assertEqual(authorization, 'Bearer secret')
+
+    def test_rate_limited_call_is_retried(self):
+        server = self.serve([(429, {'error': 'slow down'}), completion('done')])
+        with override_settings(LLM_HTTP_URL=server.url):
+            backend = llm.create_backend('http')
+            self.assertEqual(backend.generate('prompt'), 'done')
+        self.assertEqual(backend.calls, 2)
+
+    def test_client_errors_are_not_retried(self):
+        server = self.serve([(400, {'error': 'bad request'})])
+        with override_settings(LLM_HTTP_URL=server.url):
+            backend = llm.create_backend('http')
+            with self.assertRaises(llm.ModelError):
+                backend.generate('prompt')
+        self.assertEqual(backend.calls, 1)
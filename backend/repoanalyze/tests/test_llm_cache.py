@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+
+from repoanalyze import llm, llm_cache
+from repoanalyze.models import LLMResult
+
+from .utils import RepoTestCase, add_commit
+
+
+class CacheTests(TestCase):
+    def test_key_covers_content_prompt_model_and_config(self):
+        key = llm_cache.make_key('def f(): pass', 'v1', 'model', {'temperature': 0.7})
+        self.assertEqual(key, llm_cache.make_key('def f(): pass', 'v1', 'model', {'temperature': 0.7}))
+        for other in (('def g(): pass', 'v1', 'model', {'temperature': 0.7}),
+                      ('def f(): pass', 'v2', 'model', {'temperature': 0.7}),
+                      ('def f(): pass', 'v1', 'other', {'temperature': 0.7}),
+                      ('def f(): pass', 'v1', 'model', {'temperature': 0.2})):
+            self.assertNotEqual(llm_cache.make_key(*other), key)
+
+    def test_hits_are_counted(self):
+        llm_cache.put('a', 'result', 'v1', 'model')
+        self.assertEqual(llm_cache.get_many(['a', 'b']), {'a': 'result'})
+        self.assertEqual(LLMResult.objects.get(key='a').hits, 1)
+
+    @override_settings(LLM_CACHE_MAX_BYTES=10)
+    def test_least_recently_used_results_are_evicted(self):
+        now = timezone.now()
+        for age, key in enumerate(('new', 'old', 'oldest')):
+            llm_cache.put(key, 'x' * 5, 'v1', 'model')
+            LLMResult.objects.filter(key=key).update(last_used_at=now - timedelta(minutes=age))
+        llm_cache.evict()
+        self.assertEqual(sorted(LLMResult.objects.values_list('key', flat=True)), ['new', 'old'])
+
+
+class DocstringCacheTests(RepoTestCase):
+    def test_unchanged_files_cost_no_model_calls(self):
+        backend = llm.get_backend()
+        files = self.post(Client(), '/repoanalyze/get_files_from_repository/', {'input': self.repo_url}).json()['output']
+        first = self.post(Client(), '/repoanalyze/generate_doc_strings/', {'input': files[:3]}).json()
+        calls = backend.calls
+        self.assertGreater(calls, 0)
+
+        second = self.post(Client(), '/repoanalyze/generate_doc_strings/', {'input': files[:3]}).json()
+        self.assertEqual(backend.calls, calls)
+        self.assertEqual(second['output'], first['output'])
+        self.assertEqual((first['cache']['hits'], second['cache']['hits']), (0, 3))
+
+    def test_output_that_does_not_parse_is_not_cached(self):
+        add_commit(self.repo_path, {'broken.py': 'def f(:\n    pass\n'})
+        backend = llm.get_backend()
+        files = self.post(Client(), '/repoanalyze/get_files_from_repository/', {'input': self.repo_url}).json()['output']
+        broken = [url for url in files if url.endswith('/broken.py')]
+        # The whole-file prompt's answer is the broken source itself
+        first = self.post(Client(), '/repoanalyze/generate_doc_strings/', {'input': broken}).json()
+        self.assertIn('content', first['results'][0])
+        calls = backend.calls
+        self.post(Client(), '/repoanalyze/generate_doc_strings/', {'input': broken})
+        self.assertEqual(backend.calls, calls + 1)
+        self.assertFalse(LLMResult.objects.exists())
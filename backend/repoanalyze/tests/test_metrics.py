@@ -0,0 +1,53 @@
+import os
+from unittest import mock
+
+from django.test import Client, SimpleTestCase
+
+from repoanalyze import docstrings, metrics
+
+from .utils import CacheDirMixin, RepoTestCase
+
+API = '/repoanalyze/'
+
+
+class DiskUsageTests(CacheDirMixin, SimpleTestCase):
+    def test_areas(self):
+        os.makedirs(os.path.join(self.cache_dir, 'docs'))
+        with open(os.path.join(self.cache_dir, 'docs', 'page.html'), 'w') as f:
+            f.write('x' * 10)
+        with open(os.path.join(self.cache_dir, 'jobs.json'), 'w') as f:
+            f.write('y' * 5)
+        sizes = metrics._measure_disk_usage()
+        # No separate temp area: the cache already lives there by default
+        self.assertEqual(set(sizes), {('repos',), ('docs',), ('cache_other',)})
+        self.assertEqual(sizes[('docs',)], 10)
+        self.assertEqual(sizes[('cache_other',)], 5)
+
+    def test_file_removed_while_measuring(self):
+        os.makedirs(self.cache_dir)
+        open(os.path.join(self.cache_dir, 'gone.json'), 'w').close()
+        with mock.patch('os.path.getsize', side_effect=FileNotFoundError):
+            self.assertEqual(metrics._measure_disk_usage()[('cache_other',)], 0)
+
+
+class StageContextTests(SimpleTestCase):
+    def test_stages_in_pack_workers_reach_the_request(self):
+        def generate(prompt):
+            with metrics.stage('llm'):
+                raise RuntimeError('model down')
+
+        sources = [(f'f{i}.py', f'def f{i}():\n    pass\n') for i in range(3)]
+        with metrics.collect() as stages:
+            results = list(docstrings.document_sources(sources, generate, workers=3))
+        self.assertEqual(len(results), 3)
+        self.assertTrue(stages)
+        self.assertEqual({name for name, _ in stages}, {'llm'})
+
+
+class ServerTimingTests(RepoTestCase):
+    def test_model_calls_are_in_server_timing(self):
+        client = Client()
+        files = self.post(client, f'{API}get_files_from_repository/', {'input': self.repo_url}).json()['output']
+        response = self.post(client, f'{API}generate_doc_strings/', {'input': files[:3]})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('llm;dur=', response['Server-Timing'])
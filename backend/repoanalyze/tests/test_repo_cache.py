@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+
+from django.core.asgi import get_asgi_application
+from django.test import SimpleTestCase, override_settings
+
+from repoanalyze import repo_cache
+from repoanalyze.git_reader import get_reader
+from repoanalyze.singleflight import SingleFlight
+from repoanalyze.benchmark import RepoSpec, make_repo
+
+from .utils import CacheDirMixin, add_commit, git
+
+
+def local_blobs(path: str) -> int:
+    """Blobs present in a clone's object store (missing ones in a partial clone aren't fetched)"""
+    types = git(path, 'cat-file', '--batch-all-objects', '--batch-check=%(objecttype)').split()
+    return types.count('blob')
+
+
+class RepoCacheTestCase(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repo_path = make_repo(self.root, RepoSpec(files=20, commits=3))
+        self.repo_url = f"file://{self.repo_path}"
+
+    def expire(self):
+        """Make the next open_repo check the remote"""
+        repo_cache.update_manifest(repo_cache.cache_key(self.repo_url), checked_at=0)
+
+
+class RefreshTests(RepoCacheTestCase):
+    def test_partial_clone_fetches_no_blobs(self):
+        with repo_cache.open_repo(self.repo_url) as repo:
+            self.assertEqual(local_blobs(repo.path), 0)
+
+        head = add_commit(self.repo_path, {'src/new.py': 'VALUE = 1\n'})
+        self.expire()
+        with repo_cache.open_repo(self.repo_url) as repo:
+            self.assertEqual(repo.sha, head)
+            self.assertEqual(git(repo.path, 'rev-parse', 'HEAD'), head)
+            self.assertEqual(local_blobs(repo.path), 0)
+            self.assertEqual(sorted(os.listdir(repo.path)), ['.git'])
+
+    def test_reads_fetch_only_the_blobs_they_need(self):
+        add_commit(self.repo_path, {'src/new.py': 'VALUE = 1\n'})
+        with repo_cache.open_repo(self.repo_url) as repo:
+            self.assertEqual(get_reader(repo.path).read_file(repo.sha, 'src/new.py'), b'VALUE = 1\n')
+            self.assertEqual(local_blobs(repo.path), 1)
+            self.assertEqual(sorted(os.listdir(repo.path)), ['.git'])
+
+    @override_settings(REPO_PARTIAL_CLONE=False)
+    def test_full_clone_refresh_updates_working_tree(self):
+        with repo_cache.open_repo(self.repo_url) as repo:
+            self.assertTrue(os.path.exists(os.path.join(repo.path, 'requirements.txt')))
+        add_commit(self.repo_path, {'src/new.py': 'VALUE = 1\n'})
+        self.expire()
+        with repo_cache.open_repo(self.repo_url) as repo:
+            self.assertTrue(os.path.exists(os.path.join(repo.path, 'src', 'new.py')))
+
+
+class CacheKeyTests(SimpleTestCase):
+    def test_spellings_of_one_repository_share_a_key(self):
+        keys = {repo_cache.cache_key(url) for url in (
+            'https://github.com/Owner/Repo', 'https://github.com/owner/repo.git/',
+            'git@github.com:owner/repo.git', 'ssh://git@GitHub.com/owner/repo',
+        )}
+        self.assertEqual(keys, {'github.com/owner/repo'})
+
+    def test_same_name_under_different_owners_or_branches_differ(self):
+        self.assertNotEqual(repo_cache.cache_key('https://github.com/a/repo'),
+                            repo_cache.cache_key('https://github.com/b/repo'))
+        self.assertEqual(repo_cache.cache_key('https://github.com/a/repo', 'dev'), 'github.com/a/repo@dev')
+        self.assertNotEqual(repo_cache.entry_path('github.com/a/repo'), repo_cache.entry_path('github.com/b/repo'))
+
+    def test_case_is_kept_on_other_hosts(self):
+        self.assertEqual(repo_cache.cache_key('https://example.com/Owner/Repo'), 'example.com/Owner/Repo')
+
+
+@override_settings(REPO_CACHE_MAX_BYTES=1)
+class EvictionTests(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.urls = [f"file://{make_repo(os.path.join(self.root, name), RepoSpec(files=5, commits=1))}"
+                     for name in ('one', 'two')]
+
+    def test_least_recently_used_entry_is_evicted(self):
+        with repo_cache.open_repo(self.urls[0]) as first:
+            pass
+        with repo_cache.open_repo(self.urls[1]) as second:
+            self.assertFalse(os.path.exists(first.path))
+            self.assertTrue(os.path.exists(second.path))
+        self.assertEqual(list(repo_cache._load_manifest()), [repo_cache.cache_key(self.urls[1])])
+
+    def test_entry_in_use_is_not_evicted(self):
+        with repo_cache.open_repo(self.urls[0]) as first:
+            with repo_cache.open_repo(self.urls[1]):
+                self.assertTrue(os.path.exists(first.path))
+            self.assertEqual(git(first.path, 'rev-parse', 'HEAD'), first.sha)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_callers_share_one_call(self):
+        flight, started, release = SingleFlight(), threading.Event(), threading.Event()
+        calls = []
+
+        def work():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'result'
+
+        with ThreadPoolExecutor(4) as pool:
+            leader = pool.submit(flight.do, 'key', work)
+            started.wait(5)
+            followers = [pool.submit(flight.do, 'key', work) for _ in range(3)]
+            while not all(future.running() for future in followers):
+                time.sleep(0.01)
+            # Give them time to reach the in-flight call
+            time.sleep(0.1)
+            release.set()
+            results = [future.result() for future in [leader, *followers]]
+        self.assertEqual(results, ['result'] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight._calls, {})
+
+    def test_errors_are_shared_and_not_remembered(self):
+        flight = SingleFlight()
+        with self.assertRaises(ZeroDivisionError):
+            flight.do('key', lambda: 1 / 0)
+        self.assertEqual(flight.do('key', lambda: 'retried'), 'retried')
+
+
+
+class FreshnessTests(RepoCacheTestCase):
+    def git_commands(self) -> list:
+        """Open the repository and return the git subcommands that ran"""
+        with mock.patch.object(repo_cache, 'run_git', wraps=repo_cache.run_git) as run:
+            with repo_cache.open_repo(self.repo_url) as repo:
+                self.sha = repo.sha
+        return [next(arg for arg in call.args if not arg.startswith('-') and arg != repo.path)
+                for call in run.call_args_list]
+
+    def test_fresh_entry_runs_no_git(self):
+        self.git_commands()
+        self.assertEqual(self.git_commands(), [])
+
+    def test_unchanged_remote_is_only_checked(self):
+        self.git_commands()
+        self.expire()
+        self.assertEqual(self.git_commands(), ['ls-remote'])
+        key = repo_cache.cache_key(self.repo_url)
+        self.assertGreater(repo_cache.get_manifest_entry(key)['checked_at'], 0)
+
+    def test_unreachable_remote_serves_the_cached_copy(self):
+        self.git_commands()
+        cached = self.sha
+        shutil.move(self.repo_path, f"{self.repo_path}.moved")
+        self.expire()
+        self.assertEqual(self.git_commands(), ['ls-remote'])
+        self.assertEqual(self.sha, cached)
+
+
+def group_members(pgid: int) -> list:
+    """Live (not zombie) processes in a process group"""
+    members = []
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                state, _, pgrp = f.read().rsplit(')', 1)[1].split()[:3]
+        except OSError:
+            continue
+        if int(pgrp) == pgid and state != 'Z':
+            members.append(int(pid))
+    return members
+
+
+async def until(condition, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting")
+        await asyncio.sleep(0.05)
+
+
+@skipUnless(os.path.isdir('/proc') and repo_cache.NEW_SESSION, "needs /proc and process groups")
+class DisconnectTests(RepoCacheTestCase):
+    async def test_disconnect_mid_clone_stops_git(self):
+        clone_args = repo_cache._clone_args
+        create = asyncio.create_subprocess_exec
+        spawned = []
+
+        async def spawn(*cmd, **kwargs):
+            process = await create(*cmd, **kwargs)
+            spawned.append(process)
+            return process
+
+        body = json.dumps({'input': self.repo_url}).encode()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': '/repoanalyze/get_files_from_repository/', 'raw_path': b'', 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'content-type', b'application/json')],
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        received, disconnected = [], asyncio.Event()
+
+        async def receive():
+            if not received:
+                received.append(body)
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            self.fail(f"Unexpected response: {message}")
+
+        # upload-pack is started through the shell, in git's process group
+        slow_clone = lambda: [*clone_args(), '--upload-pack=sleep 30; git-upload-pack']
+        with mock.patch.object(repo_cache, '_clone_args', slow_clone), \
+                mock.patch('asyncio.create_subprocess_exec', spawn):
+            request = asyncio.ensure_future(get_asgi_application()(scope, receive, send))
+            await until(lambda: spawned and len(group_members(spawned[0].pid)) > 1)
+            disconnected.set()
+            await asyncio.wait_for(request, 10)
+            clone = spawned[0]
+            await asyncio.wait_for(clone.wait(), 10)
+            await until(lambda: not repo_cache._inflight_async._calls)
+
+        self.assertEqual(len(spawned), 1)
+        self.assertEqual(group_members(clone.pid), [])
+        key = repo_cache.cache_key(self.repo_url)
+        self.assertFalse(os.path.exists(repo_cache.entry_path(key)))
+        self.assertEqual(repo_cache.get_manifest_entry(key), {})
@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from repoanalyze import scheduler, views
+from repoanalyze.scheduler import BATCH, INTERACTIVE, Limits, QueueTimeout, Scheduler, Ticket
+
+from .utils import CacheDirMixin
+
+
+class SchedulerTests(CacheDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scheduler = Scheduler('test', Limits(concurrency=1))
+
+    def test_new_client_goes_before_a_queued_batch(self):
+        state, now = self.scheduler._load(), time.time()
+        batch = [Ticket(f'b{i}', 'batch-client', 100) for i in range(5)]
+        for ticket in batch:
+            self.scheduler._enqueue(state, ticket, BATCH, now)
+        newcomer = Ticket('n', 'new-client', 100)
+        self.scheduler._enqueue(state, newcomer, INTERACTIVE, now)
+
+        self.assertEqual(self.scheduler._try_dispatch(state, batch[1], BATCH, now), (None, False))
+        self.assertEqual(self.scheduler._try_dispatch(state, newcomer, INTERACTIVE, now), (0.0, True))
+        self.assertIn('n', state['running'])
+
+    def test_waiting_ticket_does_not_rewrite_the_state_every_poll(self):
+        running = self.scheduler.acquire('first', 10)
+        with mock.patch.object(Scheduler, '_save', autospec=True, side_effect=Scheduler._save) as save:
+            with self.assertRaises(QueueTimeout):
+                self.scheduler.acquire('second', 10, timeout=0.5)
+        # Queued and dropped again; the polls in between only read
+        self.assertEqual(save.call_count, 2)
+        self.assertEqual(self.scheduler.snapshot()['queued'], 0)
+
+        self.scheduler.release(running)
+        self.assertEqual(self.scheduler.snapshot()['running'], 0)
+
+    def test_ticket_without_a_free_slot_waits_for_a_release_not_the_file(self):
+        running = self.scheduler.acquire('first', 10)
+        acquired = []
+        with mock.patch.object(Scheduler, '_load', autospec=True, side_effect=Scheduler._load) as load:
+            waiter = threading.Thread(target=lambda: acquired.append(self.scheduler.acquire('second', 10, timeout=10)))
+            waiter.start()
+            time.sleep(1)
+            # Queued, then one look at the queue before waiting for this process's slot
+            self.assertEqual(load.call_count, 2)
+            released = time.monotonic()
+            self.scheduler.release(running)
+            waiter.join(5)
+        self.assertLess(time.monotonic() - released, 1)
+        self.assertEqual(len(acquired), 1)
+        self.scheduler.release(acquired[0])
+
+    def test_waiting_ticket_is_marked_seen_and_stale_ones_expire(self):
+        state, now = self.scheduler._load(), time.time()
+        waiting, abandoned = Ticket('w', 'a', 1), Ticket('x', 'b', 1)
+        self.scheduler._enqueue(state, abandoned, INTERACTIVE, now - scheduler.STALE_AFTER - 1)
+        self.scheduler._enqueue(state, waiting, INTERACTIVE, now - scheduler.SEEN_EVERY)
+        # Another call of this process holds the only slot
+        state['running']['r'] = {'pid': os.getpid(), 'tokens': 1, 'started': now}
+
+        wait, changed = self.scheduler._try_dispatch(state, waiting, INTERACTIVE, now)
+        self.assertIsNone(wait)
+        self.assertTrue(changed)
+        self.assertNotIn('x', state['queue'])
+        self.assertEqual(state['queue']['w']['seen'], now)
+
+
+class ClientIdTests(SimpleTestCase):
+    def client_id(self, forwarded: str) -> str:
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR=forwarded, REMOTE_ADDR='10.0.0.2')
+        return views.client_id(request)
+
+    def test_forwarded_header_is_ignored_without_trusted_proxies(self):
+        self.assertEqual(self.client_id('203.0.113.7'), '10.0.0.2')
+
+    @override_settings(TRUSTED_PROXIES=1)
+    def test_client_is_what_the_trusted_proxy_saw(self):
+        # The client sent a made-up first entry; the proxy appended its real address
+        self.assertEqual(self.client_id('1.2.3.4, 198.51.100.9'), '198.51.100.9')
+        self.assertEqual(self.client_id(''), '10.0.0.2')
@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.test import TransactionTestCase, override_settings
+
+from repoanalyze import llm
+from repoanalyze.benchmark import RepoSpec, make_repo
+
+
+GIT_ENV = {
+    'GIT_AUTHOR_NAME': 'Test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+    'GIT_COMMITTER_NAME': 'Test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+}
+
+
+def git(path: str, *args: str, env: dict = None) -> str:
+    return subprocess.run(['git', '-C', path, *args], capture_output=True, text=True, check=True,
+                          env={**os.environ, **GIT_ENV, **(env or {})}).stdout.strip()
+
+
+def add_commit(bare_repo: str, files: dict, message: str = 'Update') -> str:
+    """Commit files (path -> text) on top of a bare repository's main branch and return the SHA"""
+    work = tempfile.mkdtemp(prefix='repoanalyze-work-')
+    try:
+        git(work, 'clone', '--quiet', bare_repo, '.')
+        for rel_path, text in files.items():
+            os.makedirs(os.path.dirname(os.path.join(work, rel_path)), exist_ok=True)
+            with open(os.path.join(work, rel_path), 'w') as f:
+                f.write(text)
+        git(work, 'add', '--', *files)
+        git(work, 'commit', '--quiet', '-m', message)
+        git(work, 'push', '--quiet', 'origin', 'HEAD:main')
+        return git(work, 'rev-parse', 'HEAD')
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+class CacheDirMixin:
+    """Gives every test its own REPO_CACHE_DIR (and with it docs, job and model state)"""
+
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp(prefix='repoanalyze-test-')
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.cache_dir = os.path.join(self.root, 'cache')
+        overrides = override_settings(REPO_CACHE_DIR=self.cache_dir)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+
+@override_settings(DOCSTRINGS_ALLOW_FILE_URLS=True)
+class RepoTestCase(CacheDirMixin, TransactionTestCase):
+    """
+    Runs views against a synthetic repository served over file:// and the
+    stub model. The views hand work to other threads, so tests need real
+    commits rather than TestCase's transaction.
+    """
+    spec = RepoSpec(files=10, commits=5)
+
+    def setUp(self):
+        super().setUp()
+        self.repo_path = make_repo(self.root, self.spec)
+        self.repo_url = f"file://{self.repo_path}"
+        previous = llm.set_backend(llm.create_backend('stub', latency=0))
+        self.addCleanup(llm.set_backend, previous)
+
+    def post(self, client, url: str, body: dict, **extra):
+        return client.post(url, json.dumps(body), content_type='application/json', **extra)
@@ -0,0 +1,78 @@
+"""
+Blocking work for async views.
+
+Async views hand blocking calls (object reads, SQLite, model calls, file
+reads) to one thread pool per process, sized by ASYNC_WORKER_THREADS; git
+clones, fetches and logs run as asyncio subprocesses instead (see
+repo_cache.run_git), so they don't count against it. asyncio's
+default executor has min(32, CPUs + 4) threads, which on a small instance
+would cap a whole worker at a handful of concurrent requests. Calls keep
+the caller's context variables, so stage timings still reach the request.
+
+Streaming responses under ASGI need async iterators (Django buffers
+synchronous ones in full); aiter_in_thread() runs a blocking iterator one
+item at a time in the pool.
+
+The other way round, run_sync() lets blocking code (a pool thread, a job,
+a management command) drive a coroutine such as the repository sync.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+_lock = threading.Lock()
+_executor = None
+
+_DONE = object()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_WORKER_THREADS,
+                                           thread_name_prefix='repoanalyze')
+        return _executor
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Await func(*args, **kwargs) run in the worker pool"""
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), call)
+
+
+def run_sync(coro):
+    """Run a coroutine to completion on a new event loop; not for use from async code"""
+    return asyncio.run(coro)
+
+
+async def aiter_in_thread(iterable):
+    """
+    Async iterator over a blocking iterable, each step run in the worker pool.
+
+    Closing it (the client went away) closes a generator too, once a step
+    still running in the pool has finished.
+    """
+    iterator = iter(iterable)
+    context = contextvars.copy_context()
+    executor = get_executor()
+    step = None
+    try:
+        while True:
+            step = executor.submit(context.run, next, iterator, _DONE)
+            item = await asyncio.wrap_future(step)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            if step is None or step.done():
+                executor.submit(context.run, close)
+            else:
+                step.add_done_callback(lambda _: executor.submit(context.run, close))
@@ -5,11 +5,14 @@ from . import views
 urlpatterns = [
     path('get_dependencies/', views.get_dependencies, name='get_dependencies'),
     path('get_commit_history/', views.get_commit_history, name='get_commit_history'),
+    path('get_repository_analytics/', views.get_repository_analytics, name='get_repository_analytics'),
     path('get_files_from_repository/', views.get_files_from_repository, name='get_files_from_repository'),
     path('generate_doc_strings/', views.generate_doc_strings, name='generate_doc_strings'),
     path('genDocument_from_docstr/', views.genDocument_from_docstr, name='genDocument_from_docstr'),
     path('download_documentation/', views.download_documentation, name='download_documentation'),
-    path('remove_zip/', views.remove_zip, name='remove_zip'),
+    re_path(r'^download_documentation/(?P<build_id>[0-9a-f]{32})/$', views.download_build, name='download_build'),
+    # Background job status (submit with "async": true)
+    path('jobs/<uuid:job_id>/', views.job_status, name='job_status'),
     # Serve generated documentation
-    re_path(r'^docs/(?P<path>.*)$', views.serve_docs, name='serve_docs'),
+    re_path(r'^docs/(?P<build_id>[0-9a-f]{32})/(?P<path>.*)$', views.serve_docs, name='serve_docs'),
 ]
\ No newline at end of file